@@ -24,7 +24,7 @@ project = AwsCdkPythonApp(
     module_name="onnxacceleratorsampleone",
     name="onnxacceleratorsampleone",
     version="0.1.0",
-    context={"thing_name":"WindTurbine", "thing_group_name":"WindTurbines", "devices_logs_topic":"device/+/logs", "use_greengrass":False},
+    context={"thing_name":"WindTurbine", "thing_group_name":"WindTurbines", "devices_logs_topic":"device/+/logs", "use_greengrass":False, "quantization":"none", "quantization_min_agreement":0.99},
     pytest=False
 )
 
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+    Microbenchmark of the denoising of the prediction windows, at the
+    window size of the edge application (MIN_NUM_SAMPLES samples, one
+    prediction every STEP new samples per turbine):
+
+    - per feature: turbine.wavelet_denoise on each feature of each turbine
+    - per turbine: turbine.wavelet_denoise_batch on the window of each turbine
+    - stacked: one turbine.wavelet_denoise_batch call for the windows of all
+      the turbines, what Gateway.prepare_batch does
+
+        python3 benchmarks/bench_denoise.py --turbines 1 10 100
+'''
+import argparse
+import os
+import sys
+import time
+import warnings
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'edge_application'))
+import turbine
+from turbine.constants import MIN_NUM_SAMPLES, STEP, NUM_FEATURES
+
+WINDOW_SIZE = MIN_NUM_SAMPLES
+WAVELET = 'db6'
+
+def per_feature(windows, noise_sigmas):
+    return [np.array([turbine.wavelet_denoise(w[:, i], noise_sigmas[i], WAVELET) for i in range(w.shape[1])]).T for w in windows]
+
+def per_turbine(windows, noise_sigmas):
+    return [turbine.wavelet_denoise_batch(w, noise_sigmas, WAVELET) for w in windows]
+
+def stacked(windows, noise_sigmas):
+    return turbine.wavelet_denoise_batch(np.stack(windows), noise_sigmas, WAVELET, axis=1)
+
+def measure(func, stream, turbines, ticks, noise_sigmas):
+    '''
+        Seconds per tick: every turbine has STEP new samples
+    '''
+    start = time.perf_counter()
+    for tick in range(ticks):
+        position = tick * STEP
+        func([stream[position + t:position + t + WINDOW_SIZE] for t in range(turbines)], noise_sigmas)
+    return (time.perf_counter() - start) / ticks
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turbines', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--ticks', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    noise_sigmas = rng.uniform(0.1, 1.0, NUM_FEATURES)
+    stream = np.cumsum(rng.standard_normal((args.ticks * STEP + WINDOW_SIZE + max(args.turbines), NUM_FEATURES)), axis=0)
+    # the results are checked once, the paths must agree
+    windows = [stream[t:t + WINDOW_SIZE] for t in range(3)]
+    np.testing.assert_allclose(stacked(windows, noise_sigmas), per_feature(windows, noise_sigmas), atol=1e-9)
+    np.testing.assert_allclose(per_turbine(windows, noise_sigmas), per_feature(windows, noise_sigmas), atol=1e-9)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for turbines in args.turbines:
+            ticks = max(5, args.ticks // turbines)
+            results = [measure(func, stream, turbines, ticks, noise_sigmas) for func in (per_feature, per_turbine, stacked)]
+            print("%3d turbines: per feature %7.2f ms/tick, per turbine %7.2f ms/tick, stacked %7.2f ms/tick (%.2f ms per turbine)" %
+                ((turbines,) + tuple(r * 1000 for r in results) + (results[2] * 1000 / turbines,)))
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+    Microbenchmark of the turbine/raw payload parsing done in on_message.
+    Usage: python3 benchmarks/bench_parser.py [--iterations N]
+'''
+import argparse
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'edge_application'))
+import turbine
+from turbine.constants import FEATURES_IDX, NUM_RAW_FEATURES
+
+def make_payload(rng, num_samples):
+    lines = []
+    for _ in range(num_samples):
+        values = ['%d' % rng.integers(1e6, 1e7), '%d' % rng.integers(1e4, 1e5)] + ['%.6f' % v for v in rng.uniform(-1, 1, NUM_RAW_FEATURES - 2)]
+        lines.append(','.join(values))
+    return '\n'.join(lines).encode('utf-8')
+
+def legacy_parse(payload):
+    # what on_message did before TelemetryParser, one sample per message
+    tokens = np.array(payload.decode('utf8').split(','))
+    data = [float(tokens[i]) for i in FEATURES_IDX]
+    roll,pitch,yaw = turbine.euler_from_quaternion(data[0],data[1],data[2],data[3])
+    return np.array([roll,pitch,yaw, data[4], data[5], data[6]])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    telemetry_parser = turbine.TelemetryParser(FEATURES_IDX, NUM_RAW_FEATURES)
+
+    single = make_payload(rng, 1)
+    legacy = timeit.timeit(lambda: legacy_parse(single), number=args.iterations) / args.iterations
+    current = timeit.timeit(lambda: turbine.prepare_features(telemetry_parser.parse(single)[0]), number=args.iterations) / args.iterations
+    print("single sample:  legacy %.2f us/msg, parser %.2f us/msg (%.1fx)" % (legacy * 1e6, current * 1e6, legacy / current))
+
+    for batch_size in (10, 100):
+        batch = make_payload(rng, batch_size)
+        iterations = max(1, args.iterations // batch_size)
+        elapsed = timeit.timeit(lambda: turbine.prepare_features(telemetry_parser.parse(batch)[0]), number=iterations) / iterations
+        print("batch of %3d:   parser %.2f us/sample" % (batch_size, elapsed * 1e6 / batch_size))
+
+    # validation counters
+    telemetry_parser = turbine.TelemetryParser(FEATURES_IDX, NUM_RAW_FEATURES)
+    invalid = single.split(b',')
+    invalid[FEATURES_IDX[0]] = b'x'
+    telemetry_parser.parse(b'\n'.join([b'1,2,3', single, b','.join(invalid)]))
+    print("counters: parsed=%d wrong_length=%d invalid=%d" % (telemetry_parser.parsed, telemetry_parser.wrong_length, telemetry_parser.invalid))
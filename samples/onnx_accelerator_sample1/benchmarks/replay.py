@@ -0,0 +1,339 @@
+#!/usr/bin/python3
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+    Offline replay benchmark of the edge detection pipeline.
+
+    Replays dataset_wind.csv (or synthetic samples) for one or more turbines
+    through the same path as edge_application.py: ingest (on_message),
+    denoise + windows (preprocess), model run + scores (infer) and publish,
+    with a stub cloud connector and, by default, a small dummy ONNX model
+    generated locally. No broker nor cloud connection is needed.
+
+    The stages run one after the other on every tick, so their latencies
+    don't interfere. Results are printed and can be saved as JSON, to be
+    compared across commits:
+
+        python benchmarks/replay.py --turbines 20 --ticks 300 --output results.json
+'''
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import onnxruntime as ort
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'edge_application'))
+import turbine
+import edge_application as app
+
+STATISTICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'edge_application', 'statistics')
+RESULTS_VERSION = 1
+
+class StubCloudConnector(object):
+    '''
+        Same interface as turbine.CloudConnector. The messages are serialized
+        like the real ones, but only counted
+    '''
+    def __init__(self):
+        self.messages = {'inference': 0, 'logs': 0}
+        self.bytes = {'inference': 0, 'logs': 0}
+
+    def publish_inference(self, anomalies, values, model_name, model_version, ts, turbine_id=None):
+        message = {"ts": ts, "model_name": model_name, "model_version": model_version,
+            "anomalies": anomalies.tolist(), "values": values.tolist()}
+        if turbine_id is not None:
+            message["turbine_id"] = turbine_id
+        self.messages['inference'] += 1
+        self.bytes['inference'] += len(json.dumps(message))
+
+    def publish_logs(self, token):
+        self.messages['logs'] += 1
+        self.bytes['logs'] += len(json.dumps({"type": "rawdata", "data": token}))
+
+    def publish_raw_batch(self, payload):
+        self.messages['logs'] += 1
+        self.bytes['logs'] += len(payload)
+
+class Message(object):
+    '''
+        The fields of a paho MQTTMessage used by on_message
+    '''
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+def save_dummy_model(path, hidden=16):
+    '''
+        Small convolutional autoencoder with random weights, same input and
+        output as the exported model (dynamic batch axis)
+    '''
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+    rng = np.random.default_rng(0)
+    shape = ['batch', app.NUM_FEATURES, 10, 10]
+    weights = [
+        numpy_helper.from_array((rng.standard_normal((hidden, app.NUM_FEATURES, 3, 3)) * 0.1).astype(np.float32), 'encoder'),
+        numpy_helper.from_array((rng.standard_normal((hidden, app.NUM_FEATURES, 3, 3)) * 0.1).astype(np.float32), 'decoder')
+    ]
+    graph = helper.make_graph([
+            helper.make_node('Conv', ['input', 'encoder'], ['code'], pads=[1, 1, 1, 1]),
+            helper.make_node('Relu', ['code'], ['activation']),
+            helper.make_node('ConvTranspose', ['activation', 'decoder'], ['output'], pads=[1, 1, 1, 1])
+        ], 'dummy_autoencoder',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, shape)],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, shape)],
+        weights)
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)], ir_version=8), path)
+
+def read_dataset(path):
+    '''
+        Samples of dataset_wind.csv, with the columns in the order published
+        by the simulated device
+    '''
+    samples = []
+    with open(path, 'r') as f:
+        next(f) # header
+        for line in f:
+            reading = line.strip().split(',')[2:]
+            samples.append(reading[0:2] + [reading[3], reading[-1]] + reading[4:-1])
+    return np.array(samples, dtype=np.float64)
+
+def synthetic_samples(count, seed=0):
+    '''
+        Samples with the layout of the dataset: unit quaternions slowly
+        rotating, plus noisy speeds and voltage
+    '''
+    rng = np.random.default_rng(seed)
+    samples = rng.standard_normal((count, app.NUM_RAW_FEATURES))
+    angles = np.cumsum(rng.normal(0, 0.01, (count, 3)), axis=0)
+    half = angles / 2
+    cr, cp, cy = np.cos(half).T
+    sr, sp, sy = np.sin(half).T
+    # qx, qy, qz, qw columns (see FEATURES_IDX)
+    samples[:, 6] = sr * cp * cy - cr * sp * sy
+    samples[:, 7] = cr * sp * cy + sr * cp * sy
+    samples[:, 8] = cr * cp * sy - sr * sp * cy
+    samples[:, 5] = cr * cp * cy + sr * sp * sy
+    samples[:, 3] = 5 + rng.normal(0, 0.5, count) # wind speed
+    samples[:, 2] = 10 + rng.normal(0, 1, count) # rps
+    samples[:, 4] = 800 + rng.normal(0, 20, count) # voltage
+    return samples
+
+def encode(samples, wire_format):
+    if wire_format == 'binary':
+        return turbine.encode_binary(samples)
+    return '\n'.join(','.join(repr(float(v)) for v in sample) for sample in samples).encode('utf-8')
+
+def percentiles(times):
+    times = np.asarray(times) * 1000
+    if len(times) == 0:
+        return {'count': 0}
+    return {'count': len(times), 'mean_ms': float(times.mean()), 'p50_ms': float(np.percentile(times, 50)),
+        'p95_ms': float(np.percentile(times, 95)), 'p99_ms': float(np.percentile(times, 99)), 'max_ms': float(times.max())}
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except Exception:
+        return None
+
+def replay(samples, turbines=1, ticks=100, rate=app.STEP, batch_size=1, wire_format='csv', model_path=None,
+        session_params=None, catch_up_windows=40, dtype=np.float64, keep_scores=False, logs_batch_size=turbine.DEFAULT_MAX_SAMPLES,
+        cascade=False):
+    '''
+        Replay samples (N, NUM_RAW_FEATURES) for the turbines (each one starting
+        at a different offset), rate samples per turbine and tick, published by
+        micro-batches of batch_size samples, preprocessed in dtype. The raw samples
+        are published in batches of logs_batch_size samples (0: one by one), with the
+        first tier of the cascade if set. Returns the results dict, plus the scores
+        and anomaly flags of every window if keep_scores is set
+    '''
+    # the baked in statistics, unless the model comes with its bundle
+    statistics = turbine.load_statistics(STATISTICS_DIR, dtype)
+    cascade = turbine.Cascade(statistics.mean, statistics.std, statistics.thresholds) if cascade else None
+
+    # the globals used by on_message, like in the application
+    app.logs_q = turbine.BoundedQueue('logs', turbines * rate * 2, turbine.DROP_OLDEST)
+    app.gateway = turbine.Gateway(app.MIN_NUM_SAMPLES, app.NUM_FEATURES, statistics.raw_std, 'db6', max(turbines, 1), catch_up_windows,
+        cascade=cascade, dtype=dtype)
+    app.telemetry_parser = turbine.TelemetryParser(app.FEATURES_IDX, app.NUM_RAW_FEATURES, dtype=dtype)
+    gateway = app.gateway
+    connector = StubCloudConnector()
+    uplink = turbine.BatchPublisher(connector.publish_raw_batch, logs_batch_size) if logs_batch_size > 0 else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if model_path is None:
+            model_path = os.path.join(tmp, 'dummy.onnx')
+            save_dummy_model(model_path)
+        start = time.perf_counter()
+        holder = turbine.ModelHolder(lambda path: turbine.create_session(path, session_params),
+            np.zeros((1, app.NUM_FEATURES, 10, 10), dtype=np.float32),
+            runner_factory=lambda session: turbine.BoundRunner(session, max_batch=gateway.max_turbines + gateway.catch_up),
+            statistics_loader=lambda path: turbine.load_model_statistics(path, dtype))
+        if not holder.load(model_path, 'benchmark', '1'):
+            raise Exception('Unable to load %s' % model_path)
+        load_time = time.perf_counter() - start
+    # the stages of edge_application.py
+    stages = turbine.DetectionStages(holder, gateway, statistics, app.TIME_STEPS, app.STEP, cascade)
+
+    topics = ['turbine/raw'] if turbines == 1 else ['turbine/t%04d/raw' % i for i in range(turbines)]
+    offsets = [(i * 7919) % len(samples) for i in range(turbines)]
+    positions = list(offsets)
+
+    def ingest(count):
+        # one message per micro-batch, turbines interleaved like on a broker
+        times = []
+        for start in range(0, count, batch_size):
+            n = min(batch_size, count - start)
+            for i, topic in enumerate(topics):
+                idx = np.arange(positions[i], positions[i] + n) % len(samples)
+                positions[i] += n
+                msg = Message(topic, encode(samples[idx], wire_format))
+                t = time.perf_counter()
+                app.on_message(None, None, msg)
+                times.append(time.perf_counter() - t)
+        return times
+
+    scores, flags = [], []
+    def publish(results):
+        for result in results:
+            connector.publish_inference(*result)
+            if keep_scores:
+                flags.append(result[0])
+                scores.append(result[1])
+        while True:
+            token = app.logs_q.get(0)
+            if token is None:
+                break
+            if uplink is not None:
+                uplink.add(token)
+            else:
+                connector.publish_logs(token)
+
+    latencies = {'ingest': [], 'preprocess': [], 'infer': [], 'publish': [], 'tick': []}
+    cpu_time = 0
+    windows = 0
+    # fill the windows first, buffering is not measured
+    ingest(app.MIN_NUM_SAMPLES)
+    item = stages.preprocess()
+    if item is not None:
+        publish(stages.infer(item))
+    for tick in range(ticks):
+        tick_start, cpu_start = time.perf_counter(), time.process_time()
+        latencies['ingest'] += ingest(rate)
+        t = time.perf_counter()
+        item = stages.preprocess()
+        latencies['preprocess'].append(time.perf_counter() - t)
+        if item is None:
+            continue
+        t = time.perf_counter()
+        results = stages.infer(item)
+        latencies['infer'].append(time.perf_counter() - t)
+        # scored by the model or reused by the cascade
+        windows += len(results)
+        t = time.perf_counter()
+        publish(results)
+        latencies['publish'].append(time.perf_counter() - t)
+        latencies['tick'].append(time.perf_counter() - tick_start)
+        cpu_time += time.process_time() - cpu_start
+    if uplink is not None:
+        uplink.flush()
+
+    wall_time = sum(latencies['tick'])
+    num_samples = ticks * rate * turbines
+    results = {
+        'model_load_ms': load_time * 1000,
+        'stages': dict((name, percentiles(times)) for name, times in latencies.items()),
+        'throughput': {
+            'samples_per_s': num_samples / wall_time,
+            'windows_per_s': windows / wall_time,
+            # turbines one core can serve at one prediction per PREDICTIONS_INTERVAL
+            'turbines_per_core': turbines * ticks * app.PREDICTIONS_INTERVAL / cpu_time
+        },
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'gateway': gateway.stats(),
+        'runner': None if holder.get() is None else holder.get().runner.stats(),
+        'parser': {'parsed': app.telemetry_parser.parsed, 'malformed': app.telemetry_parser.malformed},
+        'published': {'messages': connector.messages, 'bytes': connector.bytes}
+    }
+    if keep_scores:
+        results['scores'] = np.array(scores)
+        results['anomalies'] = np.array(flags) > 0
+    return results
+
+def parity(samples, **kwargs):
+    '''
+        Replay the samples in float64 and float32. Returns the largest differences of the scores and the number
+        of windows with different anomaly flags
+    '''
+    kwargs['keep_scores'] = True
+    reference = replay(samples, dtype=np.float64, **kwargs)
+    result = replay(samples, dtype=np.float32, **kwargs)
+    diff = np.abs(result['scores'] - reference['scores'])
+    return {
+        'windows': len(diff),
+        'max_abs_diff': float(diff.max()),
+        'max_rel_diff': float((diff / np.maximum(np.abs(reference['scores']), 1e-12)).max()),
+        'flags_mismatch': int((result['anomalies'] != reference['anomalies']).any(axis=1).sum())
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline replay benchmark of the edge detection pipeline')
+    parser.add_argument('--data', type=str, default=None, help='dataset_wind.csv to replay, synthetic samples if not set')
+    parser.add_argument('--turbines', type=int, default=1, help='number of turbines (gateway mode if > 1)')
+    parser.add_argument('--ticks', type=int, default=100, help='number of predictions measured')
+    parser.add_argument('--rate', type=int, default=app.STEP, help='samples per turbine between two predictions')
+    parser.add_argument('--batch-size', type=int, default=1, help='samples per message')
+    parser.add_argument('--format', type=str, default='csv', choices=['csv', 'binary'], help='wire format of the messages')
+    parser.add_argument('--model', type=str, default=None, help='ONNX model, a small dummy model if not set')
+    parser.add_argument('--intra-op-threads', type=int, default=1, help='onnxruntime intra op threads, 0: default')
+    parser.add_argument('--graph-optimization-level', type=str, default='all', choices=list(turbine.GRAPH_OPTIMIZATION_LEVELS), help='onnxruntime graph optimization level')
+    parser.add_argument('--catch-up-windows', type=int, default=40, help='max windows of a turbine scored at once when lagging')
+    parser.add_argument('--logs-batch-size', type=int, default=turbine.DEFAULT_MAX_SAMPLES, help='raw samples per uplink message, 0: one message per sample')
+    parser.add_argument('--cascade', action='store_true', help='skip the model on the windows which did not change since its last run')
+    parser.add_argument('--dtype', type=str, default='float64', choices=['float64', 'float32'], help='precision of the preprocessing')
+    parser.add_argument('--parity', action='store_true', help='also compare the scores of the float32 and float64 preprocessing')
+    parser.add_argument('--output', type=str, default=None, help='JSON file where the results are saved')
+    parser.add_argument('--verbose', action='store_true', help='log the application messages')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    samples = synthetic_samples(100000) if args.data is None else read_dataset(args.data)
+    session_params = {'intra_op_num_threads': args.intra_op_threads, 'inter_op_num_threads': 1,
+        'graph_optimization_level': args.graph_optimization_level}
+    results = {
+        'version': RESULTS_VERSION,
+        'commit': git_commit(),
+        'environment': {'python': platform.python_version(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpus': os.cpu_count(), 'numpy': np.__version__, 'onnxruntime': ort.__version__},
+        'config': dict(vars(args), data=args.data or 'synthetic', model=args.model or 'dummy')
+    }
+    results.update(replay(samples, args.turbines, args.ticks, args.rate, args.batch_size, args.format, args.model,
+        session_params, args.catch_up_windows, np.dtype(args.dtype), logs_batch_size=args.logs_batch_size, cascade=args.cascade))
+    if args.parity:
+        results['parity'] = parity(samples, turbines=args.turbines, ticks=args.ticks, rate=args.rate, batch_size=args.batch_size,
+            wire_format=args.format, model_path=args.model, session_params=session_params, catch_up_windows=args.catch_up_windows)
+    print(json.dumps(results, indent=4))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
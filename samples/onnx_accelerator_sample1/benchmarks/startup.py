@@ -0,0 +1,126 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+    Startup benchmark of the edge application: import time and time to the
+    first inference, in fresh interpreters like a restart of the detector
+    (Greengrass restarts it on each deployment and configuration change).
+
+    Each run starts a new python process which imports the application,
+    loads the model (onnxruntime session + warm up) and scores a first
+    window, already buffered. The medians of the phases are printed and
+    can be saved as JSON, with the slowest imports:
+
+        python benchmarks/startup.py --runs 10 --output startup.json
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'edge_application')
+RESULTS_VERSION = 1
+
+def child(model_path):
+    '''
+        Phases of a start, in ms since the beginning of this function (the
+        interpreter startup is measured by the parent)
+    '''
+    start = time.perf_counter()
+    sys.path.insert(0, APP_DIR)
+    import numpy as np
+    import edge_application as app
+    import turbine
+    phases = {'import_ms': (time.perf_counter() - start) * 1000}
+
+    statistics = {n: np.load(os.path.join(APP_DIR, 'statistics', '%s.npy' % n)) for n in ['raw_std', 'mean', 'std']}
+    gateway = turbine.Gateway(app.MIN_NUM_SAMPLES, app.NUM_FEATURES, statistics['raw_std'])
+    holder = turbine.ModelHolder(turbine.create_session, np.zeros((1, app.NUM_FEATURES, 10, 10), dtype=np.float32),
+        runner_factory=lambda session: turbine.BoundRunner(session, max_batch=1))
+    if not holder.load(model_path, 'startup', '1'):
+        raise Exception('Unable to load %s' % model_path)
+    phases['model_loaded_ms'] = (time.perf_counter() - start) * 1000
+
+    gateway.extend(None, np.random.default_rng(0).normal(statistics['mean'], statistics['std'], (app.MIN_NUM_SAMPLES, app.NUM_FEATURES)))
+    model = holder.get()
+    buffers = model.runner.acquire()
+    ids, times, x = gateway.prepare_batch(app.TIME_STEPS, app.STEP, statistics['mean'], statistics['std'], out=buffers.input)
+    model.runner.run(buffers, len(ids))
+    model.runner.release(buffers)
+    phases['first_inference_ms'] = (time.perf_counter() - start) * 1000
+    phases['modules'] = len(sys.modules)
+    return phases
+
+def run_child(model_path, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [os.path.abspath(__file__), '--child', model_path]
+    start = time.perf_counter()
+    process = subprocess.run(command, capture_output=True, text=True, check=True)
+    phases = json.loads(process.stdout)
+    phases['process_ms'] = (time.perf_counter() - start) * 1000
+    return phases, process.stderr
+
+def slowest_imports(importtime_log, count):
+    '''
+        Top level imports (cumulative time) of a -X importtime log
+    '''
+    imports = []
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # top level: the module name isn't indented
+        if not name.startswith('  '):
+            imports.append((name.strip(), int(cumulative) / 1000))
+    imports.sort(key=lambda i: i[1], reverse=True)
+    return [{'module': name, 'ms': ms} for name, ms in imports[:count]]
+
+def startup(runs=5, model_path=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        if model_path is None:
+            sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+            import replay
+            model_path = os.path.join(tmp, 'dummy.onnx')
+            replay.save_dummy_model(model_path)
+        # the first run warms up the OS file cache
+        run_child(model_path)
+        results = [run_child(model_path)[0] for _ in range(runs)]
+        _, log = run_child(model_path, importtime=True)
+    phases = {k: median([r[k] for r in results]) for k in results[0]}
+    return {'median': phases, 'slowest_imports': slowest_imports(log, 10)}
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--child':
+        print(json.dumps(child(sys.argv[2])))
+        sys.exit(0)
+    parser = argparse.ArgumentParser(description='Startup benchmark of the edge application')
+    parser.add_argument('--runs', type=int, default=5, help='number of starts measured')
+    parser.add_argument('--model', type=str, default=None, help='ONNX model, a small dummy model if not set')
+    parser.add_argument('--output', type=str, default=None, help='JSON file where the results are saved')
+    args = parser.parse_args()
+
+    results = {
+        'version': RESULTS_VERSION,
+        'environment': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'config': dict(vars(args), model=args.model or 'dummy')
+    }
+    results.update(startup(args.runs, args.model))
+    print(json.dumps(results, indent=4))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
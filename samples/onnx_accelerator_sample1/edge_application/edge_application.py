@@ -20,70 +20,107 @@ import paho.mqtt.client as mqtt
 import json
 import numpy as np
 import turbine
-from queue import Queue
-import onnxruntime as ort
 from datetime import datetime
 
-# buffer size required to process timeseries data
+# windows and features of the model, shared with turbine.backfill
+from turbine.constants import MIN_NUM_SAMPLES, TIME_STEPS, STEP, FEATURES_IDX, NUM_RAW_FEATURES, NUM_FEATURES
+
 PREDICTIONS_INTERVAL = 1.0 # interval in seconds between the predictions
-MIN_NUM_SAMPLES = 500         
-INTERVAL = 5 # seconds
-TIME_STEPS = 20 * INTERVAL
-STEP = 10
-FEATURES_IDX = [6,7,8,5,  3, 2, 4] # qX,qy,qz,qw  ,wind_seed_rps, rps, voltage 
-NUM_RAW_FEATURES = 20
-NUM_FEATURES = 6
+STATS_INTERVAL = 60 # number of predictions between two pipeline stats logs
+RAW_TOPIC = 'turbine/raw'
+GATEWAY_RAW_TOPIC = 'turbine/+/raw' # turbine/<turbine_id>/raw
 
 connected = False
 
-q=Queue()
-tokens_q = Queue()
+raw_topic = RAW_TOPIC
+gateway = None # windows of the turbines, created with the statistics
+logs_q = None # raw data to be published, created with the pipeline
+telemetry_parser = None # created with the metrics
 
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("Connected to broker for raw data acquisition")
         client.connected_flag=True
-        client.subscribe('turbine/raw')         
+        client.subscribe(raw_topic)
+        # let the devices know which wire formats we accept (see turbine.telemetry)
+        client.publish(turbine.WIRE_FORMATS_TOPIC, turbine.SUPPORTED_WIRE_FORMATS, retain=True)
     else:
         print("Connection failed")
 
 def on_message(client, userdata, msg):
-    data = msg.payload.decode('utf8')
-    try:
-        tokens = np.array(data.split(','))
-        # check if the format is correct
-        if len(tokens) != NUM_RAW_FEATURES:
-            print(data)
-            logging.error('Wrong # of features. Expected: %d, Got: %d' % ( NUM_RAW_FEATURES, len(tokens)))
-            return
-        # add noise to raw data randomly
-        if np.random.randint(50) == 0:
-            print("adding noise to radians")
-            tokens[FEATURES_IDX[0:4]] = np.random.rand(4) * 10 # out of the radians range
-        if np.random.randint(20) == 0:
-            print("adding noise to wind")
-            tokens[FEATURES_IDX[5]] = np.random.rand(1)[0] * 10 # out of the normalized wind range
-        if np.random.randint(50) == 0:
-            print("adding noise to voltage")
-            tokens[FEATURES_IDX[6]] = int(np.random.rand(1)[0] * 1000) # out of the normalized voltage range
-    except Exception as e:
-        logging.error(e)
-        logging.error(data)
+    # the payload can carry a micro-batch of samples, one per line.
+    # raw contains only the used features, in the FEATURES_IDX order
+    raw, rows = telemetry_parser.parse(msg.payload)
+    if len(rows) == 0:
+        return
+    # None in single turbine mode
+    turbine_id = turbine.turbine_id_from_topic(msg.topic)
+    # the samples of a micro-batch arrive together. Anomalies for the tests are
+    # injected upstream, by the scenarios of the simulated device
     ts = "%s+00:00" % datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
-    tokens_q.put({'ts': ts, 'values': tokens.tolist()})
-    # get only the used features
-    data = [float(tokens[i]) for i in FEATURES_IDX]
-    # compute the euler angles from the quaternion
-    roll,pitch,yaw = turbine.euler_from_quaternion(data[0],data[1],data[2],data[3])
-    data = np.array([roll,pitch,yaw, data[4], data[5], data[6]])
-    #logging.info("Adding data to samples: %s", data)
-    q.put(data)
+    for fields in rows:
+        token = {'ts': ts, 'values': fields}
+        if turbine_id is not None:
+            token['turbine_id'] = turbine_id
+        logs_q.put(token)
+    # compute the euler angles from the quaternions of the whole micro-batch
+    gateway.extend(turbine_id, turbine.prepare_features(raw))
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO )
 
     # load the json file containing configuration
     iot_params = json.loads(open("config.json", 'r').read())
+    metrics_params = iot_params.get('metrics', {})
+    metrics_port = metrics_params.get('port', turbine.METRICS_PORT)
+    metrics_host = metrics_params.get('host', '127.0.0.1')
+    metrics_summary = metrics_params.get('summary', False)
+    # precision of the samples, denoising, normalization and scores. float32 halves
+    # the memory traffic, the model input is float32 anyway
+    dtype = np.dtype(iot_params.get('dtype', 'float64'))
+
+    # latency histograms, queue depths and drop counters of the application,
+    # served in the Prometheus text format (on localhost by default)
+    metrics = turbine.Metrics()
+    metrics_server = None
+    if metrics_port:
+        try:
+            metrics_server = turbine.MetricsServer(metrics, metrics_port, metrics_host)
+            metrics_server.start()
+        except OSError as e:
+            logging.error('Unable to serve the metrics on port %d: %s' % (metrics_port, e))
+            metrics_server = None
+    telemetry_parser = turbine.TelemetryParser(FEATURES_IDX, NUM_RAW_FEATURES, metrics, dtype)
+
+    # stages: ingest (mqtt callback) -> preprocess -> infer -> publish
+    # connected by bounded queues, so a slow uplink can't delay the inference
+    pipeline = turbine.Pipeline(metrics)
+    logs_q = pipeline.queue('logs', iot_params.get('logs_queue_size', 1000), iot_params.get('logs_overflow', turbine.DROP_OLDEST))
+    # the scheduler tick is skipped if the previous one is still being processed
+    ticks_q = pipeline.queue('ticks', 1, turbine.DROP_NEWEST)
+    # the model always gets the most recent window. A dropped batch gives its buffers back
+    inputs_q = pipeline.queue('inputs', 1, turbine.DROP_OLDEST, on_drop=lambda item: item[0].runner.release(item[1]))
+    # summaries of the metrics published in the logs stream, if enabled
+    metrics_q = pipeline.queue('metrics', 1, turbine.DROP_OLDEST) if metrics_summary else None
+    results_q = pipeline.queue('results', iot_params.get('results_queue_size', 100), iot_params.get('results_overflow', turbine.DROP_OLDEST))
+
+    # Some constants used for data prep + compare the results
+    # baked in the application, for the models delivered without their own statistics
+    statistics = turbine.load_statistics('statistics', dtype)
+    thresholds, raw_std, mean, std = statistics.thresholds, statistics.raw_std, statistics.mean, statistics.std
+
+    # gateway mode: one process serves several turbines, each one with its own window
+    # In single turbine mode the gateway holds just one turbine
+    if iot_params.get('gateway', False):
+        raw_topic = GATEWAY_RAW_TOPIC
+    # when the predictions fall behind, the windows of the backlog are scored in a single run
+    # optional first tier: the windows which didn't change since the last model run of their turbine reuse its scores
+    cascade = None
+    cascade_params = iot_params.get('cascade', {})
+    if cascade_params.get('enabled', False):
+        cascade = turbine.Cascade(mean, std, thresholds, cascade_params.get('z_limit', 3.0), cascade_params.get('change_limit', 0.25),
+            cascade_params.get('margin', 0.5), cascade_params.get('max_skips', 10), metrics=metrics)
+    gateway = turbine.Gateway(MIN_NUM_SAMPLES, NUM_FEATURES, raw_std, 'db6', iot_params.get('max_turbines', 100), iot_params.get('catch_up_windows', 40), metrics=metrics, cascade=cascade, dtype=dtype)
 
     # Connect to the broker to acquire simulated data
     logging.info("Connecting to MQTT broker...")
@@ -91,6 +128,8 @@ if __name__ == '__main__':
     client.connected_flag=False
     client.on_connect = on_connect
     client.on_message = on_message
+    # clear the advertised wire formats if we disconnect unexpectedly
+    client.will_set(turbine.WIRE_FORMATS_TOPIC, b'', retain=True)
     client.loop_start()
     client.connect(iot_params['broker'], iot_params['port'])
     while not client.connected_flag: #wait in loop
@@ -99,102 +138,97 @@ if __name__ == '__main__':
     logging.info("Connected")
 
     ## Initialize the OTA Model Manager
-    model_loaded = False
-    model_name = None
-    model_version = None
     model_path = '.'
-    sess = None
-
-    def model_update_callback(name, version):
-        global model_loaded, model_version, model_name, sess
-        if name is not None and version is not None:
-            if name is not model_name and model_version is not version:
-                model_version=str(version)
-                model_name = name
-                logging.info('New model deployed: %s - %s' % (name, version))
-                if sess is not None:
-                    del sess
-                sess = ort.InferenceSession(name+".onnx")
-            else:
-                logging.info("Job update failed - keeping current model running")
-            model_loaded = True
+    # the current model keeps serving while a new one is loaded and warmed up
+    holder = turbine.ModelHolder(lambda path: turbine.create_session(path, iot_params.get('session')),
+        np.zeros((1, NUM_FEATURES, 10, 10), dtype=np.float32),
+        # IO binding on buffers sized for the windows of all the turbines
+        runner_factory=lambda session: turbine.BoundRunner(session, max_batch=gateway.max_turbines + gateway.catch_up, metrics=metrics),
+        metrics=metrics,
+        # the statistics bundle shipped with the model (memory mapped), checked against it
+        statistics_loader=lambda path: turbine.load_model_statistics(path, dtype))
+
+    def model_update_callback(name, version, model_file=None):
+        # called by the jobs thread, so the load doesn't block the inference.
+        # model_file: the downloaded model, renamed to name.onnx by the jobs thread once it is loaded
+        if name is None or version is None:
+            return False
+        current = holder.get()
+        if current is not None and current.name == name and current.version == str(version):
+            logging.info("Job update failed - keeping current model running")
+            return True
+        logging.info('New model deployed: %s - %s' % (name, version))
+        return holder.load(model_file or name+".onnx", name, str(version))
 
     def starting_model_update_callback():
-        global model_loaded, sess
-        logging.info("Starting a new model update, stopping current inference session")
-        
-        model_loaded = False
+        logging.info("Starting a new model update, the current model keeps running")
 
     cloud_connector = turbine.CloudConnector(iot_params, starting_model_update_callback, model_update_callback, model_path)
     
-    # Some constants used for data prep + compare the results
-    thresholds = np.load('statistics/thresholds.npy')
-    raw_std = np.load('statistics/raw_std.npy')
-    mean = np.load('statistics/mean.npy')
-    std = np.load('statistics/std.npy')
-    
-    try:
-        while True:
-
-            cloud_connector.publish_logs(tokens_q.get())
+    # preprocess and infer, shared with the replay benchmark
+    stages = turbine.DetectionStages(holder, gateway, statistics, TIME_STEPS, STEP, cascade)
+
+    def publish_inference(results):
+        # publish data to visualize in dashboard, one message per window
+        for result in results:
+            cloud_connector.publish_inference(*result)
+
+    pipeline.stage('preprocess', stages.preprocess, ticks_q, inputs_q)
+    pipeline.stage('infer', stages.infer, inputs_q, results_q)
+    pipeline.stage('publish_inference', publish_inference, results_q)
+    # the raw samples are sent in compressed batches of up to logs_batch_size samples, at least
+    # every logs_batch_ms: one IoT message and one Lambda run per batch. 0: one message per sample
+    uplink = None
+    logs_batch_size = iot_params.get('logs_batch_size', turbine.DEFAULT_MAX_SAMPLES)
+    if logs_batch_size > 0:
+        uplink = turbine.BatchPublisher(cloud_connector.publish_raw_batch, logs_batch_size, iot_params.get('logs_batch_ms', 1000) / 1000, metrics=metrics)
+        pipeline.stage('publish_logs', uplink.add, logs_q, idle=uplink.poll, idle_interval=uplink.max_delay / 4)
+    else:
+        pipeline.stage('publish_logs', cloud_connector.publish_logs, logs_q)
+    if metrics_q is not None:
+        pipeline.stage('publish_metrics', cloud_connector.publish_metrics, metrics_q)
+    pipeline.start()
 
-            if not model_loaded:
-                logging.info("Waiting for the model...")
-                time.sleep(5)
+    # the inference is driven by deadlines, not by the incoming data
+    scheduler = turbine.DeadlineScheduler(PREDICTIONS_INTERVAL, metrics=metrics)
+    try:
+        while scheduler.wait():
+            if not holder.ready:
+                if scheduler.ticks % 5 == 0:
+                    logging.info("Waiting for the model...")
                 continue
-
-            if q.qsize() <= MIN_NUM_SAMPLES:
-                if q.qsize() % 10 == 0:
-                    logging.info('Buffering %d/%d... please wait' % (q.qsize(), MIN_NUM_SAMPLES))
-                    time.sleep(1)
-                # buffering
+            if len(gateway) == 0:
+                logging.info('Waiting for data...')
                 continue
-
-            # prep the data for the model
-            li = list(q.queue)
-            data = np.array(li) # create a copy
-            q.get() # remove the oldest sample            
-            data = np.array([turbine.wavelet_denoise(data[:,i], raw_std[i], 'db6') for i in range(NUM_FEATURES)])
-            data = data.transpose((1,0))
-            data -= mean
-            data /= std
-            data = data[-(TIME_STEPS+STEP):]
-
-            x = turbine.create_dataset(data, TIME_STEPS, STEP)
-            x = np.transpose(x, (0, 2, 1)).reshape(x.shape[0], NUM_FEATURES, 10, 10).astype(np.float32)
-
-            # Now we can run our model using the loaded data
-            # The run command lets you specify which outputs you want to get returned. it only has one output.
-            ptemp = sess.run(None, {"input": x})
-
-            # We are converting the prediction output to a numpy array so that we can convert it into
-            # something human readable
-            p = np.asarray(ptemp[0])
-
-            a = x.reshape(x.shape[0], NUM_FEATURES, 100).transpose((0,2,1))
-            b = p.reshape(p.shape[0], NUM_FEATURES, 100).transpose((0,2,1))
-            
-            # check the anomalies
-            pred_mae_loss = np.mean(np.abs(b - a), axis=1).transpose((1,0))
-            values = np.mean(pred_mae_loss, axis=1)
-            anomalies = (values > thresholds)
-            
-            # publish data to visualize in dashboard
-            ts = "%s+00:00" % datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
-            cloud_connector.publish_inference(anomalies.astype(np.float32), values.astype(np.float32), model_name, model_version, ts)
-
-            if anomalies.any():
-                logging.info("Anomaly detected: %s" % anomalies)
-            else:
-                logging.info("Ok")
-
-            time.sleep(PREDICTIONS_INTERVAL)
+            for turbine_id, num_samples in gateway.buffering().items():
+                logging.info('Buffering %s%d/%d... please wait' % ('' if turbine_id is None else turbine_id + ' ', num_samples, MIN_NUM_SAMPLES))
+            ticks_q.put(scheduler.deadline)
+            if scheduler.ticks % STATS_INTERVAL == 0:
+                stats = pipeline.stats()
+                stats['scheduler'] = scheduler.stats()
+                stats['gateway'] = gateway.stats()
+                stats['model'] = holder.stats()
+                model = holder.get()
+                if model is not None:
+                    stats['runner'] = model.runner.stats()
+                stats['parser'] = {'parsed': telemetry_parser.parsed, 'malformed': telemetry_parser.malformed}
+                if uplink is not None:
+                    stats['uplink'] = uplink.stats()
+                logging.info("Pipeline stats: %s" % json.dumps(stats))
+                if metrics_q is not None:
+                    metrics_q.put(metrics.summary())
     except KeyboardInterrupt as e:
         pass
     except Exception as e:
         logging.error(e)
 
     logging.info("Shutting down")
+    pipeline.stop(5)
+    if uplink is not None:
+        uplink.flush() # the samples of the last batch
+    if metrics_server is not None:
+        metrics_server.stop()
+    client.publish(turbine.WIRE_FORMATS_TOPIC, b'', retain=True).wait_for_publish(1)
     client.loop_stop()
     client.disconnect()
     cloud_connector.exit("Done")
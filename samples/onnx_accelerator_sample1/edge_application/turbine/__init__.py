@@ -12,5 +12,41 @@
 # COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
-from turbine.util import *
-from turbine.cloud import CloudConnector
\ No newline at end of file
+import importlib
+
+# The submodules are imported on the first use of one of their names (PEP 562),
+# so importing turbine doesn't load onnxruntime, pywt, the http server or the
+# AWS SDKs until the feature that needs them runs
+_EXPORTS = {
+    'turbine.constants': ['MIN_NUM_SAMPLES', 'INTERVAL', 'TIME_STEPS', 'STEP', 'FEATURES_IDX', 'NUM_RAW_FEATURES', 'NUM_FEATURES'],
+    'turbine.util': ['euler_from_quaternion', 'euler_from_quaternion_batch', 'prepare_features', 'wavelet_denoise',
+        'soft_threshold', 'wavelet_denoise_batch', 'denoise_windows', 'create_dataset', 'create_model_input'],
+    'turbine.buffer': ['RingBuffer'],
+    'turbine.telemetry': ['TelemetryParser', 'encode_binary', 'WIRE_FORMATS_TOPIC', 'SUPPORTED_WIRE_FORMATS'],
+    'turbine.pipeline': ['Pipeline', 'BoundedQueue', 'Stage', 'DeadlineScheduler', 'BLOCK', 'DROP_OLDEST', 'DROP_NEWEST', 'OVERFLOW_POLICIES'],
+    'turbine.gateway': ['Gateway', 'turbine_id_from_topic'],
+    'turbine.cascade': ['Cascade'],
+    'turbine.stages': ['DetectionStages', 'timestamp'],
+    'turbine.session': ['create_session', 'session_options', 'SESSION_DEFAULTS', 'EXECUTION_MODES', 'GRAPH_OPTIMIZATION_LEVELS'],
+    'turbine.model': ['ModelHolder', 'Model'],
+    'turbine.statistics': ['Statistics', 'load_statistics', 'load_bundle', 'save_bundle', 'bundle_path', 'load_model_statistics', 'STATISTICS_NAMES'],
+    'turbine.binding': ['BoundRunner', 'IOBuffers'],
+    'turbine.metrics': ['Metrics', 'MetricsServer', 'Histogram', 'METRICS_PORT'],
+    'turbine.uplink': ['BatchPublisher', 'encode_batch', 'encode_batches', 'decode_batch', 'RAW_BATCH_TYPE',
+        'DEFAULT_MAX_SAMPLES', 'DEFAULT_MAX_DELAY'],
+    'turbine.cloud': ['CloudConnector']
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+__all__ = list(_MODULES)
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError("module 'turbine' has no attribute '%s'" % name)
+    value = getattr(importlib.import_module(module), name)
+    # the next lookups don't go through __getattr__
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,119 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import time
+from queue import Queue, Empty
+import numpy as np
+import onnxruntime as ort
+
+ORT_DTYPES = {
+    'tensor(float)': np.float32,
+    'tensor(double)': np.float64,
+    'tensor(int64)': np.int64,
+    'tensor(bool)': np.bool_
+}
+
+class IOBuffers(object):
+    '''
+        Input and output arrays of a BoundRunner, plus the IO bindings of
+        each batch size run on them
+    '''
+    def __init__(self, input_shape, input_dtype, output_shapes, output_dtypes):
+        self.input = np.zeros(input_shape, dtype=input_dtype)
+        self.outputs = [np.zeros(s, dtype=d) for s, d in zip(output_shapes, output_dtypes)]
+        self.bindings = {}
+
+class BoundRunner(object):
+    '''
+        Runs a session with IO binding on preallocated buffers, sized from
+        the declared shapes of the model (max_batch for a dynamic batch
+        axis). onnxruntime reads the input and writes the outputs in place,
+        so there are no allocations in the steady state.
+        The callers fill the input of a set of buffers taken with acquire()
+        and give it back with release(): with num_buffers sets, the input of
+        the next batch can be prepared while the model runs
+    '''
+    def __init__(self, session, max_batch=1, num_buffers=2, metrics=None):
+        self.session = session
+        model_input = session.get_inputs()[0]
+        model_outputs = session.get_outputs()
+        self.input_name = model_input.name
+        self.output_names = [o.name for o in model_outputs]
+        # models exported with a fixed batch size are run on chunks of that size
+        batch_size = model_input.shape[0]
+        self.batch_size = batch_size if isinstance(batch_size, int) else None
+        if self.batch_size is None:
+            self.capacity = max_batch
+        else:
+            self.capacity = -(-max_batch // self.batch_size) * self.batch_size
+        input_shape = self.shape(model_input)
+        output_shapes = [self.shape(o) for o in model_outputs]
+        self.free = Queue()
+        for i in range(num_buffers):
+            self.free.put(IOBuffers(input_shape, ORT_DTYPES[model_input.type], output_shapes, [ORT_DTYPES[o.type] for o in model_outputs]))
+        self.runs = 0
+        self.busy = 0 # acquire() calls with no free buffers
+        self.run_time = None if metrics is None else metrics.histogram('session_run_seconds', 'Model runs on a batch of windows')
+
+    def shape(self, node):
+        for d in node.shape[1:]:
+            if not isinstance(d, int):
+                raise ValueError('Only the batch axis can be dynamic: %s %s' % (node.name, node.shape))
+        return tuple([self.capacity] + node.shape[1:])
+
+    def acquire(self):
+        '''
+            A free set of buffers, None if all of them are in use
+        '''
+        try:
+            return self.free.get_nowait()
+        except Empty:
+            self.busy += 1
+            return None
+
+    def release(self, buffers):
+        self.free.put(buffers)
+
+    def bind(self, buffers, n):
+        chunk = n if self.batch_size is None else self.batch_size
+        bindings = []
+        for i in range(0, n, chunk):
+            binding = self.session.io_binding()
+            binding.bind_ortvalue_input(self.input_name, ort.OrtValue.ortvalue_from_numpy(buffers.input[i:i+chunk]))
+            for name, output in zip(self.output_names, buffers.outputs):
+                binding.bind_ortvalue_output(name, ort.OrtValue.ortvalue_from_numpy(output[i:i+chunk]))
+            bindings.append(binding)
+        return bindings
+
+    def run(self, buffers, n):
+        '''
+            Run the model on the first n rows of buffers.input. Returns views
+            of the first n rows of the outputs, valid until the buffers are
+            released
+        '''
+        if n > self.capacity:
+            raise ValueError('Batch too large: %d > %d' % (n, self.capacity))
+        bindings = buffers.bindings.get(n)
+        if bindings is None:
+            bindings = buffers.bindings[n] = self.bind(buffers, n)
+        start = time.perf_counter()
+        for binding in bindings:
+            self.session.run_with_iobinding(binding)
+        if self.run_time is not None:
+            self.run_time.observe(time.perf_counter() - start)
+        self.runs += len(bindings)
+        return [o[:n] for o in buffers.outputs]
+
+    def stats(self):
+        return {'runs': self.runs, 'busy': self.busy, 'capacity': self.capacity}
@@ -0,0 +1,103 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import threading
+import numpy as np
+
+class Cascade(object):
+    '''
+        Cheap first tier in front of the model: decides, on the latest raw
+        samples of a turbine, if its window needs to be denoised and scored
+        again, or if the scores of its last model run still hold.
+
+        A window is skipped only when all of these are true:
+          - its mean is within z_limit training stds of the training mean
+            (per feature, against mean.npy/std.npy)
+          - its mean and std, and the mean of its latest step samples, moved
+            less than change_limit training stds since the last window scored
+            by the model (change point, a step isn't diluted in the window)
+          - the last scores were below margin * thresholds, so a window
+            close to an anomaly is always scored
+          - less than max_skips windows were skipped in a row
+    '''
+    def __init__(self, mean, std, thresholds, z_limit=3.0, change_limit=0.25, margin=0.5, max_skips=10, metrics=None):
+        self.mean = np.asarray(mean)
+        self.std = np.asarray(std)
+        self.thresholds = np.asarray(thresholds)
+        self.z_limit = z_limit
+        self.change_limit = change_limit
+        self.margin = margin
+        self.max_skips = max_skips
+        self.lock = threading.Lock()
+        self.references = {} # turbine id -> [mean, std, scores, skips] of the last window scored
+        self.candidates = {} # turbine id -> (mean, std) of the window being scored
+        self.checked = 0
+        self.skipped = 0
+        if metrics is not None:
+            metrics.counter('cascade_windows_checked_total', 'Windows checked by the first tier of the cascade', lambda: self.checked)
+            metrics.counter('cascade_windows_skipped_total', 'Windows not scored by the model, the last scores were reused', lambda: self.skipped)
+            metrics.gauge('cascade_skip_ratio', 'Ratio of the checked windows not scored by the model', self.skip_ratio)
+
+    def set_statistics(self, mean, std, thresholds):
+        '''
+            Statistics of a new model: the scores of the previous one can't
+            be reused
+        '''
+        if thresholds is self.thresholds:
+            return
+        with self.lock:
+            self.mean, self.std, self.thresholds = np.asarray(mean), np.asarray(std), np.asarray(thresholds)
+            self.references.clear()
+            self.candidates.clear()
+
+    def skip_ratio(self):
+        return self.skipped / self.checked if self.checked > 0 else 0.0
+
+    def check(self, turbine_id, samples, step):
+        '''
+            samples: latest (time_steps, F) raw samples of a turbine, step
+            of them are new. Returns the scores to reuse, None if the model
+            must run
+        '''
+        window_mean = samples.mean(axis=0)
+        window_std = samples.std(axis=0)
+        recent_mean = samples[-step:].mean(axis=0)
+        self.checked += 1
+        with self.lock:
+            reference = self.references.get(turbine_id)
+            if reference is not None and reference[3] < self.max_skips and \
+                    (np.abs(window_mean - self.mean) <= self.z_limit * self.std).all() and \
+                    (np.abs(window_mean - reference[0]) <= self.change_limit * self.std).all() and \
+                    (np.abs(recent_mean - reference[0]) <= self.change_limit * self.std).all() and \
+                    (np.abs(window_std - reference[1]) <= self.change_limit * self.std).all() and \
+                    (reference[2] < self.margin * self.thresholds).all():
+                reference[3] += 1
+                self.skipped += 1
+                return reference[2]
+            self.candidates[turbine_id] = (window_mean, window_std)
+        return None
+
+    def update(self, ids, scores):
+        '''
+            Scores of the windows run by the model. The ones checked by the
+            first tier become the reference of their turbine
+        '''
+        with self.lock:
+            for turbine_id, s in zip(ids, scores):
+                candidate = self.candidates.pop(turbine_id, None)
+                if candidate is not None:
+                    self.references[turbine_id] = [candidate[0], candidate[1], np.array(s, dtype=np.float32), 0]
+
+    def stats(self):
+        return {'checked': self.checked, 'skipped': self.skipped}
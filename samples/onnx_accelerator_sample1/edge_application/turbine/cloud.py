@@ -21,9 +21,9 @@ import threading
 import time
 import traceback
 import time
-import requests
 from uuid import uuid4
 import json
+import os
 
 class LockedData:
     def __init__(self):
@@ -333,25 +333,44 @@ class CloudConnector(object):
                     publish_future.add_done_callback(self.on_publish_update_job_execution)
                     return
 
-            deployment_package_path = job_document['deployment_artifact_path']
-
-            # download artifacts
+            # download artifacts (requests is only loaded for the model updates)
+            import requests
             print("Downloading new model...")
-            r = requests.get(deployment_package_path)
-            with open ('/home/awsab3ak/edge_application/'+model_name+'.onnx', 'wb') as f:
-                f.write(r.content)
-            
-            self.model_version = model_version
-            self.model_name = model_name
+            # the files are downloaded under temporary names, next to the current ones, and only
+            # renamed into place once the application loaded them: a model it rejects leaves the
+            # current files untouched. The .ort and .stats files follow the name of the .onnx one
+            model_dir = '/home/awsab3ak/edge_application/'
+            artifacts = {'.onnx': 'deployment_artifact_path', '.ort': 'deployment_ort_artifact_path',
+                '.stats': 'deployment_statistics_artifact_path'}
+            for extension, key in artifacts.items():
+                if key in job_document:
+                    r = requests.get(job_document[key])
+                    with open(model_dir + model_name + '.download' + extension, 'wb') as f:
+                        f.write(r.content)
 
             print("Done working on job.")
-            self.update_callback(self.model_name, self.model_version) 
-
-            print("Publishing request to update job status to SUCCEEDED...")
+            # the application rejects a model that can't be loaded and keeps the current one
+            status = iotjobs.JobStatus.SUCCEEDED
+            if self.update_callback(model_name, model_version, model_dir + model_name + '.download.onnx') is False:
+                status = iotjobs.JobStatus.FAILED
+                for extension in artifacts:
+                    if os.path.exists(model_dir + model_name + '.download' + extension):
+                        os.remove(model_dir + model_name + '.download' + extension)
+            else:
+                self.model_version = model_version
+                self.model_name = model_name
+                for extension in artifacts:
+                    if os.path.exists(model_dir + model_name + '.download' + extension):
+                        os.replace(model_dir + model_name + '.download' + extension, model_dir + model_name + extension)
+                    elif os.path.exists(model_dir + model_name + extension):
+                        # left by a previous model: no pre-optimized model, or the statistics baked in the application
+                        os.remove(model_dir + model_name + extension)
+
+            print("Publishing request to update job status to %s..." % status)
             request = iotjobs.UpdateJobExecutionRequest(
                 thing_name=self.thing_name,
                 job_id=job_id,
-                status=iotjobs.JobStatus.SUCCEEDED)
+                status=status)
             publish_future = self.jobs_client.publish_update_job_execution(request, mqtt.QoS.AT_LEAST_ONCE)
             publish_future.add_done_callback(self.on_publish_update_job_execution)
 
@@ -375,7 +394,7 @@ class CloudConnector(object):
         except Exception as e:
             self.exit(e)
 
-    def publish_inference(self, anomalies, values, model_name, model_version, ts):
+    def publish_inference(self, anomalies, values, model_name, model_version, ts, turbine_id=None):
         try:
             dictionary = {
                 "type": "inference",
@@ -385,6 +404,9 @@ class CloudConnector(object):
                 "values": values.tolist(),
                 "ts": ts
             }
+            if turbine_id is not None:
+                # gateway mode: the device serves several turbines
+                dictionary["turbine_id"] = turbine_id
             message_json = json.dumps(dictionary)
             self.mqtt_connection.publish(
                 topic='device/'+self.thing_name+'/logs',
@@ -407,6 +429,30 @@ class CloudConnector(object):
         except Exception as e:
             print(e)
 
+    def publish_raw_batch(self, payload):
+        # a batch of raw samples, encoded by turbine.uplink. Errors are counted by the BatchPublisher,
+        # so wait for the broker acknowledgement (like the Greengrass connector): a failed or
+        # timed out publish raises here
+        publish_future, packet_id = self.mqtt_connection.publish(
+            topic='device/'+self.thing_name+'/logs',
+            payload=payload,
+            qos=mqtt.QoS.AT_LEAST_ONCE)
+        publish_future.result(timeout=5.0)
+
+    def publish_metrics(self, summary):
+        try:
+            dictionary = {
+                "type": "metrics",
+                "data": summary
+            }
+            message_json = json.dumps(dictionary)
+            self.mqtt_connection.publish(
+                topic='device/'+self.thing_name+'/logs',
+                payload=message_json,
+                qos=mqtt.QoS.AT_LEAST_ONCE)
+        except Exception as e:
+            print(e)
+
     def on_update_job_execution_rejected(self, rejected):
         # type: (iotjobs.RejectedError) -> None
         self.exit("Request to update job status was rejected. code:'{}' message:'{}'.".format(
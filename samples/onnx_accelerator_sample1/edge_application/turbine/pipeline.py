@@ -0,0 +1,254 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import logging
+import threading
+import time
+from collections import deque
+
+# overflow policies of a BoundedQueue
+BLOCK = 'block' # the producer waits for a free slot (backpressure)
+DROP_OLDEST = 'drop_oldest' # the oldest item is discarded to make room
+DROP_NEWEST = 'drop_newest' # the new item is discarded
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+class BoundedQueue(object):
+    '''
+        Thread safe FIFO with a maximum size and an overflow policy.
+        get() returns None once the queue is closed and drained, so
+        None can't be used as an item. on_drop is called with each
+        dropped item, to release its resources
+    '''
+    def __init__(self, name, maxsize, policy=DROP_OLDEST, on_drop=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError('Invalid overflow policy: %s' % policy)
+        if maxsize < 1:
+            raise ValueError('Invalid queue size: %d' % maxsize)
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_drop = on_drop
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.enqueued = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item, timeout=None):
+        '''
+            Add an item, applying the overflow policy if the queue is full.
+            Returns False if the item was dropped
+        '''
+        with self.cond:
+            if self.closed:
+                self.drop(item)
+                return False
+            if len(self.items) >= self.maxsize:
+                if self.policy == DROP_NEWEST:
+                    self.drop(item)
+                    return False
+                elif self.policy == DROP_OLDEST:
+                    self.drop(self.items.popleft())
+                elif not self.cond.wait_for(lambda: self.closed or len(self.items) < self.maxsize, timeout) or self.closed:
+                    self.drop(item)
+                    return False
+            self.items.append(item)
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.cond.notify_all()
+            return True
+
+    def drop(self, item):
+        self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+    def get(self, timeout=None):
+        '''
+            Remove and return the oldest item. Returns None on timeout or
+            when the queue is closed and empty
+        '''
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.closed or len(self.items) > 0, timeout) or len(self.items) == 0:
+                return None
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def stats(self):
+        return {'depth': len(self.items), 'max_depth': self.max_depth, 'size': self.maxsize,
+            'enqueued': self.enqueued, 'dropped': self.dropped}
+
+class Stage(object):
+    '''
+        Worker thread applying func to the items of input_q. Results that
+        are not None are put in output_q. Exceptions are logged and counted,
+        they don't stop the worker. The processing time of each item is
+        observed in the latency histogram, if given. idle is called when
+        no item came in for idle_interval seconds
+    '''
+    def __init__(self, name, func, input_q, output_q=None, latency=None, idle=None, idle_interval=None):
+        self.name = name
+        self.func = func
+        self.input_q = input_q
+        self.output_q = output_q
+        self.latency = latency
+        self.idle = idle
+        self.idle_interval = idle_interval if idle is not None else None
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0 # seconds spent in func
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.input_q.get(self.idle_interval)
+            if item is None:
+                if self.idle is None or self.input_q.closed and len(self.input_q) == 0:
+                    break
+                try:
+                    self.idle()
+                except Exception as e:
+                    self.errors += 1
+                    logging.error('Stage %s failed: %s' % (self.name, e))
+                continue
+            start = time.perf_counter()
+            try:
+                result = self.func(item)
+            except Exception as e:
+                self.errors += 1
+                logging.error('Stage %s failed: %s' % (self.name, e))
+                continue
+            finally:
+                elapsed = time.perf_counter() - start
+                self.busy_time += elapsed
+                if self.latency is not None:
+                    self.latency.observe(elapsed)
+            self.processed += 1
+            if result is not None and self.output_q is not None:
+                self.output_q.put(result)
+
+    def stop(self, timeout=None):
+        '''
+            Close the input queue and wait for the pending items to be processed
+        '''
+        self.input_q.close()
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {'processed': self.processed, 'errors': self.errors, 'busy_time': round(self.busy_time, 3)}
+
+class DeadlineScheduler(object):
+    '''
+        Fires every interval seconds on absolute deadlines, so the cadence
+        doesn't drift with the processing time. Deadlines already missed
+        when wait() is called are skipped and counted
+    '''
+    def __init__(self, interval, clock=time.monotonic, metrics=None):
+        self.interval = interval
+        self.clock = clock
+        self.deadline = None
+        self.ticks = 0
+        self.missed = 0
+        self.lateness = 0.0 # delay of the last tick
+        self.lateness_histogram = None
+        if metrics is not None:
+            self.lateness_histogram = metrics.histogram('deadline_lateness_seconds', 'Delay of the predictions after their deadline')
+            metrics.counter('deadlines_missed_total', 'Predictions skipped because their deadline was missed', lambda: self.missed)
+            metrics.counter('ticks_total', 'Predictions scheduled', lambda: self.ticks)
+
+    def wait(self, stop_event=None):
+        '''
+            Block until the next deadline. Returns False if stop_event is set
+        '''
+        now = self.clock()
+        if self.deadline is None:
+            self.deadline = now
+        elif now > self.deadline:
+            skipped = int((now - self.deadline) // self.interval)
+            self.missed += skipped
+            self.deadline += skipped * self.interval
+        delay = self.deadline - now
+        if delay > 0:
+            if stop_event is not None:
+                if stop_event.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+        elif stop_event is not None and stop_event.is_set():
+            return False
+        self.lateness = max(0.0, self.clock() - self.deadline)
+        if self.lateness_histogram is not None:
+            self.lateness_histogram.observe(self.lateness)
+        self.ticks += 1
+        self.deadline += self.interval
+        return True
+
+    def stats(self):
+        return {'ticks': self.ticks, 'missed': self.missed, 'lateness': round(self.lateness, 4)}
+
+class Pipeline(object):
+    '''
+        Set of stages connected by bounded queues
+    '''
+    def __init__(self, metrics=None):
+        self.queues = []
+        self.stages = []
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.gauge('queue_depth', 'Items waiting in the pipeline queues', lambda: {q.name: len(q) for q in self.queues}, 'queue')
+            metrics.counter('queue_dropped_total', 'Items dropped by the pipeline queues', lambda: {q.name: q.dropped for q in self.queues}, 'queue')
+            metrics.counter('stage_errors_total', 'Items the pipeline stages failed to process', lambda: {s.name: s.errors for s in self.stages}, 'stage')
+
+    def queue(self, name, maxsize, policy=DROP_OLDEST, on_drop=None):
+        q = BoundedQueue(name, maxsize, policy, on_drop)
+        self.queues.append(q)
+        return q
+
+    def stage(self, name, func, input_q, output_q=None, idle=None, idle_interval=None):
+        latency = None
+        if self.metrics is not None:
+            latency = self.metrics.histogram('stage_seconds', 'Processing time of an item by the pipeline stages', stage=name)
+        s = Stage(name, func, input_q, output_q, latency, idle, idle_interval)
+        self.stages.append(s)
+        return s
+
+    def start(self):
+        for s in self.stages:
+            s.start()
+
+    def stop(self, timeout=None):
+        '''
+            Stop the stages in order, so each one can drain into the next
+        '''
+        for s in self.stages:
+            s.stop(timeout)
+
+    def stats(self):
+        return {
+            'queues': {q.name: q.stats() for q in self.queues},
+            'stages': {s.name: s.stats() for s in self.stages}
+        }
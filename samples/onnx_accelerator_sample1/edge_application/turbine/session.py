@@ -0,0 +1,138 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import logging
+import hashlib
+import os
+import onnxruntime as ort
+
+EXECUTION_MODES = {
+    'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': ort.ExecutionMode.ORT_PARALLEL
+}
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+}
+# 0 threads: let onnxruntime decide
+SESSION_DEFAULTS = {
+    'intra_op_num_threads': 0,
+    'inter_op_num_threads': 0,
+    'execution_mode': 'sequential',
+    'graph_optimization_level': 'all',
+    'cache_dir': None,
+    'cache_size': 3 # optimized models kept in cache_dir
+}
+
+def session_options(params=None):
+    '''
+        Build the onnxruntime SessionOptions from a dict with the keys of
+        SESSION_DEFAULTS. Missing keys get the default value
+    '''
+    params = dict(SESSION_DEFAULTS, **(params or {}))
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = int(params['intra_op_num_threads'])
+    options.inter_op_num_threads = int(params['inter_op_num_threads'])
+    options.execution_mode = EXECUTION_MODES[params['execution_mode']]
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[params['graph_optimization_level']]
+    return options
+
+def model_hash(model_path):
+    sha = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def cached_model_path(cache_dir, model_path, params=None):
+    '''
+        Path of the optimized graph of model_path in cache_dir. The optimized
+        graph depends on the model, the optimization level and the
+        onnxruntime version
+    '''
+    params = dict(SESSION_DEFAULTS, **(params or {}))
+    return os.path.join(cache_dir, '%s-%s-ort%s.onnx' % (model_hash(model_path), params['graph_optimization_level'], ort.__version__))
+
+def prune_cache(cache_dir, keep):
+    '''
+        Remove the least recently used optimized models
+    '''
+    entries = [os.path.join(cache_dir, i) for i in os.listdir(cache_dir) if i.endswith('.onnx')]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for path in entries[keep:]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.error('Unable to remove %s: %s' % (path, e))
+
+def ort_format_path(model_path):
+    '''
+        Path of the pre-optimized ORT format model shipped with model_path
+        (same name, .ort extension), None if there isn't one
+    '''
+    path = os.path.splitext(model_path)[0] + '.ort'
+    return path if path != model_path and os.path.exists(path) else None
+
+def create_session(model_path, params=None, providers=None):
+    '''
+        Create an InferenceSession configured by params (see SESSION_DEFAULTS).
+        The ORT format model shipped with model_path is preferred: it is loaded
+        without parsing the protobuf and is already optimized.
+        Otherwise, if params['cache_dir'] is set, the optimized graph is saved
+        there on the first load and reused, without optimizing it again, by the
+        next loads of the same model
+    '''
+    params = dict(SESSION_DEFAULTS, **(params or {}))
+    ort_path = ort_format_path(model_path)
+    if ort_path is not None:
+        try:
+            options = session_options(params)
+            options.add_session_config_entry('session.load_model_format', 'ORT')
+            sess = ort.InferenceSession(ort_path, sess_options=options, providers=providers)
+            logging.info('ORT format model loaded: %s' % ort_path)
+            return sess
+        except Exception as e:
+            # e.g. converted by a newer onnxruntime, or an operator missing in this build
+            logging.error('Unable to load %s, using %s: %s' % (ort_path, model_path, e))
+
+    options = session_options(params)
+    if params['cache_dir'] is None or params['graph_optimization_level'] == 'disable':
+        return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+
+    cached_path = cached_model_path(params['cache_dir'], model_path, params)
+    if os.path.exists(cached_path):
+        try:
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            sess = ort.InferenceSession(cached_path, sess_options=options, providers=providers)
+            os.utime(cached_path)
+            logging.info('Optimized model loaded from the cache: %s' % cached_path)
+            return sess
+        except Exception as e:
+            logging.error('Invalid optimized model %s, optimizing it again: %s' % (cached_path, e))
+            options = session_options(params)
+
+    os.makedirs(params['cache_dir'], exist_ok=True)
+    # written next to the final file and renamed, so a crash can't leave a partial model in the cache
+    tmp_path = '%s.%d.tmp' % (cached_path, os.getpid())
+    options.optimized_model_filepath = tmp_path
+    sess = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+    try:
+        os.replace(tmp_path, cached_path)
+        logging.info('Optimized model saved in the cache: %s' % cached_path)
+        prune_cache(params['cache_dir'], int(params['cache_size']))
+    except OSError as e:
+        logging.error('Unable to cache the optimized model: %s' % e)
+    return sess
@@ -0,0 +1,121 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import logging
+from operator import itemgetter
+import numpy as np
+
+# Binary wire format of turbine/raw: one format byte followed by one or more
+# samples packed as little endian float32 values. A CSV payload always
+# starts with an ASCII character, so both can share the same topic
+WIRE_FORMAT_BINARY_V1 = 0xB1
+WIRE_FORMATS_TOPIC = 'turbine/raw/formats'
+# formats accepted by this parser, advertised (retained) in WIRE_FORMATS_TOPIC
+SUPPORTED_WIRE_FORMATS = 'bin1,csv'
+
+def encode_binary(samples):
+    '''
+        Pack a (N, num_fields) array (or a single sample) into the binary
+        wire format
+    '''
+    samples = np.asarray(samples, dtype='<f4')
+    return bytes([WIRE_FORMAT_BINARY_V1]) + samples.tobytes()
+
+class TelemetryParser(object):
+    '''
+        Parser for the samples published in turbine/raw, either comma
+        separated or in the binary wire format.
+        Only the columns in features_idx are converted, straight into a
+        float buffer (of dtype). Counts the parsed and malformed samples.
+    '''
+    def __init__(self, features_idx, num_fields, metrics=None, dtype=np.float64):
+        self.features_idx = list(features_idx)
+        self.num_fields = num_fields
+        self.get_features = itemgetter(*self.features_idx)
+        self.dtype = dtype
+        self.buffer = np.empty((1, len(self.features_idx)), dtype=dtype)
+        self.parsed = 0
+        self.wrong_length = 0 # unexpected number of columns
+        self.invalid = 0 # values that couldn't be converted to float
+        self.parse_time = None
+        if metrics is not None:
+            self.parse_time = metrics.histogram('parse_seconds', 'Parsing of a telemetry message')
+            metrics.counter('samples_parsed_total', 'Telemetry samples parsed', lambda: self.parsed)
+            metrics.counter('samples_malformed_total', 'Malformed telemetry samples', lambda: self.malformed)
+
+    @property
+    def malformed(self):
+        return self.wrong_length + self.invalid
+
+    def parse_fields(self, fields, out):
+        '''
+            Convert the selected columns of a split sample into out.
+            Returns False if the sample is malformed
+        '''
+        if len(fields) != self.num_fields:
+            self.wrong_length += 1
+            logging.error('Wrong # of features. Expected: %d, Got: %d' % (self.num_fields, len(fields)))
+            return False
+        try:
+            out[:] = list(map(float, self.get_features(fields)))
+        except ValueError as e:
+            self.invalid += 1
+            logging.error('Invalid sample: %s' % e)
+            return False
+        self.parsed += 1
+        return True
+
+    def parse_binary(self, payload):
+        '''
+            Decode a binary payload, no text parsing involved
+        '''
+        record_size = 4 * self.num_fields
+        if (len(payload) - 1) % record_size != 0:
+            self.wrong_length += 1
+            logging.error('Wrong binary payload size: %d bytes' % len(payload))
+            return self.buffer[:0], []
+        records = np.frombuffer(payload, dtype='<f4', offset=1).reshape(-1, self.num_fields)
+        if self.buffer.shape[0] < records.shape[0]:
+            self.buffer = np.empty((records.shape[0], len(self.features_idx)), dtype=self.dtype)
+        raw = self.buffer[:records.shape[0]]
+        raw[:] = records[:, self.features_idx]
+        self.parsed += records.shape[0]
+        return raw, records.tolist()
+
+    def parse(self, payload):
+        '''
+            Parse a payload with one or more samples (one per line for CSV).
+            Returns a (N, len(features_idx)) view of an internal buffer,
+            reused by the next call, and the list of fields of the N
+            valid samples
+        '''
+        if self.parse_time is None:
+            return self.parse_payload(payload)
+        with self.parse_time.time():
+            return self.parse_payload(payload)
+
+    def parse_payload(self, payload):
+        if isinstance(payload, (bytes, bytearray)):
+            if len(payload) > 0 and payload[0] == WIRE_FORMAT_BINARY_V1:
+                return self.parse_binary(payload)
+            payload = payload.decode('utf8')
+        lines = payload.splitlines()
+        if self.buffer.shape[0] < len(lines):
+            self.buffer = np.empty((len(lines), len(self.features_idx)), dtype=self.dtype)
+        rows = []
+        for line in lines:
+            fields = line.split(',')
+            if self.parse_fields(fields, self.buffer[len(rows)]):
+                rows.append(fields)
+        return self.buffer[:len(rows)], rows
@@ -0,0 +1,144 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import base64
+import json
+import logging
+import threading
+import time
+import zlib
+
+# Raw samples published in batches: one message {"type": "rawbatch", ...}
+# carries the samples of several messages of turbine/raw, column by column
+# (the values as received), compressed with zlib and base64 encoded (the
+# IoT rule only handles json)
+RAW_BATCH_TYPE = 'rawbatch'
+RAW_BATCH_ENCODING = 'zlib-json-columns'
+DEFAULT_MAX_SAMPLES = 100
+DEFAULT_MAX_DELAY = 1.0 # seconds
+# IoT Core rejects the messages larger than 128 KB
+MAX_PAYLOAD_SIZE = 120 * 1024
+
+def encode_batch(tokens):
+    '''
+        One rawbatch message (json bytes) with the tokens {'ts', 'values'
+        and optionally 'turbine_id'} of the raw samples
+    '''
+    batch = {
+        'ts': [t['ts'] for t in tokens],
+        'columns': [list(c) for c in zip(*[t['values'] for t in tokens])]
+    }
+    if any('turbine_id' in t for t in tokens):
+        batch['turbine_id'] = [t.get('turbine_id') for t in tokens]
+    data = zlib.compress(json.dumps(batch, separators=(',', ':')).encode('utf-8'))
+    return json.dumps({
+        'type': RAW_BATCH_TYPE,
+        'encoding': RAW_BATCH_ENCODING,
+        'count': len(tokens),
+        'data': base64.b64encode(data).decode('ascii')
+    }).encode('utf-8')
+
+def split_batch(tokens, max_size=MAX_PAYLOAD_SIZE):
+    '''
+        (number of samples, rawbatch message) of the tokens, split in halves
+        until each message fits in max_size bytes
+    '''
+    payload = encode_batch(tokens)
+    if len(payload) <= max_size or len(tokens) == 1:
+        return [(len(tokens), payload)]
+    half = len(tokens) // 2
+    return split_batch(tokens[:half], max_size) + split_batch(tokens[half:], max_size)
+
+def encode_batches(tokens, max_size=MAX_PAYLOAD_SIZE):
+    '''
+        The rawbatch messages of the tokens, each one within max_size bytes
+    '''
+    return [payload for count, payload in split_batch(tokens, max_size)]
+
+def decode_batch(message):
+    '''
+        The tokens of a rawbatch message (already parsed from json)
+    '''
+    if message.get('encoding') != RAW_BATCH_ENCODING:
+        raise ValueError('Unsupported raw batch encoding: %s' % message.get('encoding'))
+    batch = json.loads(zlib.decompress(base64.b64decode(message['data'])))
+    rows = zip(*batch['columns']) if len(batch['columns']) > 0 else [[] for i in batch['ts']]
+    tokens = [{'ts': ts, 'values': list(values)} for ts, values in zip(batch['ts'], rows)]
+    for token, turbine_id in zip(tokens, batch.get('turbine_id', [])):
+        if turbine_id is not None:
+            token['turbine_id'] = turbine_id
+    return tokens
+
+class BatchPublisher(object):
+    '''
+        Accumulates the raw samples and publishes them with publish(payload)
+        in rawbatch messages, once max_samples samples are waiting or the
+        oldest one waited max_delay seconds. poll() publishes the late
+        batch when no new sample comes in, flush() what is left
+    '''
+    def __init__(self, publish, max_samples=DEFAULT_MAX_SAMPLES, max_delay=DEFAULT_MAX_DELAY, clock=time.monotonic, metrics=None):
+        if max_samples < 1:
+            raise ValueError('Invalid batch size: %d' % max_samples)
+        self.publish = publish
+        self.max_samples = max_samples
+        self.max_delay = max_delay
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.tokens = []
+        self.first_time = None # when the oldest waiting sample was added
+        self.samples = 0
+        self.messages = 0
+        self.bytes = 0
+        self.errors = 0
+        if metrics is not None:
+            metrics.counter('uplink_samples_total', 'Raw samples published in batches', lambda: self.samples)
+            metrics.counter('uplink_messages_total', 'Batches of raw samples published', lambda: self.messages)
+            metrics.counter('uplink_bytes_total', 'Bytes of the batches of raw samples published', lambda: self.bytes)
+            metrics.counter('uplink_errors_total', 'Batches of raw samples which failed to be published', lambda: self.errors)
+
+    def add(self, token):
+        with self.lock:
+            if len(self.tokens) == 0:
+                self.first_time = self.clock()
+            self.tokens.append(token)
+            if len(self.tokens) >= self.max_samples or self.clock() - self.first_time >= self.max_delay:
+                self.send()
+
+    def poll(self):
+        with self.lock:
+            if len(self.tokens) > 0 and self.clock() - self.first_time >= self.max_delay:
+                self.send()
+
+    def flush(self):
+        with self.lock:
+            if len(self.tokens) > 0:
+                self.send()
+
+    def send(self):
+        tokens, self.tokens = self.tokens, []
+        for count, payload in split_batch(tokens):
+            try:
+                self.publish(payload)
+            except Exception as e:
+                self.errors += 1
+                logging.error('Unable to publish a batch of %d raw samples: %s' % (count, e))
+                continue
+            # only the samples which went out
+            self.samples += count
+            self.messages += 1
+            self.bytes += len(payload)
+
+    def stats(self):
+        return {'samples': self.samples, 'messages': self.messages, 'bytes': self.bytes,
+            'errors': self.errors, 'waiting': len(self.tokens)}
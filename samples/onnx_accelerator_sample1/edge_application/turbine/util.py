@@ -14,11 +14,7 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 import math
 import numpy as np
-import boto3
 import pywt
-import socket
-import requests
-import json
 
 def euler_from_quaternion(x, y, z, w):
     """
@@ -42,6 +38,47 @@ def euler_from_quaternion(x, y, z, w):
 
     return roll_x, pitch_y, yaw_z # in radians
 
+def euler_from_quaternion_batch(x, y, z, w, out=None):
+    """
+    Vectorized version of euler_from_quaternion for arrays of quaternions,
+    with the same clamping of the pitch. Returns (or fills out with) a
+    (N, 3) array with roll, pitch and yaw in radians, computed in the
+    precision of out (float64 by default)
+    """
+    dtype = np.float64 if out is None else out.dtype
+    x, y, z, w = [np.asarray(i, dtype=dtype) for i in (x, y, z, w)]
+    if out is None:
+        out = np.empty((x.shape[0], 3))
+
+    np.arctan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y), out=out[:,0])
+
+    t2 = 2.0 * (w * y - z * x)
+    np.clip(t2, -1.0, 1.0, out=t2)
+    np.arcsin(t2, out=out[:,1])
+
+    np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z), out=out[:,2])
+
+    return out
+
+def prepare_features(raw, out=None):
+    '''
+        Convert a (N, 7) array of raw samples (qx, qy, qz, qw, wind_speed_rps,
+        rps, voltage) into the (N, 6) features used by the model
+        (roll, pitch, yaw, wind_speed_rps, rps, voltage), in the float
+        precision of raw (float64 for other types)
+    '''
+    raw = np.asarray(raw)
+    if out is None:
+        out = np.empty((raw.shape[0], 6), dtype=raw.dtype if raw.dtype.kind == 'f' else np.float64)
+    if raw.shape[0] == 1:
+        # numpy overhead dominates for a single sample, math is faster
+        x, y, z, w, wind_speed_rps, rps, voltage = raw[0].tolist()
+        out[0] = euler_from_quaternion(x, y, z, w) + (wind_speed_rps, rps, voltage)
+    else:
+        euler_from_quaternion_batch(raw[:,0], raw[:,1], raw[:,2], raw[:,3], out=out[:,:3])
+        out[:,3:] = raw[:,4:7]
+    return out
+
 def wavelet_denoise(data, noise_sigma, wavelet):
     '''Filter accelerometer data using wavelet denoising    
     Modification of F. Blanco-Silva's code at: https://goo.gl/gOQwy5
@@ -56,13 +93,78 @@ def wavelet_denoise(data, noise_sigma, wavelet):
 
     return pywt.waverec(list(new_wavelet_coeffs), wavelet)
 
+def soft_threshold(data, threshold, out=None):
+    '''
+        Vectorized soft thresholding, threshold can be a scalar or
+        one value per channel (last axis)
+    '''
+    magnitude = np.abs(data)
+    magnitude -= threshold
+    np.maximum(magnitude, 0, out=magnitude)
+    return np.copysign(magnitude, data, out=out)
+
+def wavelet_denoise_batch(data, noise_sigmas, wavelet, axis=0):
+    '''
+        Same as wavelet_denoise, but for all the channels (columns) of a
+        (T, F) matrix at once, with one noise sigma per channel.
+        The result has T rows (T+1 if T is odd, like wavelet_denoise).
+        With axis=1, denoises each (T, F) window of a (N, T, F) stack
+    '''
+    wavelet = pywt.Wavelet(wavelet)
+    levels  = min(5, (np.floor(np.log2(data.shape[axis]))).astype(int))
+    wavelet_coeffs = pywt.wavedec(data, wavelet, level=levels, axis=axis)
+    threshold = (np.asarray(noise_sigmas)*np.sqrt(2*np.log2(data.shape[axis]))).astype(data.dtype)
+
+    for coeffs in wavelet_coeffs:
+        soft_threshold(coeffs, threshold, out=coeffs)
+
+    return pywt.waverec(wavelet_coeffs, wavelet, axis=axis)
+
+def denoise_windows(windows, noise_sigmas, wavelet, mean, std, lengths):
+    '''
+        Preprocessing shared by the edge gateway and the backfill: denoise the
+        stacked (N, window_size, F) raw windows in a single call, then
+        normalize the last lengths[i] samples of window i (lengths can be an
+        int, the same for all the windows). Returns the list of the
+        normalized samples, in the dtype of windows
+    '''
+    denoised = wavelet_denoise_batch(windows, noise_sigmas, wavelet, axis=1)
+    if np.isscalar(lengths):
+        lengths = [lengths] * len(denoised)
+    data = [d[-length:] for d, length in zip(denoised, lengths)]
+    for d in data:
+        d -= mean
+        d /= std
+    return data
+
 def create_dataset(X, time_steps=1, step=1):
     '''
         Format a timeseries buffer into a multidimensional tensor
-        required by the model
+        required by the model. Returns a read-only strided view
+        (no copy) of shape (N, time_steps, ...)
+    '''
+    X = np.asarray(X)
+    if len(X) <= time_steps:
+        return np.empty((0, time_steps) + X.shape[1:], dtype=X.dtype)
+    windows = np.lib.stride_tricks.sliding_window_view(X, time_steps, axis=0)[:len(X) - time_steps:step]
+    # the window axis is the last one, move it next to the batch axis
+    return np.moveaxis(windows, -1, 1)
+
+def create_model_input(X, time_steps, step, out=None, dtype=np.float32):
+    '''
+        Same windows as create_dataset, already in the (N, F, rows, cols)
+        layout expected by the model, where rows * cols == time_steps.
+        The strided view is copied (and cast) only once, into out when
+        given. out can have more rows than windows, the filled slice
+        is returned
     '''
-    Xs = []
-    for i in range(0, len(X) - time_steps, step):
-        v = X[i:(i + time_steps)]
-        Xs.append(v)
-    return np.array(Xs)
\ No newline at end of file
+    X = np.asarray(X)
+    num_features = X.shape[1]
+    rows = int(np.sqrt(time_steps))
+    windows = np.moveaxis(create_dataset(X, time_steps, step), 1, -1) # (N, F, time_steps)
+    windows = windows.reshape(windows.shape[0], num_features, rows, time_steps // rows)
+    if out is None:
+        return windows.astype(dtype)
+    out = out[:windows.shape[0]]
+    np.copyto(out, windows, casting='same_kind')
+    return out
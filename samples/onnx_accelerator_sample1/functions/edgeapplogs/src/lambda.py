@@ -17,14 +17,25 @@ import json
 import urllib.request
 import os
 import io
+import base64
+import zlib
 import boto3
 import time
 
 log_group_name = os.environ['LOG_GROUP_NAME']
 log_stream_raw_data_name = os.environ['LOG_STREAM_RAW_DATA_NAME']
 log_stream_inference_name = os.environ['LOG_STREAM_INFERENCE_NAME']
+log_stream_metrics_name = os.environ['LOG_STREAM_METRICS_NAME']
 
 
+# batches of raw samples published by the edge applications (see turbine/uplink.py)
+RAW_BATCH_ENCODING = 'zlib-json-columns'
+# limits of a put_log_events call: number of events, and size of the batch,
+# counted as the utf8 bytes of the messages plus 26 bytes per event
+MAX_LOG_EVENTS = 10000
+MAX_LOG_BYTES = 1048576
+LOG_EVENT_OVERHEAD = 26
+
 logs_client = boto3.client('logs')
 
 def put_events(log_stream_name, data):
@@ -32,23 +43,81 @@ def put_events(log_stream_name, data):
         logStreamName=log_stream_name,
         logEvents=[data])
 
+def log_events_chunks(items):
+    '''
+        The items split in chunks within the limits of a put_log_events call
+    '''
+    chunk, size = [], 0
+    for item in items:
+        item_size = len(item['message'].encode('utf-8')) + LOG_EVENT_OVERHEAD
+        if len(chunk) == MAX_LOG_EVENTS or (len(chunk) > 0 and size + item_size > MAX_LOG_BYTES):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(item)
+        size += item_size
+    if len(chunk) > 0:
+        yield chunk
+
+def put_events_batch(log_stream_name, items):
+    for chunk in log_events_chunks(items):
+        logs_client.put_log_events(logGroupName=log_group_name,
+            logStreamName=log_stream_name,
+            logEvents=chunk)
+
+def raw_message(device_name, data):
+    return ' '.join([data['ts'], source_name(device_name, data)] + [str(i) for i in data['values']])
+
+def expand_raw_batch(event):
+    '''
+        The samples {'ts', 'values' and optionally 'turbine_id'} of a rawbatch
+        event: columns of values, compressed with zlib and base64 encoded
+    '''
+    if event.get('encoding') != RAW_BATCH_ENCODING:
+        raise Exception("Unsupported raw batch encoding: %s" % event.get('encoding'))
+    batch = json.loads(zlib.decompress(base64.b64decode(event['data'])))
+    rows = zip(*batch['columns']) if len(batch['columns']) > 0 else [[] for i in batch['ts']]
+    samples = [{'ts': ts, 'values': list(values)} for ts, values in zip(batch['ts'], rows)]
+    for sample, turbine_id in zip(samples, batch.get('turbine_id', [])):
+        if turbine_id is not None:
+            sample['turbine_id'] = turbine_id
+    return samples
+
+def source_name(device_name, data):
+    # gateway devices serve several turbines: <device>/<turbine_id>, still a single token for the dashboard queries
+    if 'turbine_id' in data:
+        return '%s/%s' % (device_name, data['turbine_id'])
+    return device_name
+
 def handler(event, context):
     device_name = event['clientid']
 
     if event['type'] == 'rawdata':
-        data = event['data']['values']
         item = {
             "timestamp": round(time.time() * 1000),
-            "message": ' '.join([event['data']['ts'], device_name] + [str(i) for i in data])
+            "message": raw_message(device_name, event['data'])
         }
         put_events(log_stream_raw_data_name, item)
 
+    elif event['type'] == 'rawbatch':
+        # one log event per sample, same format as rawdata, written with as few calls as the limits allow
+        timestamp = round(time.time() * 1000)
+        put_events_batch(log_stream_raw_data_name,
+            [{"timestamp": timestamp, "message": raw_message(device_name, data)} for data in expand_raw_batch(event)])
+
     elif event['type'] == 'inference':
         data = event['values']
         item = {
             "timestamp": round(time.time() * 1000),
-            "message": ' '.join([event['ts'], device_name, event['model_name'], event['model_version']] + [str(i) for i in event["anomalies"]] + [str(i) for i in data])
+            "message": ' '.join([event['ts'], source_name(device_name, event), event['model_name'], event['model_version']] + [str(i) for i in event["anomalies"]] + [str(i) for i in data])
         }
         put_events(log_stream_inference_name, item)
+
+    elif event['type'] == 'metrics':
+        # kept as json, so CloudWatch Logs Insights discovers the fields (e.g. deadline_lateness_seconds.p95)
+        item = {
+            "timestamp": round(time.time() * 1000),
+            "message": json.dumps(dict(event['data'], device_name=device_name))
+        }
+        put_events(log_stream_metrics_name, item)
     else:
         raise Exception("Invalid event: %s" % json.dumps(event))
\ No newline at end of file
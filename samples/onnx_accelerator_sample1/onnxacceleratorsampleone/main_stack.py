@@ -43,6 +43,9 @@ class MainStack(Stack):
     super().__init__(scope, construct_id, **kwargs)
 
     use_greengrass = self.node.try_get_context('use_greengrass')
+    # optional INT8 quantization of the model by the build project, see model_optimization.py
+    quantization = self.node.try_get_context('quantization') or 'none'
+    quantization_min_agreement = self.node.try_get_context('quantization_min_agreement') or 0.99
 
     ####################################
     #### Sagemaker Studio and users  ###
@@ -275,7 +278,9 @@ class MainStack(Stack):
                         "pip3 install git+https://github.com/aws-greengrass/aws-greengrass-gdk-cli.git@v1.2.1",
                         "pip3 install torch==1.13.1",
                         "pip3 install numpy==1.24.2",
+                        "pip3 install onnx==1.13.1 onnxruntime==1.13.1", # scoring subgraph appended to the exported model
                         "aws s3 cp s3://$S3_ARTIFACTS_BUCKET/$S3_ARTIFACTS_OBJECT $S3_ARTIFACTS_OBJECT",
+                        "aws s3 cp s3://$S3_ARTIFACTS_BUCKET/model_optimization.py model_optimization.py", # scoring subgraph and quantization
                         "aws s3 cp s3://$S3_ARTIFACTS_BUCKET/components ./ --recursive", # we pull all the artifacts used to build our deployment package,
                         "touch trigger.json", # empty file, will be used to trigger a deployment
                         "cp trigger.json /tmp",
@@ -332,7 +337,20 @@ class MainStack(Stack):
     else:
       aws_s3_deployment.BucketDeployment(self, "DeployCodeBuildInputArtifacts",
           sources=[aws_s3_deployment.Source.asset("./onnxacceleratorsampleone/without_ggv2")],
-          destination_bucket=artifacts_bucket
+          destination_bucket=artifacts_bucket,
+          prune=False # keep the statistics/ prefix deployed below
+      )
+      # the statistics of the edge application, the thresholds are embedded in the model
+      aws_s3_deployment.BucketDeployment(self, "DeployCodeBuildInputStatistics",
+          sources=[aws_s3_deployment.Source.asset("./edge_application/statistics")],
+          destination_bucket=artifacts_bucket,
+          destination_key_prefix="statistics"
+      )
+      # the module of the edge application which reads the statistics bundle also writes it
+      aws_s3_deployment.BucketDeployment(self, "DeployCodeBuildInputTurbine",
+          sources=[aws_s3_deployment.Source.asset("./edge_application/turbine", exclude=["__pycache__"])],
+          destination_bucket=artifacts_bucket,
+          destination_key_prefix="turbine"
       )
     
       # Create the codebuild project
@@ -354,9 +372,15 @@ class MainStack(Stack):
                       "commands": [
                           "pip3 install torch==1.13.1",
                           "pip3 install numpy==1.24.2",
+                          "pip3 install onnx==1.13.1 onnxruntime==1.13.1", # scoring subgraph appended to the exported model
                           "aws s3 cp s3://$S3_ARTIFACTS_BUCKET/$S3_ARTIFACTS_OBJECT $S3_ARTIFACTS_OBJECT", # we pull the script which will be used to build our deployment package,
+                          "aws s3 cp s3://$S3_ARTIFACTS_BUCKET/model_optimization.py model_optimization.py", # scoring subgraph and quantization
+                          "aws s3 cp s3://$S3_ARTIFACTS_BUCKET/statistics ./statistics --recursive", # thresholds embedded in the model
+                          "aws s3 cp s3://$S3_ARTIFACTS_BUCKET/turbine ./turbine --recursive", # statistics bundle writer
                           "python $S3_ARTIFACTS_OBJECT", # run the script to build the deployment package
                           "cp *.onnx /tmp", # the generated onnx file is copied to the folder used to copy artifacts
+                          "cp *.ort *.required_operators.config /tmp", # ORT format model and the operators it needs
+                          "cp *.stats /tmp", # statistics bundle of the model
                           "cp job.json /tmp",
                       ]
                   }
@@ -364,6 +388,9 @@ class MainStack(Stack):
               "artifacts": {
                   "files": [
                       "*.onnx",
+                      "*.ort",
+                      "*.required_operators.config",
+                      "*.stats",
                       "job.json"
                   ],
                   "base-directory": "/tmp",
@@ -400,6 +427,8 @@ class MainStack(Stack):
         's3:List*'
       ],
       resources=[
+        # ListBucket applies to the bucket itself, the Get* actions to its objects
+        'arn:aws:s3:::sagemaker-'+ Aws.REGION+'-'+ Aws.ACCOUNT_ID,
         'arn:aws:s3:::sagemaker-'+ Aws.REGION+'-'+ Aws.ACCOUNT_ID+'/*'
       ]
     ))
@@ -450,6 +479,16 @@ class MainStack(Stack):
                                                                     "name": 'DEPLOYMENT_BUCKET_NAME',
                                                                     "value": deployment_bucket.bucket_name, # The S3 bucket where output artifacts will be uploaded
                                                                     "type": 'PLAINTEXT',
+                                                                },
+                                                                {
+                                                                    "name": 'QUANTIZATION',
+                                                                    "value": quantization, # INT8 quantization of the model: none, dynamic or static
+                                                                    "type": 'PLAINTEXT',
+                                                                },
+                                                                {
+                                                                    "name": 'QUANTIZATION_MIN_AGREEMENT',
+                                                                    "value": str(quantization_min_agreement), # the build fails if the INT8 decisions agree less with the FP32 ones
+                                                                    "type": 'PLAINTEXT',
                                                                 }
                                                             ],
                                                     })
@@ -473,7 +512,7 @@ class MainStack(Stack):
         retention = logs.RetentionDays.ONE_WEEK
     )
 
-    # create 2 logs streams
+    # create 3 logs streams
     log_stream_infer = logs.LogStream(self, "inference_log_stream",
         log_group=edge_logs_group,
         log_stream_name="inference",
@@ -486,6 +525,13 @@ class MainStack(Stack):
         removal_policy=RemovalPolicy.DESTROY
     )
 
+    # optional summaries of the metrics of the edge applications
+    log_stream_metrics = logs.LogStream(self, "metrics_log_stream",
+        log_group=edge_logs_group,
+        log_stream_name="metrics",
+        removal_policy=RemovalPolicy.DESTROY
+    )
+
     function_edge_logs = _lambda.Function(self, "lambda_function_edge_logs",
                                         runtime=_lambda.Runtime.PYTHON_3_9,
                                         handler="lambda.handler",
@@ -494,7 +540,8 @@ class MainStack(Stack):
                                         environment={
                                             'LOG_GROUP_NAME': edge_logs_group.log_group_name,
                                             'LOG_STREAM_INFERENCE_NAME': log_stream_infer.log_stream_name,
-                                            'LOG_STREAM_RAW_DATA_NAME': log_stream_raw.log_stream_name
+                                            'LOG_STREAM_RAW_DATA_NAME': log_stream_raw.log_stream_name,
+                                            'LOG_STREAM_METRICS_NAME': log_stream_metrics.log_stream_name
                                         })
 
     function_edge_logs.add_to_role_policy(iam.PolicyStatement(
@@ -506,7 +553,8 @@ class MainStack(Stack):
       resources=[
         'arn:aws:logs:'+ Aws.REGION+':'+ Aws.ACCOUNT_ID+':log-group:'+edge_logs_group_name+':log-stream:',
         'arn:aws:logs:'+ Aws.REGION+':'+ Aws.ACCOUNT_ID+':log-group:'+edge_logs_group_name+':log-stream:'+log_stream_infer.log_stream_name,
-        'arn:aws:logs:'+ Aws.REGION+':'+ Aws.ACCOUNT_ID+':log-group:'+edge_logs_group_name+':log-stream:'+log_stream_raw.log_stream_name
+        'arn:aws:logs:'+ Aws.REGION+':'+ Aws.ACCOUNT_ID+':log-group:'+edge_logs_group_name+':log-stream:'+log_stream_raw.log_stream_name,
+        'arn:aws:logs:'+ Aws.REGION+':'+ Aws.ACCOUNT_ID+':log-group:'+edge_logs_group_name+':log-stream:'+log_stream_metrics.log_stream_name
       ]
     ))
         
@@ -595,6 +643,19 @@ class MainStack(Stack):
         "sort maxBytes desc"
       ]
     ))
+
+    dashboard.add_widgets(cloudwatch.LogQueryWidget(
+      log_group_names=[edge_logs_group.log_group_name],
+      width= 24,
+      view=cloudwatch.LogQueryVisualizationType.TABLE,
+      title="Missed prediction deadlines",
+      query_lines=[
+        "filter @logStream like /"+log_stream_metrics.log_stream_name+"/",
+        "stats max(deadlines_missed_total) - min(deadlines_missed_total) as missed, max(`deadline_lateness_seconds.p95`) as lateness_p95, max(`stage_seconds.infer.p95`) as infer_p95 by device_name",
+        "sort missed desc",
+        "limit 20"
+      ]
+    ))
    
     cloudwatchDashboardURL = 'https://'+Aws.REGION+'.console.aws.amazon.com/cloudwatch/home?region='+Aws.REGION+'#dashboards:name='+dashboard.dashboard_name
     CfnOutput(self, "DashboardOutput",
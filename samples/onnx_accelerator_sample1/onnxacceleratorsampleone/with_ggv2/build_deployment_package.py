@@ -14,16 +14,25 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import torch
+import numpy as np
 import tarfile
 import boto3
 import os
+import sys
 import json
+# the turbine package of the detector component writes the statistics bundle it reads
+sys.path.insert(0, './aws.samples.windturbine.detector')
+from model_optimization import add_scoring_subgraph, check_scoring_subgraph, load_shards, quantization_stage, QUANTIZATION_MODES, convert_to_ort, check_ort_model, save_statistics_bundle
 import yaml
 
 # first we need to retrieve the model pth file, for that let's consult the model package
 model_package_arn = os.environ["MODEL_PACKAGE_ARN"]
 deployment_bucket_name = os.environ['DEPLOYMENT_BUCKET_NAME']
 region = os.environ["AWS_REGION"]
+# optional INT8 quantization of the model: none, dynamic or static
+quantization = os.environ.get("QUANTIZATION", "none")
+# the quantized model is rejected (build failure) below this ratio of windows with the same decisions as the FP32 one
+quantization_min_agreement = float(os.environ.get("QUANTIZATION_MIN_AGREEMENT", "0.99"))
 
 client_sm = boto3.client("sagemaker")
 
@@ -103,8 +112,33 @@ torch.onnx.export(pytorch_model,
                  input_names=input_names,
                  output_names=output_names,
                  export_params=True,
+                 # any number of windows per run: several turbines, or the backlog of a turbine catching up
+                 dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}},
                  )
 
+thresholds = np.load('./aws.samples.windturbine.detector/statistics/thresholds.npy')
+
+if quantization not in QUANTIZATION_MODES:
+    raise Exception("Invalid quantization: %s. Use one of: %s" % (quantization, ', '.join(QUANTIZATION_MODES)))
+if quantization != 'none':
+    # calibration and evaluation windows: the training shards uploaded by the notebooks
+    default_data = "s3://sagemaker-%s-%s/wind_turbine_anomaly/data" % (region, boto3.client("sts").get_caller_identity()["Account"])
+    data_bucket, data_prefix = os.environ.get("CALIBRATION_DATA_S3", default_data).split('/', 2)[-1].split('/', 1)
+    windows = load_shards(boto3.client("s3"), data_bucket, data_prefix)
+    quantization_stage(output_onnx_model, quantization, thresholds, windows, quantization_min_agreement)
+
+# scores and anomaly flags computed by the model, with the thresholds versioned with it
+add_scoring_subgraph(output_onnx_model, thresholds)
+check_scoring_subgraph(output_onnx_model, thresholds)
+
+# pre-optimized ORT format model, preferred by the edge application (faster load, less memory)
+output_ort_model, _ = convert_to_ort(output_onnx_model)
+check_ort_model(output_onnx_model, output_ort_model)
+
+# thresholds, denoising and normalization statistics in a single bundle keyed to the model
+# (version and sha256), swapped with it by the edge application
+output_statistics = save_statistics_bundle(output_onnx_model, './aws.samples.windturbine.detector/statistics', output_onnx_model_name, model_package_version)
+
 # Update the recipe/config for each component
 component_version = '1.0.'+str(model_package_version)
 update_component_config_in_json_file('./aws.samples.windturbine.model/', component_version, 'aws.samples.windturbine.model')
@@ -19,67 +19,60 @@ import time
 import json
 import numpy as np
 import turbine
-from queue import Queue
-import onnxruntime as ort
 from datetime import datetime
 import paho.mqtt.client as mqtt
 import sys
 import os
 
-# buffer size required to process timeseries data
+# windows and features of the model, shared with turbine.backfill
+from turbine.constants import MIN_NUM_SAMPLES, TIME_STEPS, STEP, FEATURES_IDX, NUM_RAW_FEATURES, NUM_FEATURES
+
 PREDICTIONS_INTERVAL = 1.0 # interval in seconds between the predictions
-MIN_NUM_SAMPLES = 500         
-INTERVAL = 5 # seconds
-TIME_STEPS = 20 * INTERVAL
-STEP = 10
-FEATURES_IDX = [6,7,8,5,  3, 2, 4] # qX,qy,qz,qw  ,wind_seed_rps, rps, voltage 
-NUM_RAW_FEATURES = 20
-NUM_FEATURES = 6
+STATS_INTERVAL = 60 # number of predictions between two pipeline stats logs
+RAW_TOPIC = 'turbine/raw'
+GATEWAY_RAW_TOPIC = 'turbine/+/raw' # turbine/<turbine_id>/raw
 
 connected = False
 
-q=Queue()
-tokens_q = Queue()
+raw_topic = RAW_TOPIC
+gateway = None # windows of the turbines, created with the statistics
+logs_q = None # raw data to be published, created with the pipeline
+telemetry_parser = None # created with the metrics
 
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("Connected to broker for raw data acquisition")
         client.connected_flag=True
-        client.subscribe('turbine/raw')         
+        client.subscribe(raw_topic)
+        # let the devices know which wire formats we accept (see turbine.telemetry)
+        client.publish(turbine.WIRE_FORMATS_TOPIC, turbine.SUPPORTED_WIRE_FORMATS, retain=True)
     else:
         print("Connection failed")
 
 def on_message(client, userdata, msg):
-    data = msg.payload.decode('utf8')
-    try:
-        tokens = np.array(data.split(','))
-        # check if the format is correct
-        if len(tokens) != NUM_RAW_FEATURES:
-            print(data)
-            logging.error('Wrong # of features. Expected: %d, Got: %d' % ( NUM_RAW_FEATURES, len(tokens)))
-            return
-        # add noise to raw data randomly
-        if np.random.randint(50) == 0:
-            print("adding noise to radians")
-            tokens[FEATURES_IDX[0:4]] = np.random.rand(4) * 10 # out of the radians range
-        if np.random.randint(20) == 0:
-            print("adding noise to wind")
-            tokens[FEATURES_IDX[5]] = np.random.rand(1)[0] * 10 # out of the normalized wind range
-        if np.random.randint(50) == 0:
-            print("adding noise to voltage")
-            tokens[FEATURES_IDX[6]] = int(np.random.rand(1)[0] * 1000) # out of the normalized voltage range
-    except Exception as e:
-        logging.error(e)
-        logging.error(data)
+    # the payload can carry a micro-batch of samples, one per line.
+    # raw contains only the used features, in the FEATURES_IDX order
+    raw, rows = telemetry_parser.parse(msg.payload)
+    if len(rows) == 0:
+        return
+    # None in single turbine mode
+    turbine_id = turbine.turbine_id_from_topic(msg.topic)
+    # the samples of a micro-batch arrive together. Anomalies for the tests are
+    # injected upstream, by the scenarios of the simulated device
     ts = "%s+00:00" % datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
-    tokens_q.put({'ts': ts, 'values': tokens.tolist()})
-    # get only the used features
-    data = [float(tokens[i]) for i in FEATURES_IDX]
-    # compute the euler angles from the quaternion
-    roll,pitch,yaw = turbine.euler_from_quaternion(data[0],data[1],data[2],data[3])
-    data = np.array([roll,pitch,yaw, data[4], data[5], data[6]])
-    #logging.info("Adding data to samples: %s", data)
-    q.put(data)
+    for fields in rows:
+        token = {'ts': ts, 'values': fields}
+        if turbine_id is not None:
+            token['turbine_id'] = turbine_id
+        logs_q.put(token)
+    # compute the euler angles from the quaternions of the whole micro-batch
+    gateway.extend(turbine_id, turbine.prepare_features(raw))
+
+def flag(value):
+    '''
+        Boolean option: a bare flag, or the true/false of the recipe configuration
+    '''
+    return str(value).lower() in ('true', '1', 'yes')
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO )
@@ -92,7 +85,77 @@ if __name__ == '__main__':
     parser.add_argument("--model-name", type=str,required = True, help='ONNX Model name')
     parser.add_argument("--model-version", type=str,required = True, help='ONNX Model version')
     parser.add_argument('--model-path', type=str, required = True, default='models', help='Absolute path to the model dir')
+    parser.add_argument('--logs-queue-size', type=int, default=1000, help='max number of raw data messages waiting to be published')
+    parser.add_argument('--logs-overflow', type=str, default=turbine.DROP_OLDEST, choices=turbine.OVERFLOW_POLICIES, help='policy applied when the logs queue is full')
+    parser.add_argument('--logs-batch-size', type=int, default=turbine.DEFAULT_MAX_SAMPLES, help='max raw samples per compressed message, 0: one message per sample')
+    parser.add_argument('--logs-batch-ms', type=int, default=1000, help='max time a raw sample waits for its batch to be published')
+    parser.add_argument('--results-queue-size', type=int, default=100, help='max number of inference results waiting to be published')
+    parser.add_argument('--results-overflow', type=str, default=turbine.DROP_OLDEST, choices=turbine.OVERFLOW_POLICIES, help='policy applied when the results queue is full')
+    parser.add_argument('--intra-op-threads', type=int, default=0, help='onnxruntime intra op threads, 0: default')
+    parser.add_argument('--inter-op-threads', type=int, default=0, help='onnxruntime inter op threads, 0: default')
+    parser.add_argument('--execution-mode', type=str, default='sequential', choices=list(turbine.EXECUTION_MODES), help='onnxruntime execution mode')
+    parser.add_argument('--graph-optimization-level', type=str, default='all', choices=list(turbine.GRAPH_OPTIMIZATION_LEVELS), help='onnxruntime graph optimization level')
+    parser.add_argument('--session-cache-dir', type=str, default=None, help='dir where the optimized models are cached')
+    parser.add_argument('--gateway', type=flag, nargs='?', const=True, default=False, help='serve several turbines, publishing in turbine/<turbine_id>/raw')
+    parser.add_argument('--max-turbines', type=int, default=100, help='max number of turbines served in gateway mode')
+    parser.add_argument('--catch-up-windows', type=int, default=40, help='max windows of a turbine scored at once when the predictions fall behind, 0: disabled')
+    parser.add_argument('--metrics-port', type=int, default=turbine.METRICS_PORT, help='localhost port of the Prometheus metrics endpoint, 0: disabled')
+    parser.add_argument('--metrics-host', type=str, default='127.0.0.1', help='address the metrics endpoint listens on')
+    parser.add_argument('--metrics-summary', type=flag, nargs='?', const=True, default=False, help='publish a summary of the metrics in the logs stream')
+    parser.add_argument('--cascade', type=flag, nargs='?', const=True, default=False, help='skip the model on the windows which did not change since its last run')
+    parser.add_argument('--cascade-z-limit', type=float, default=3.0, help='max distance of a skipped window to the training data, in training stds')
+    parser.add_argument('--cascade-change-limit', type=float, default=0.25, help='max change of a skipped window since the last model run, in training stds')
+    parser.add_argument('--cascade-margin', type=float, default=0.5, help='max ratio of the last scores to the thresholds for a window to be skipped')
+    parser.add_argument('--cascade-max-skips', type=int, default=10, help='max windows of a turbine skipped in a row by the cascade')
+    parser.add_argument('--dtype', type=str, default='float64', choices=['float64', 'float32'], help='precision of the preprocessing and scores')
     args = parser.parse_args()
+    metrics_port, metrics_host, metrics_summary = args.metrics_port, args.metrics_host, args.metrics_summary
+    # precision of the samples, denoising, normalization and scores. float32 halves
+    # the memory traffic, the model input is float32 anyway
+    dtype = np.dtype(args.dtype)
+
+    # latency histograms, queue depths and drop counters of the application,
+    # served in the Prometheus text format (on localhost by default)
+    metrics = turbine.Metrics()
+    metrics_server = None
+    if metrics_port:
+        try:
+            metrics_server = turbine.MetricsServer(metrics, metrics_port, metrics_host)
+            metrics_server.start()
+        except OSError as e:
+            logging.error('Unable to serve the metrics on port %d: %s' % (metrics_port, e))
+            metrics_server = None
+    telemetry_parser = turbine.TelemetryParser(FEATURES_IDX, NUM_RAW_FEATURES, metrics, dtype)
+
+    # stages: ingest (mqtt callback) -> preprocess -> infer -> publish
+    # connected by bounded queues, so a slow uplink can't delay the inference
+    pipeline = turbine.Pipeline(metrics)
+    logs_q = pipeline.queue('logs', args.logs_queue_size, args.logs_overflow)
+    # the scheduler tick is skipped if the previous one is still being processed
+    ticks_q = pipeline.queue('ticks', 1, turbine.DROP_NEWEST)
+    # the model always gets the most recent window. A dropped batch gives its buffers back
+    inputs_q = pipeline.queue('inputs', 1, turbine.DROP_OLDEST, on_drop=lambda item: item[0].runner.release(item[1]))
+    # summaries of the metrics published in the logs stream, if enabled
+    metrics_q = pipeline.queue('metrics', 1, turbine.DROP_OLDEST) if metrics_summary else None
+    results_q = pipeline.queue('results', args.results_queue_size, args.results_overflow)
+
+    # Some constants used for data prep + compare the results
+    file_path = os.path.dirname(__file__)
+    # baked in the component, for the models delivered without their own statistics
+    statistics = turbine.load_statistics(os.path.join(file_path, 'statistics'), dtype)
+    thresholds, raw_std, mean, std = statistics.thresholds, statistics.raw_std, statistics.mean, statistics.std
+
+    # gateway mode: one process serves several turbines, each one with its own window
+    # In single turbine mode the gateway holds just one turbine
+    if args.gateway:
+        raw_topic = GATEWAY_RAW_TOPIC
+    # when the predictions fall behind, the windows of the backlog are scored in a single run
+    # optional first tier: the windows which didn't change since the last model run of their turbine reuse its scores
+    cascade = None
+    if args.cascade:
+        cascade = turbine.Cascade(mean, std, thresholds, args.cascade_z_limit, args.cascade_change_limit, args.cascade_margin,
+            args.cascade_max_skips, metrics=metrics)
+    gateway = turbine.Gateway(MIN_NUM_SAMPLES, NUM_FEATURES, raw_std, 'db6', args.max_turbines, args.catch_up_windows, metrics=metrics, cascade=cascade, dtype=dtype)
 
     # Connect to the broker to acquire simulated data
     logging.info("Connecting to MQTT broker...")
@@ -100,6 +163,8 @@ if __name__ == '__main__':
     client.connected_flag=False
     client.on_connect = on_connect
     client.on_message = on_message
+    # clear the advertised wire formats if we disconnect unexpectedly
+    client.will_set(turbine.WIRE_FORMATS_TOPIC, b'', retain=True)
     client.loop_start()
     client.connect(args.broker, int(args.port))
     while not client.connected_flag: #wait in loop
@@ -107,83 +172,85 @@ if __name__ == '__main__':
         time.sleep(1)
     logging.info("Connected")
 
-    # Initialize the OTA Model Manager
-    model_name = args.model_name
-    model_version = args.model_version
-
     # load model -> since the artifact is an archive, we create in the recipe an env
     # variable containing the decompressed path to the model
-    sess = None
-    try:
-        sess = ort.InferenceSession(args.model_path)
-    except Exception as e:
-        logging.error(e)
+    session_params = {
+        'intra_op_num_threads': args.intra_op_threads,
+        'inter_op_num_threads': args.inter_op_threads,
+        'execution_mode': args.execution_mode,
+        'graph_optimization_level': args.graph_optimization_level,
+        'cache_dir': args.session_cache_dir
+    }
+    holder = turbine.ModelHolder(lambda path: turbine.create_session(path, session_params),
+        np.zeros((1, NUM_FEATURES, 10, 10), dtype=np.float32),
+        # IO binding on buffers sized for the windows of all the turbines
+        runner_factory=lambda session: turbine.BoundRunner(session, max_batch=gateway.max_turbines + gateway.catch_up, metrics=metrics),
+        metrics=metrics,
+        # the statistics bundle shipped with the model (memory mapped), checked against it
+        statistics_loader=lambda path: turbine.load_model_statistics(path, dtype))
+    if not holder.load(args.model_path, args.model_name, args.model_version):
         exit()
 
     cloud_connector = turbine.CloudConnector()
     
-    # Some constants used for data prep + compare the results
-    file_path = os.path.dirname(__file__)
-    thresholds = np.load(os.path.join(file_path, 'statistics/thresholds.npy'))
-    raw_std = np.load(os.path.join(file_path, 'statistics/raw_std.npy'))
-    mean = np.load(os.path.join(file_path, 'statistics/mean.npy'))
-    std = np.load(os.path.join(file_path, 'statistics/std.npy'))
-    
+    # preprocess and infer, shared with the replay benchmark
+    stages = turbine.DetectionStages(holder, gateway, statistics, TIME_STEPS, STEP, cascade)
+
+    def publish_inference(results):
+        # publish data to visualize in dashboard, one message per window
+        for result in results:
+            cloud_connector.publish_inference(*result)
+
+    pipeline.stage('preprocess', stages.preprocess, ticks_q, inputs_q)
+    pipeline.stage('infer', stages.infer, inputs_q, results_q)
+    pipeline.stage('publish_inference', publish_inference, results_q)
+    # the raw samples are sent in compressed batches of up to --logs-batch-size samples, at least
+    # every --logs-batch-ms: one IoT message and one Lambda run per batch. 0: one message per sample
+    uplink = None
+    if args.logs_batch_size > 0:
+        uplink = turbine.BatchPublisher(cloud_connector.publish_raw_batch, args.logs_batch_size, args.logs_batch_ms / 1000, metrics=metrics)
+        pipeline.stage('publish_logs', uplink.add, logs_q, idle=uplink.poll, idle_interval=uplink.max_delay / 4)
+    else:
+        pipeline.stage('publish_logs', cloud_connector.publish_logs, logs_q)
+    if metrics_q is not None:
+        pipeline.stage('publish_metrics', cloud_connector.publish_metrics, metrics_q)
+    pipeline.start()
+
+    # the inference is driven by deadlines, not by the incoming data
+    scheduler = turbine.DeadlineScheduler(PREDICTIONS_INTERVAL, metrics=metrics)
     try:
-        while True:
-            cloud_connector.publish_logs(tokens_q.get())
-
-            if q.qsize() <= MIN_NUM_SAMPLES:
-                if q.qsize() % 10 == 0:
-                    logging.info('Buffering %d/%d... please wait' % (q.qsize(), MIN_NUM_SAMPLES))
-                    time.sleep(1)
-                # buffering
+        while scheduler.wait():
+            if len(gateway) == 0:
+                logging.info('Waiting for data...')
                 continue
-
-            # prep the data for the model
-            li = list(q.queue)
-            data = np.array(li) # create a copy
-            q.get() # remove the oldest sample            
-            data = np.array([turbine.wavelet_denoise(data[:,i], raw_std[i], 'db6') for i in range(NUM_FEATURES)])
-            data = data.transpose((1,0))
-            data -= mean
-            data /= std
-            data = data[-(TIME_STEPS+STEP):]
-
-            x = turbine.create_dataset(data, TIME_STEPS, STEP)
-            x = np.transpose(x, (0, 2, 1)).reshape(x.shape[0], NUM_FEATURES, 10, 10).astype(np.float32)
-
-            # Now we can run our model using the loaded data
-            # The run command lets you specify which outputs you want to get returned. it only has one output.
-            ptemp = sess.run(None, {"input": x})
-
-            # We are converting the prediction output to a numpy array so that we can convert it into
-            # something human readable
-            p = np.asarray(ptemp[0])
-
-            a = x.reshape(x.shape[0], NUM_FEATURES, 100).transpose((0,2,1))
-            b = p.reshape(p.shape[0], NUM_FEATURES, 100).transpose((0,2,1))
-            
-            # check the anomalies
-            pred_mae_loss = np.mean(np.abs(b - a), axis=1).transpose((1,0))
-            values = np.mean(pred_mae_loss, axis=1)
-            anomalies = (values > thresholds)
-            
-            # publish data to visualize in dashboard
-            ts = "%s+00:00" % datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
-            cloud_connector.publish_inference(anomalies.astype(np.float32), values.astype(np.float32), model_name, model_version, ts)
-
-            if anomalies.any():
-                logging.info("Anomaly detected: %s" % anomalies)
-            else:
-                logging.info("Ok")
-
-            time.sleep(PREDICTIONS_INTERVAL)
+            for turbine_id, num_samples in gateway.buffering().items():
+                logging.info('Buffering %s%d/%d... please wait' % ('' if turbine_id is None else turbine_id + ' ', num_samples, MIN_NUM_SAMPLES))
+            ticks_q.put(scheduler.deadline)
+            if scheduler.ticks % STATS_INTERVAL == 0:
+                stats = pipeline.stats()
+                stats['scheduler'] = scheduler.stats()
+                stats['gateway'] = gateway.stats()
+                stats['model'] = holder.stats()
+                model = holder.get()
+                if model is not None:
+                    stats['runner'] = model.runner.stats()
+                stats['parser'] = {'parsed': telemetry_parser.parsed, 'malformed': telemetry_parser.malformed}
+                if uplink is not None:
+                    stats['uplink'] = uplink.stats()
+                logging.info("Pipeline stats: %s" % json.dumps(stats))
+                if metrics_q is not None:
+                    metrics_q.put(metrics.summary())
     except KeyboardInterrupt as e:
         pass
     except Exception as e:
         logging.error(e)
 
     logging.info("Shutting down")
+    pipeline.stop(5)
+    if uplink is not None:
+        uplink.flush() # the samples of the last batch
+    if metrics_server is not None:
+        metrics_server.stop()
+    client.publish(turbine.WIRE_FORMATS_TOPIC, b'', retain=True).wait_for_publish(1)
     client.loop_stop()
     client.disconnect()
\ No newline at end of file
@@ -0,0 +1,311 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+    Offline scoring of historical telemetry, with the same preprocessing
+    and model as the edge application, so the results match the ones
+    published by the devices:
+
+        python -m turbine.backfill telemetry.csv scores.parquet --turbine-column device_name --time-column ts
+
+    The input (CSV with a header, or Parquet) has one row per sample, with
+    the columns of RAW_COLUMNS. It is streamed in chunks: for each turbine,
+    every STEP samples, the last MIN_NUM_SAMPLES samples are denoised,
+    normalized and the window of TIME_STEPS samples scored, like a
+    prediction of the edge application. The windows are denoised and
+    scored in large batches, by several processes.
+
+    The output (Parquet, or CSV) has one row per window: turbine id, index
+    and time of its last sample, score and anomaly flag of each feature
+'''
+import argparse
+import csv
+import logging
+import os
+import time
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+import numpy as np
+from turbine.constants import MIN_NUM_SAMPLES, TIME_STEPS, STEP, FEATURES_IDX, NUM_FEATURES
+from turbine.util import prepare_features, denoise_windows, create_model_input
+from turbine.session import create_session
+from turbine.binding import BoundRunner
+from turbine.statistics import load_statistics, load_model_statistics
+
+# fields of a sample, in the order published in turbine/raw
+RAW_COLUMNS = ['device_ts', 'device_freemem', 'rps', 'wind_speed_rps', 'voltage', 'qw', 'qx', 'qy', 'qz',
+    'gx', 'gy', 'gz', 'aax', 'aay', 'aaz', 'gearbox_temp', 'ambient_temp', 'air_humidity', 'air_pressure', 'air_quality']
+FEATURE_NAMES = ['roll', 'pitch', 'yaw', 'wind_speed_rps', 'rps', 'voltage']
+
+def read_csv(path, chunk_rows, turbine_column=None, time_column=None):
+    '''
+        Chunks of (turbine ids, times, raw samples) of a CSV file with a
+        header. ids and times are None when their column isn't set
+    '''
+    with open(path, 'r') as f:
+        header = next(csv.reader([f.readline()]))
+        def index(name):
+            if name not in header:
+                raise ValueError('Column %s not found in %s' % (name, path))
+            return header.index(name)
+        features = [index(RAW_COLUMNS[i]) for i in FEATURES_IDX]
+        while True:
+            lines = list(islice(f, chunk_rows))
+            if len(lines) == 0:
+                break
+            raw = np.loadtxt(lines, delimiter=',', usecols=features, ndmin=2)
+            ids = None if turbine_column is None else np.loadtxt(lines, delimiter=',', usecols=index(turbine_column), dtype=str, ndmin=1)
+            times = None if time_column is None else np.loadtxt(lines, delimiter=',', usecols=index(time_column), dtype=str, ndmin=1)
+            yield ids, times, raw
+
+def read_parquet(path, chunk_rows, turbine_column=None, time_column=None):
+    '''
+        Same as read_csv, for a Parquet file (requires pyarrow)
+    '''
+    import pyarrow.parquet as pq
+    features = [RAW_COLUMNS[i] for i in FEATURES_IDX]
+    columns = features + [c for c in (turbine_column, time_column) if c is not None]
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+        raw = np.column_stack([batch.column(c).to_numpy(zero_copy_only=False) for c in features]).astype(np.float64)
+        ids = None if turbine_column is None else np.asarray(batch.column(turbine_column).to_pylist(), dtype=str)
+        times = None if time_column is None else batch.column(time_column).to_numpy(zero_copy_only=False)
+        yield ids, times, raw
+
+class CsvWriter(object):
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.header = False
+
+    def write(self, columns):
+        if not self.header:
+            self.writer.writerow(list(columns))
+            self.header = True
+        values = [c.tolist() if isinstance(c, np.ndarray) else c for c in columns.values()]
+        self.writer.writerows(zip(*values))
+
+    def close(self):
+        self.file.close()
+
+class ParquetWriter(object):
+    '''
+        Appends each chunk of results as a row group (requires pyarrow)
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+
+    def write(self, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.table({k: pa.array(v) for k, v in columns.items()})
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+class Windows(object):
+    '''
+        Splits the samples of each turbine into the windows of the
+        predictions: one every step samples, ending with the last sample.
+        The samples of the next windows are kept until the next chunk
+    '''
+    def __init__(self, window_size=MIN_NUM_SAMPLES, step=STEP):
+        self.window_size = window_size
+        self.step = step
+        self.pending = {} # turbine id -> (features, times, index of the first sample)
+
+    def add(self, turbine_id, features, times=None):
+        '''
+            Returns (turbine_id, index and time of the last sample of each
+            window, samples of the windows), None if no window is complete
+        '''
+        start = 0
+        if turbine_id in self.pending:
+            old_features, old_times, start = self.pending[turbine_id]
+            features = np.concatenate([old_features, features])
+            if times is not None:
+                times = np.concatenate([old_times, times])
+        count = 0 if len(features) < self.window_size else (len(features) - self.window_size) // self.step + 1
+        # the next window starts count steps later
+        self.pending[turbine_id] = (features[count * self.step:], None if times is None else times[count * self.step:], start + count * self.step)
+        if count == 0:
+            return None
+        last = self.window_size - 1 + self.step * np.arange(count)
+        return turbine_id, start + last, None if times is None else times[last], features[:last[-1] + 1]
+
+class Scorer(object):
+    '''
+        Denoising, normalization and scoring of the windows of a turbine,
+        in batches of batch_size windows run with IO binding. The statistics
+        bundle shipped with the model is used, like on the edge, the .npy
+        files of statistics_dir only for a model without one. The samples
+        are denoised and normalized in dtype, like the dtype of the edge
+    '''
+    def __init__(self, model_path, statistics_dir, session_params=None, batch_size=256, window_size=MIN_NUM_SAMPLES, dtype=np.float64):
+        statistics = load_model_statistics(model_path, dtype)
+        if statistics is None:
+            statistics = load_statistics(statistics_dir, dtype)
+        self.dtype = dtype
+        self.thresholds, self.raw_std, self.mean, self.std = statistics.thresholds, statistics.raw_std, statistics.mean, statistics.std
+        self.window_size = window_size
+        self.runner = BoundRunner(create_session(model_path, session_params), max_batch=batch_size, num_buffers=1)
+        self.batch_size = batch_size
+
+    def score(self, samples):
+        '''
+            Scores and anomalies (windows, F) of the windows of samples, one
+            every STEP samples
+        '''
+        samples = np.asarray(samples, dtype=self.dtype)
+        windows = np.lib.stride_tricks.sliding_window_view(samples, self.window_size, axis=0)[::STEP]
+        scores = np.empty((len(windows), NUM_FEATURES), dtype=np.float32)
+        anomalies = np.empty((len(windows), NUM_FEATURES), dtype=bool)
+        buffers = self.runner.acquire()
+        try:
+            for i in range(0, len(windows), self.batch_size):
+                n = min(self.batch_size, len(windows) - i)
+                self.prepare(np.moveaxis(windows[i:i+n], -1, 1), buffers.input[:n])
+                outputs = dict(zip(self.runner.output_names, self.runner.run(buffers, n)))
+                if 'scores' in outputs:
+                    # scored by the model, against the thresholds embedded in it
+                    scores[i:i+n] = outputs['scores']
+                    anomalies[i:i+n] = outputs['anomalies']
+                else:
+                    x = buffers.input[:n]
+                    p = outputs[self.runner.output_names[0]].reshape(x.shape)
+                    scores[i:i+n] = np.abs(p - x).mean(axis=(2, 3))
+                    anomalies[i:i+n] = scores[i:i+n] > self.thresholds
+        finally:
+            self.runner.release(buffers)
+        return scores, anomalies
+
+    def prepare(self, windows, out):
+        '''
+            (N, window_size, F) raw windows -> (N, F, rows, cols) model
+            input, same as Gateway.prepare_batch for each window
+        '''
+        # the last TIME_STEPS+STEP samples give the window of a prediction of the edge
+        data = denoise_windows(windows, self.raw_std, 'db6', self.mean, self.std, TIME_STEPS + STEP)
+        for i, d in enumerate(data):
+            create_model_input(d, TIME_STEPS, STEP, out=out[i:])
+
+scorer = None # of the worker process
+
+def init_worker(*args):
+    global scorer
+    scorer = Scorer(*args)
+
+def score_task(task):
+    turbine_id, last, times, samples = task
+    scores, anomalies = scorer.score(samples)
+    return turbine_id, last, times, scores, anomalies
+
+def results_columns(result):
+    turbine_id, last, times, scores, anomalies = result
+    columns = {'turbine_id': [turbine_id] * len(last), 'sample': last}
+    if times is not None:
+        columns['time'] = times
+    for i, name in enumerate(FEATURE_NAMES):
+        columns['score_%s' % name] = scores[:, i]
+    for i, name in enumerate(FEATURE_NAMES):
+        columns['anomaly_%s' % name] = anomalies[:, i]
+    columns['anomaly'] = anomalies.any(axis=1)
+    return columns
+
+def backfill(input_path, output_path, model_path, statistics_dir, turbine_column=None, time_column=None,
+        chunk_rows=50000, batch_size=256, processes=None, session_params=None, dtype=np.float64):
+    '''
+        Score all the windows of the telemetry in input_path and write the
+        results to output_path. Parquet files are read/written with pyarrow,
+        other files as CSV. Returns a summary of the run
+    '''
+    processes = processes or os.cpu_count()
+    if processes > 1:
+        # one onnxruntime thread per process by default, the processes use the cores
+        session_params = dict({'intra_op_num_threads': 1}, **(session_params or {}))
+    reader = read_parquet if input_path.endswith('.parquet') else read_csv
+    writer = ParquetWriter(output_path) if output_path.endswith('.parquet') else CsvWriter(output_path)
+    windows = Windows()
+    summary = {'samples': 0, 'windows': 0, 'anomalies': 0}
+
+    def tasks():
+        for ids, times, raw in reader(input_path, chunk_rows, turbine_column, time_column):
+            summary['samples'] += len(raw)
+            features = prepare_features(raw)
+            if ids is None:
+                groups = [(None, slice(None))]
+            else:
+                groups = [(i, ids == i) for i in np.unique(ids)]
+            for turbine_id, rows in groups:
+                task = windows.add(turbine_id, features[rows], None if times is None else times[rows])
+                if task is not None:
+                    yield task
+
+    def write(result):
+        columns = results_columns(result)
+        summary['windows'] += len(columns['sample'])
+        summary['anomalies'] += int(columns['anomaly'].sum())
+        writer.write(columns)
+
+    start = time.perf_counter()
+    init_args = (model_path, statistics_dir, session_params, batch_size, MIN_NUM_SAMPLES, dtype)
+    try:
+        if processes == 1:
+            init_worker(*init_args)
+            for task in tasks():
+                write(score_task(task))
+        else:
+            with Pool(processes, initializer=init_worker, initargs=init_args) as pool:
+                # a few tasks ahead per process, the input is not read faster than it is scored
+                pending = deque()
+                for task in tasks():
+                    pending.append(pool.apply_async(score_task, (task,)))
+                    if len(pending) >= 2 * processes:
+                        write(pending.popleft().get())
+                while len(pending) > 0:
+                    write(pending.popleft().get())
+    finally:
+        writer.close()
+    summary['seconds'] = time.perf_counter() - start
+    summary['turbines'] = len(windows.pending)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline scoring of historical telemetry')
+    parser.add_argument('input', type=str, help='CSV (with a header) or Parquet file, one sample per row')
+    parser.add_argument('output', type=str, help='results file, Parquet if it ends with .parquet, CSV otherwise')
+    parser.add_argument('--model', type=str, default='windturbine.onnx', help='ONNX model (the .ort model next to it is preferred)')
+    parser.add_argument('--statistics', type=str, default='statistics', help='folder with the .npy statistics, for a model without its statistics bundle')
+    parser.add_argument('--turbine-column', type=str, default=None, help='column with the turbine id, a single turbine if not set')
+    parser.add_argument('--time-column', type=str, default=None, help='column with the time of the samples, copied to the results')
+    parser.add_argument('--chunk-rows', type=int, default=50000, help='rows read at once')
+    parser.add_argument('--batch-size', type=int, default=256, help='windows per model run')
+    parser.add_argument('--processes', type=int, default=None, help='scoring processes, default: one per core')
+    parser.add_argument('--dtype', type=str, default='float64', choices=['float64', 'float32'], help='precision of the preprocessing, like "dtype" of the edge application')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    summary = backfill(args.input, args.output, args.model, args.statistics, args.turbine_column, args.time_column,
+        args.chunk_rows, args.batch_size, args.processes, dtype=np.dtype(args.dtype))
+    logging.info('%d samples of %d turbines, %d windows scored (%d anomalies) in %.1fs: %.0f windows/s' % (
+        summary['samples'], summary['turbines'], summary['windows'], summary['anomalies'], summary['seconds'],
+        summary['windows'] / max(summary['seconds'], 1e-9)))
+
+if __name__ == '__main__':
+    main()
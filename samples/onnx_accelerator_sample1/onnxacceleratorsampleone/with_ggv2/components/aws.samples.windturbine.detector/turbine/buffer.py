@@ -0,0 +1,98 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import threading
+import numpy as np
+
+class RingBuffer(object):
+    '''
+        Fixed capacity, thread safe buffer of feature vectors.
+
+        Samples are written twice (at idx and idx+capacity) into a
+        preallocated (2*capacity, num_features) array, so the latest
+        N samples are always contiguous and can be returned as a view.
+        When the buffer is full the oldest sample is overwritten and
+        counted as dropped.
+    '''
+    def __init__(self, capacity, num_features, dtype=np.float64):
+        self.capacity = capacity
+        self.num_features = num_features
+        self.lock = threading.Lock()
+        self.data = np.zeros((2 * capacity, num_features), dtype=dtype)
+        self.head = 0 # next position to be written
+        self.size = 0
+        self.total = 0 # number of samples ever appended
+        self.dropped = 0
+
+    def __len__(self):
+        return self.size
+
+    def is_full(self):
+        return self.size == self.capacity
+
+    def append(self, sample):
+        with self.lock:
+            self.data[self.head] = sample
+            self.data[self.head + self.capacity] = sample
+            self.head = (self.head + 1) % self.capacity
+            self.total += 1
+            if self.size == self.capacity:
+                self.dropped += 1
+            else:
+                self.size += 1
+
+    def extend(self, samples):
+        '''
+            Append a (N, num_features) micro-batch of samples at once
+        '''
+        samples = np.asarray(samples)
+        count = samples.shape[0]
+        with self.lock:
+            # only the last capacity samples survive
+            kept = samples[-self.capacity:]
+            start = (self.head + count - kept.shape[0]) % self.capacity
+            first = min(kept.shape[0], self.capacity - start)
+            # two copies of each sample, split where the buffer wraps around
+            for offset in (0, self.capacity):
+                self.data[offset + start:offset + start + first] = kept[:first]
+                self.data[offset:offset + kept.shape[0] - first] = kept[first:]
+            self.head = (self.head + count) % self.capacity
+            self.total += count
+            overflow = max(0, self.size + count - self.capacity)
+            self.dropped += overflow
+            self.size += count - overflow
+
+    def latest(self, n=None):
+        '''
+            Return a read-only view of the latest n samples (oldest first).
+            The view stays valid for the next (capacity - n) appends, copy it
+            if it needs to live longer than that.
+        '''
+        with self.lock:
+            n = self.size if n is None else n
+            if n > self.size:
+                raise ValueError('Requested %d samples, buffer has %d' % (n, self.size))
+            end = self.head + self.capacity
+            view = self.data[end - n:end]
+        view.flags.writeable = False
+        return view
+
+    def clear(self):
+        '''
+            Empty the buffer. total and dropped keep accumulating, they count
+            the samples since the buffer was created
+        '''
+        with self.lock:
+            self.head = 0
+            self.size = 0
@@ -42,7 +42,33 @@ class CloudConnector(object):
         except Exception as e:
             print("failed to publish message:", e)
 
-    def publish_inference(self, anomalies, values, model_name, model_version, ts):
+    def publish_raw_batch(self, payload):
+        # a batch of raw samples, encoded by turbine.uplink. Errors are counted by the BatchPublisher
+        op = self.ipc_client.new_publish_to_iot_core()
+        op.activate(model.PublishToIoTCoreRequest(
+            topic_name="device/{}/logs".format(os.environ["AWS_IOT_THING_NAME"]),
+            qos=model.QOS.AT_LEAST_ONCE,
+            payload=payload,
+        ))
+        op.get_response().result(timeout=5.0)
+
+    def publish_metrics(self, summary):
+        dictionary = {
+            "type": "metrics",
+            "data": summary
+        }
+        op = self.ipc_client.new_publish_to_iot_core()
+        op.activate(model.PublishToIoTCoreRequest(
+            topic_name="device/{}/logs".format(os.environ["AWS_IOT_THING_NAME"]),
+            qos=model.QOS.AT_LEAST_ONCE,
+            payload=json.dumps(dictionary).encode(),
+        ))
+        try:
+            op.get_response().result(timeout=5.0)
+        except Exception as e:
+            print("failed to publish metrics:", e)
+
+    def publish_inference(self, anomalies, values, model_name, model_version, ts, turbine_id=None):
         dictionary = {
             "type": "inference",
             "model_name": model_name,
@@ -51,6 +77,9 @@ class CloudConnector(object):
             "values": values.tolist(),
             "ts": ts
         }
+        if turbine_id is not None:
+            # gateway mode: the device serves several turbines
+            dictionary["turbine_id"] = turbine_id
         op = self.ipc_client.new_publish_to_iot_core()
         op.activate(model.PublishToIoTCoreRequest(
             topic_name="device/{}/logs".format(os.environ["AWS_IOT_THING_NAME"]),
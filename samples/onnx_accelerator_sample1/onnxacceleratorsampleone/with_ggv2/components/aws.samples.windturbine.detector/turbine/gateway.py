@@ -0,0 +1,233 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import logging
+import threading
+import time
+import numpy as np
+from turbine.buffer import RingBuffer
+from turbine.util import create_model_input, denoise_windows
+
+def turbine_id_from_topic(topic, default=None):
+    '''
+        turbine/<turbine_id>/raw -> turbine_id, default for turbine/raw
+    '''
+    parts = topic.split('/')
+    return parts[1] if len(parts) == 3 else default
+
+class TurbineWindow(object):
+    '''
+        Samples and prediction state of a single turbine
+    '''
+    def __init__(self, turbine_id, window_size, num_features, dtype=np.float64):
+        self.turbine_id = turbine_id
+        # twice the window, so a view of the latest samples isn't overwritten while it is processed
+        self.samples = RingBuffer(2 * window_size, num_features, dtype)
+        self.scored = 0 # samples.total at the last prediction
+        self.scored_time = None # time of the last prediction
+
+class Gateway(object):
+    '''
+        Keeps a sliding window per turbine and scores all the turbines with
+        new data in a single batched model run.
+        A turbine is normally scored on the window of its latest samples. When
+        the predictions fall behind (more than one step of new samples since
+        the last one), up to catch_up windows, one step apart, are scored
+        instead, so every window of the backlog gets a result.
+        The windows of all the turbines are denoised in a single call.
+        With a cascade (see turbine.Cascade), the windows it skips are
+        neither denoised nor scored, see reused_scores().
+        The samples are kept, denoised and normalized in dtype: with
+        float32, the whole path runs in the precision of the model input
+    '''
+    def __init__(self, window_size, num_features, noise_sigmas, wavelet='db6', max_turbines=100, catch_up=0, clock=time.time, metrics=None, cascade=None,
+            dtype=np.float64):
+        self.window_size = window_size
+        self.num_features = num_features
+        self.noise_sigmas = noise_sigmas
+        self.wavelet = wavelet
+        self.max_turbines = max_turbines
+        self.catch_up = catch_up # max windows per turbine and prediction, 0: disabled
+        self.clock = clock
+        self.cascade = cascade
+        self.dtype = dtype
+        self.reused = [] # (turbine id, time, scores) of the windows skipped by the cascade
+        self.turbines = {}
+        self.lock = threading.Lock()
+        self.rejected = 0 # samples of turbines over max_turbines
+        self.predictions = 0 # windows scored
+        self.catch_ups = 0 # predictions with more than one window
+        self.skipped = 0 # windows of the backlog not scored
+        self.denoise_time = self.window_time = None
+        if metrics is not None:
+            self.denoise_time = metrics.histogram('denoise_seconds', 'Denoising and normalization of the windows of a prediction')
+            self.window_time = metrics.histogram('window_seconds', 'Conversion of the denoised samples of a prediction into model input windows')
+            metrics.gauge('turbines', 'Turbines served', lambda: len(self.turbines))
+            metrics.counter('samples_rejected_total', 'Samples of the turbines over max_turbines', lambda: self.rejected)
+            metrics.counter('samples_dropped_total', 'Samples overwritten in the turbine buffers before they were scored', self.dropped)
+            metrics.counter('windows_scored_total', 'Windows scored by the model', lambda: self.predictions)
+            metrics.counter('windows_skipped_total', 'Windows of a backlog not scored', lambda: self.skipped)
+
+    def __len__(self):
+        return len(self.turbines)
+
+    def extend(self, turbine_id, samples):
+        state = self.turbines.get(turbine_id)
+        if state is None:
+            with self.lock:
+                if len(self.turbines) >= self.max_turbines:
+                    self.rejected += len(samples)
+                    logging.error('Too many turbines, ignoring %s' % turbine_id)
+                    return
+                state = TurbineWindow(turbine_id, self.window_size, self.num_features, self.dtype)
+                self.turbines[turbine_id] = state
+                logging.info('New turbine: %s' % turbine_id)
+        state.samples.extend(samples)
+
+    def dropped(self):
+        '''
+            Samples overwritten in the buffers of all the turbines
+        '''
+        with self.lock:
+            states = list(self.turbines.values())
+        return sum(s.samples.dropped for s in states)
+
+    def buffering(self):
+        '''
+            Number of samples of the turbines that don't have a full window yet
+        '''
+        with self.lock:
+            states = list(self.turbines.values())
+        return {s.turbine_id: len(s.samples) for s in states if len(s.samples) < self.window_size}
+
+    def num_windows(self, state, time_steps, step):
+        '''
+            Number of windows to score for a turbine: 1, or the windows of the
+            backlog when it is lagging. The first prediction is never a catch
+            up, the samples were just buffering
+        '''
+        backlog = (state.samples.total - state.scored) // step
+        if self.catch_up <= 0 or state.scored == 0 or backlog < 2:
+            return 1
+        # windows of the backlog still in the denoised window
+        count = min(backlog, self.catch_up, (self.window_size - time_steps) // step)
+        self.skipped += backlog - count
+        return count
+
+    def set_noise_sigmas(self, noise_sigmas):
+        '''
+            Denoising thresholds of a new model, for all the turbines
+        '''
+        with self.lock:
+            self.noise_sigmas = noise_sigmas
+
+    def prepare_batch(self, time_steps, step, mean, std, out=None, noise_sigmas=None):
+        '''
+            Denoise and normalize the windows of the turbines with new samples
+            since their last prediction. Returns, for each window (oldest
+            first for a turbine), the turbine id and the estimated time of its
+            last sample, and the stacked model input (windows, F, rows, cols),
+            written in the first rows of out if given. The turbines that don't
+            fit in out are left for the next batch.
+            noise_sigmas replaces the denoising thresholds if it is another array
+        '''
+        if noise_sigmas is not None and noise_sigmas is not self.noise_sigmas:
+            self.set_noise_sigmas(noise_sigmas)
+        with self.lock:
+            states = list(self.turbines.values())
+        now = self.clock()
+        ids, times, inputs = [], [], []
+        counts, windows = [], []
+        rows = 0
+        for state in states:
+            if len(state.samples) < self.window_size or state.samples.total == state.scored:
+                continue
+            if out is not None and rows == len(out):
+                break
+            count = self.num_windows(state, time_steps, step)
+            if out is not None and count > len(out) - rows:
+                # only the most recent windows of the backlog fit
+                self.skipped += count - (len(out) - rows)
+                count = len(out) - rows
+            if self.cascade is not None and count == 1:
+                scores = self.cascade.check(state.turbine_id, state.samples.latest(time_steps), step)
+                if scores is not None:
+                    state.scored = state.samples.total
+                    state.scored_time = now
+                    self.reused.append((state.turbine_id, now, scores))
+                    continue
+            if count > 1:
+                self.catch_ups += 1
+                # samples are assumed evenly spaced since the last prediction
+                period = (now - state.scored_time) / (state.samples.total - state.scored)
+                times += [now - (count - i) * step * period for i in range(count)]
+            else:
+                times.append(now)
+            state.scored = state.samples.total
+            state.scored_time = now
+            ids += [state.turbine_id] * count
+            rows += count
+            counts.append(count)
+            windows.append(state.samples.latest(self.window_size))
+        if len(ids) == 0:
+            return ids, times, None
+
+        start = time.perf_counter()
+        # one wavelet decomposition for the stacked windows of all the turbines, the last
+        # time_steps+count*step denoised samples of a turbine give count windows, step apart
+        data = denoise_windows(np.stack(windows), self.noise_sigmas, self.wavelet, mean, std, [time_steps + count * step for count in counts])
+        denoised_time = time.perf_counter()
+        rows = 0
+        for d in data:
+            if out is None:
+                inputs.append(create_model_input(d, time_steps, step))
+            else:
+                rows += len(create_model_input(d, time_steps, step, out=out[rows:]))
+        if self.denoise_time is not None:
+            self.denoise_time.observe(denoised_time - start)
+            self.window_time.observe(time.perf_counter() - denoised_time)
+        self.predictions += len(ids)
+        if out is None:
+            return ids, times, np.concatenate(inputs)
+        return ids, times, out[:rows]
+
+    def reused_scores(self):
+        '''
+            (turbine id, time, scores) of the windows skipped by the cascade
+            since the last call, to be published with the scored ones
+        '''
+        reused, self.reused = self.reused, []
+        return reused
+
+    def update_scores(self, ids, scores):
+        '''
+            Scores of the windows run by the model, for the cascade
+        '''
+        if self.cascade is not None:
+            self.cascade.update(ids, scores)
+
+    def scores(self, x, p, num_windows):
+        '''
+            Mean absolute reconstruction error of each window and feature:
+            (num_windows, F)
+        '''
+        error = np.abs(p.reshape(x.shape) - x)
+        return error.reshape(num_windows, -1, x.shape[1], x.shape[2] * x.shape[3]).mean(axis=(1, 3))
+
+    def stats(self):
+        stats = {'turbines': len(self.turbines), 'rejected': self.rejected, 'dropped': self.dropped(), 'predictions': self.predictions,
+            'catch_ups': self.catch_ups, 'skipped': self.skipped}
+        if self.cascade is not None:
+            stats['cascade'] = self.cascade.stats()
+        return stats
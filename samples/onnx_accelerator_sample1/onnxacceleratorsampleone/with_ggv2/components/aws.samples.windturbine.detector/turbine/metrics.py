@@ -0,0 +1,222 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# latency buckets in seconds, from 0.1 ms to 10 s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_PREFIX = 'windturbine_'
+METRICS_PORT = 9110
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Histogram(object):
+    '''
+        Thread safe histogram of durations, with the le (less or equal)
+        buckets of Prometheus
+    '''
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+def quantile(buckets, counts, q):
+    '''
+        Estimate of the q quantile, interpolated in its bucket like the
+        histogram_quantile function of Prometheus. None without observations
+    '''
+    total = sum(counts)
+    if total == 0:
+        return None
+    rank = q * total
+    cumulative = 0
+    for i, count in enumerate(counts):
+        if count > 0 and cumulative + count >= rank:
+            if i == len(buckets):
+                return buckets[-1]
+            lower = 0.0 if i == 0 else buckets[i - 1]
+            return lower + (buckets[i] - lower) * (rank - cumulative) / count
+        cumulative += count
+    return buckets[-1]
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metrics(object):
+    '''
+        Registry of the application metrics: histograms, observed by the
+        instrumented code, and gauges/counters, read from the stats of the
+        components when rendered. A metric has at most one label.
+        Components taking an optional metrics argument register their own
+    '''
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.families = {} # name -> [type, help, label name, {label value: Histogram} or function]
+        self.previous = {} # histogram snapshots of the last summary
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS, **label):
+        '''
+            Histogram name{label}, created on the first call.
+            e.g. metrics.histogram('stage_seconds', 'help', stage='infer')
+        '''
+        label_name, label_value = list(label.items())[0] if label else (None, None)
+        with self.lock:
+            family = self.families.setdefault(name, ['histogram', help, label_name, {}])
+            if label_value not in family[3]:
+                family[3][label_value] = Histogram(buckets)
+            return family[3][label_value]
+
+    def gauge(self, name, help, func, label=None):
+        '''
+            func returns the value, or a dict {label value: value} if label is set
+        '''
+        with self.lock:
+            self.families[name] = ['gauge', help, label, func]
+
+    def counter(self, name, help, func, label=None):
+        '''
+            Same as gauge, for values that only increase (name ends with _total)
+        '''
+        with self.lock:
+            self.families[name] = ['counter', help, label, func]
+
+    def values(self, func, label):
+        try:
+            values = func()
+        except Exception as e:
+            logging.error('Unable to read a metric: %s' % e)
+            return {}
+        return {None: values} if label is None else values
+
+    def render(self):
+        '''
+            All the metrics in the Prometheus text format
+        '''
+        with self.lock:
+            families = sorted((name, list(family)) for name, family in self.families.items())
+        lines = []
+        for name, (kind, help, label, value) in families:
+            name = self.prefix + name
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            if kind == 'histogram':
+                for label_value, histogram in sorted(value.items(), key=lambda i: str(i[0])):
+                    counts, total, count = histogram.snapshot()
+                    labels = [] if label is None else ['%s="%s"' % (label, escape(label_value))]
+                    cumulative = 0
+                    for bound, c in zip(list(histogram.buckets) + ['+Inf'], counts):
+                        cumulative += c
+                        lines.append('%s_bucket{%s} %d' % (name, ','.join(labels + ['le="%s"' % bound]), cumulative))
+                    suffix = '{%s}' % labels[0] if labels else ''
+                    lines.append('%s_sum%s %r' % (name, suffix, float(total)))
+                    lines.append('%s_count%s %d' % (name, suffix, count))
+            else:
+                for label_value, v in sorted(self.values(value, label).items(), key=lambda i: str(i[0])):
+                    suffix = '' if label is None else '{%s="%s"}' % (label, escape(label_value))
+                    lines.append('%s%s %r' % (name, suffix, float(v)))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        '''
+            Compact view of the metrics for the logs stream: count, mean and
+            quantiles (seconds) of the histograms since the previous summary,
+            current value of the gauges and counters
+        '''
+        with self.lock:
+            families = sorted((name, list(family)) for name, family in self.families.items())
+        result = {}
+        for name, (kind, help, label, value) in families:
+            if kind == 'histogram':
+                entries = {}
+                for label_value, histogram in value.items():
+                    counts, total, count = histogram.snapshot()
+                    previous = self.previous.get((name, label_value), ([0] * len(counts), 0.0, 0))
+                    self.previous[(name, label_value)] = (counts, total, count)
+                    counts = [c - p for c, p in zip(counts, previous[0])]
+                    count -= previous[2]
+                    entry = {'count': count}
+                    if count > 0:
+                        entry['mean'] = round((total - previous[1]) / count, 6)
+                        for q in (0.5, 0.95, 0.99):
+                            entry['p%d' % (q * 100)] = round(quantile(histogram.buckets, counts, q), 6)
+                    entries[label_value] = entry
+                result[name] = entries if label is not None else entries[None]
+            else:
+                values = self.values(value, label)
+                result[name] = values if label is not None else values.get(None)
+        return result
+
+class MetricsServer(object):
+    '''
+        Serves the metrics in the Prometheus text format on
+        http://host:port/metrics, from a daemon thread. Only reachable
+        from the device by default
+    '''
+    def __init__(self, metrics, port=METRICS_PORT, host='127.0.0.1'):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # no access log in the application logs
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        logging.info('Metrics served on http://%s:%d/metrics' % self.server.server_address[:2])
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
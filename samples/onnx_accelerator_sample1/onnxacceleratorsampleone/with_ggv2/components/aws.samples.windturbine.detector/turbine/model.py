@@ -0,0 +1,121 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import logging
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+
+# runner: optional wrapper of the session (e.g. BoundRunner), built by the runner factory
+# statistics: the ones shipped with the model (turbine.Statistics), loaded by the statistics loader
+Model = namedtuple('Model', ['session', 'name', 'version', 'runner', 'statistics'], defaults=[None])
+
+class ModelHolder(object):
+    '''
+        Double buffered inference session. load() builds and warms up the
+        new session while the current one keeps serving, then swaps them
+        atomically. A model that fails to load or to run the smoke
+        inference is discarded and the current one stays in place.
+        The statistics shipped with a model are swapped with it, a model
+        with invalid statistics is discarded too
+    '''
+    def __init__(self, session_factory, warmup_input, input_name='input', warmup_runs=3, runner_factory=None, metrics=None,
+            statistics_loader=None):
+        self.session_factory = session_factory # model path -> InferenceSession
+        self.runner_factory = runner_factory # InferenceSession -> runner
+        self.statistics_loader = statistics_loader # model path -> Statistics, None if there aren't any
+        self.warmup_input = warmup_input
+        self.input_name = input_name
+        self.warmup_runs = warmup_runs
+        self.current = None # Model, replaced as a whole so readers always get a consistent one
+        self.previous = None
+        self.load_lock = threading.Lock()
+        self.swaps = 0
+        self.failures = 0
+        self.rollbacks = 0
+        self.swap_time = None
+        if metrics is not None:
+            self.swap_time = metrics.histogram('model_swap_seconds', 'Load and warm up of the models swapped in')
+            metrics.counter('model_swaps_total', 'Models swapped in', lambda: self.swaps)
+            metrics.counter('model_failures_total', 'Models rejected', lambda: self.failures)
+            metrics.counter('model_rollbacks_total', 'Models rolled back after a runtime failure', lambda: self.rollbacks)
+
+    @property
+    def ready(self):
+        return self.current is not None
+
+    def get(self):
+        return self.current
+
+    def warmup(self, session, runner=None):
+        '''
+            Smoke inference, through the runner if any: the output must have
+            the input shape (autoencoder) and be finite
+        '''
+        if runner is None:
+            for i in range(self.warmup_runs):
+                output = np.asarray(session.run(None, {self.input_name: self.warmup_input})[0])
+        else:
+            buffers = runner.acquire()
+            try:
+                buffers.input[:len(self.warmup_input)] = self.warmup_input
+                for i in range(self.warmup_runs):
+                    output = runner.run(buffers, len(self.warmup_input))[0]
+            finally:
+                runner.release(buffers)
+        if output.size != self.warmup_input.size or not np.all(np.isfinite(output)):
+            raise ValueError('Invalid smoke inference output: %s' % str(output.shape))
+
+    def load(self, model_path, name, version):
+        '''
+            Load, warm up and swap in a new model. Blocks until it is done,
+            so it is meant to be called from a background thread.
+            Returns False if the model was rejected
+        '''
+        with self.load_lock:
+            start = time.perf_counter()
+            try:
+                session = self.session_factory(model_path)
+                runner = None if self.runner_factory is None else self.runner_factory(session)
+                self.warmup(session, runner)
+                statistics = None if self.statistics_loader is None else self.statistics_loader(model_path)
+            except Exception as e:
+                self.failures += 1
+                logging.error('Unable to load the model %s - %s, keeping the current one: %s' % (name, version, e))
+                return False
+            self.previous, self.current = self.current, Model(session, name, version, runner, statistics)
+            self.swaps += 1
+            if self.swap_time is not None:
+                self.swap_time.observe(time.perf_counter() - start)
+            logging.info('Model swapped: %s - %s' % (name, version))
+            return True
+
+    def rollback(self, model):
+        '''
+            Go back to the previous model if model, the current one, fails at runtime
+        '''
+        with self.load_lock:
+            if model is not self.current or self.previous is None:
+                return False
+            logging.error('Model %s - %s failed, rolling back to %s - %s' % (model.name, model.version, self.previous.name, self.previous.version))
+            self.current, self.previous = self.previous, None
+            self.rollbacks += 1
+            return True
+
+    def stats(self):
+        current = self.current
+        return {'name': None if current is None else current.name, 'version': None if current is None else current.version,
+            'statistics': None if current is None or current.statistics is None else current.statistics.model_version,
+            'swaps': self.swaps, 'failures': self.failures, 'rollbacks': self.rollbacks}
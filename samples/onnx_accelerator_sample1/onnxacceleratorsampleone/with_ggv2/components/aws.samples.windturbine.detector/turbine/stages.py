@@ -0,0 +1,101 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import logging
+from datetime import datetime
+import numpy as np
+
+def timestamp(t):
+    return "%s+00:00" % datetime.fromtimestamp(t).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
+
+class DetectionStages(object):
+    '''
+        preprocess and infer stages of the detection pipeline, shared by the
+        edge applications and the replay benchmark. preprocess writes the
+        windows of the turbines with new samples into the input bound to the
+        current model, infer runs the model and returns one result per window:
+        (anomalies, scores, model name, model version, timestamp, turbine id).
+        The statistics shipped with a model are used with it, the baked in
+        ones (statistics) otherwise
+    '''
+    def __init__(self, holder, gateway, statistics, time_steps, step, cascade=None):
+        self.holder = holder
+        self.gateway = gateway
+        self.statistics = statistics
+        self.time_steps = time_steps
+        self.step = step
+        self.cascade = cascade
+
+    def preprocess(self, deadline=None):
+        # the batch is scored by the model current at this time, a swap doesn't affect it
+        model = self.holder.get()
+        if model is None:
+            return None
+        # input/output buffers bound to the model, None if they are all in use
+        buffers = model.runner.acquire()
+        if buffers is None:
+            return None
+        # windows of the turbines with new samples, written straight into the bound input
+        # one row per window, several for the turbines catching up a backlog
+        stats = model.statistics or self.statistics
+        if self.cascade is not None:
+            self.cascade.set_statistics(stats.mean, stats.std, stats.thresholds)
+        ids, times, x = self.gateway.prepare_batch(self.time_steps, self.step, stats.mean, stats.std, out=buffers.input, noise_sigmas=stats.raw_std)
+        # windows skipped by the cascade, published with the scores of the last model run
+        reused = self.gateway.reused_scores()
+        if x is None and len(reused) == 0:
+            model.runner.release(buffers)
+            return None
+        return model, buffers, ids, times, reused
+
+    def infer(self, item):
+        model, buffers, ids, times, reused = item
+        thresholds = (model.statistics or self.statistics).thresholds
+        num_features = len(thresholds)
+        values = np.zeros((0, num_features), dtype=np.float32)
+        anomalies = np.zeros((0, num_features), dtype=bool)
+        try:
+            x = buffers.input[:len(ids)]
+            # Now we can run our model on the windows of all the turbines at once
+            # (none if the cascade skipped all of them)
+            if len(ids) > 0:
+                try:
+                    outputs = dict(zip(model.runner.output_names, model.runner.run(buffers, len(ids))))
+                except Exception:
+                    self.holder.rollback(model)
+                    raise
+
+                # check the anomalies
+                if 'scores' in outputs:
+                    # scored by the model, against the thresholds embedded in it (one row per window)
+                    values, anomalies = outputs['scores'].copy(), outputs['anomalies'].copy()
+                else:
+                    values = self.gateway.scores(x, outputs[model.runner.output_names[0]], len(ids))
+                    anomalies = (values > thresholds)
+        finally:
+            model.runner.release(buffers)
+        self.gateway.update_scores(ids, values)
+        if len(reused) > 0:
+            ids = ids + [r[0] for r in reused]
+            times = times + [r[1] for r in reused]
+            values = np.concatenate([values, np.array([r[2] for r in reused], dtype=values.dtype)])
+            anomalies = np.concatenate([anomalies, values[-len(reused):] > thresholds])
+
+        for turbine_id, a in zip(ids, anomalies):
+            if a.any():
+                logging.info("Anomaly detected%s: %s" % ('' if turbine_id is None else ' on %s' % turbine_id, a))
+        if not anomalies.any():
+            logging.info("Ok")
+        # in order: the windows of a turbine catching up are the oldest first
+        return [(anomalies[i].astype(np.float32), values[i].astype(np.float32), model.name, model.version, timestamp(times[i]), ids[i]) for i in range(len(ids))]
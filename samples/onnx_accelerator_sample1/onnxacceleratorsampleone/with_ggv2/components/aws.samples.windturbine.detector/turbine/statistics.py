@@ -0,0 +1,111 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import hashlib
+import json
+import mmap
+import os
+import struct
+from collections import namedtuple
+import numpy as np
+from turbine.session import model_hash
+
+# Statistics bundle shipped with a model (written by save_bundle, also used by
+# the build, see save_statistics_bundle in model_optimization.py), a single flat file:
+#   magic         8 bytes, BUNDLE_MAGIC
+#   header size   little endian uint32
+#   header        utf8 JSON: model name, version and sha256, sha256 of the
+#                 data, offset (from the data), shape and dtype of each array
+#   data          the arrays, each one aligned on BUNDLE_ALIGNMENT bytes.
+#                 The header is padded so the data is aligned too
+# so the arrays can be used straight from a memory map
+BUNDLE_MAGIC = b'WTSTATS1'
+BUNDLE_ALIGNMENT = 64
+STATISTICS_NAMES = ('thresholds', 'raw_std', 'mean', 'std')
+
+# model_*: model the statistics were computed for, None for the ones baked in the application
+Statistics = namedtuple('Statistics', list(STATISTICS_NAMES) + ['model_name', 'model_version', 'model_sha256'])
+
+def load_statistics(statistics_dir, dtype=np.float64):
+    '''
+        Statistics of the .npy files of statistics_dir (thresholds.npy, ...)
+    '''
+    arrays = [np.load(os.path.join(statistics_dir, '%s.npy' % name)).astype(dtype) for name in STATISTICS_NAMES]
+    return Statistics(*arrays, None, None, None)
+
+def bundle_path(model_path):
+    '''
+        Path of the statistics bundle shipped with model_path (same name,
+        .stats extension), None if there isn't one
+    '''
+    path = os.path.splitext(model_path)[0] + '.stats'
+    return path if path != model_path and os.path.exists(path) else None
+
+def save_bundle(path, statistics, model_path, model_name, model_version):
+    '''
+        Write the arrays of statistics (or a dict of them) in a bundle keyed
+        to the model in model_path
+    '''
+    if isinstance(statistics, Statistics):
+        statistics = statistics._asdict()
+    data = b''
+    arrays = {}
+    for name in STATISTICS_NAMES:
+        array = np.ascontiguousarray(statistics[name], dtype='<f8')
+        data += b'\0' * (-len(data) % BUNDLE_ALIGNMENT)
+        arrays[name] = {'offset': len(data), 'shape': list(array.shape), 'dtype': array.dtype.str}
+        data += array.tobytes()
+    header = json.dumps({'model_name': model_name, 'model_version': str(model_version), 'model_sha256': model_hash(model_path),
+        'data_sha256': hashlib.sha256(data).hexdigest(), 'arrays': arrays}).encode('utf8')
+    header += b' ' * (-(len(BUNDLE_MAGIC) + 4 + len(header)) % BUNDLE_ALIGNMENT)
+    # written next to the final file and renamed, a reader never sees a partial bundle
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(BUNDLE_MAGIC + struct.pack('<I', len(header)) + header + data)
+    os.replace(tmp_path, path)
+
+def load_bundle(path, model_path=None, dtype=None):
+    '''
+        Memory map a statistics bundle. The arrays are read-only views of the
+        map (copies if dtype is set and differs). Raises ValueError if the
+        bundle is corrupted, or wasn't built for the model in model_path
+    '''
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+        raise ValueError('Not a statistics bundle: %s' % path)
+    header_size, = struct.unpack_from('<I', buffer, len(BUNDLE_MAGIC))
+    data_offset = len(BUNDLE_MAGIC) + 4 + header_size
+    header = json.loads(buffer[len(BUNDLE_MAGIC) + 4:data_offset].decode('utf8'))
+    if hashlib.sha256(memoryview(buffer)[data_offset:]).hexdigest() != header['data_sha256']:
+        raise ValueError('Corrupted statistics bundle: %s' % path)
+    if model_path is not None and model_hash(model_path) != header['model_sha256']:
+        raise ValueError('%s was not built for %s' % (path, model_path))
+    arrays = []
+    for name in STATISTICS_NAMES:
+        entry = header['arrays'][name]
+        array = np.frombuffer(buffer, dtype=entry['dtype'], count=int(np.prod(entry['shape'])),
+            offset=data_offset + entry['offset']).reshape(entry['shape'])
+        if dtype is not None and array.dtype != dtype:
+            array = array.astype(dtype)
+        arrays.append(array)
+    return Statistics(*arrays, header['model_name'], header['model_version'], header['model_sha256'])
+
+def load_model_statistics(model_path, dtype=None):
+    '''
+        Statistics bundle shipped with model_path, checked against it. None
+        if there isn't one (the application uses its own statistics)
+    '''
+    path = bundle_path(model_path)
+    return None if path is None else load_bundle(path, model_path, dtype)
@@ -0,0 +1,261 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+    Post-processing of the exported ONNX model, used by build_deployment_package.py:
+    anomaly scoring subgraph and optional INT8 quantization. The statistics
+    bundle is written with the turbine package of the edge application, which
+    the build puts on the path
+'''
+import os
+import time
+import json
+import hashlib
+import tempfile
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+import onnxruntime as ort
+from onnxruntime.quantization import quantize_dynamic, quantize_static, CalibrationDataReader, QuantFormat, QuantType
+from turbine.statistics import save_bundle, load_statistics
+
+QUANTIZATION_MODES = ('none', 'dynamic', 'static')
+
+def add_scoring_subgraph(model_path, thresholds):
+    '''
+        Append the anomaly scoring to the autoencoder: per feature mean absolute
+        reconstruction error (scores) and anomaly flags (scores > thresholds),
+        with the thresholds embedded in the model. The reconstruction stays the
+        first output, so applications that compute the scores themselves still work
+    '''
+    model = onnx.load(model_path)
+    graph = model.graph
+    opset = [i.version for i in model.opset_import if i.domain in ('', 'ai.onnx')][0]
+    input_name, output_name = graph.input[0].name, graph.output[0].name
+    batch = graph.input[0].type.tensor_type.shape.dim[0]
+    batch = batch.dim_param if batch.dim_param else batch.dim_value
+
+    graph.initializer.append(numpy_helper.from_array(np.asarray(thresholds, dtype=np.float32), 'scoring/thresholds'))
+    graph.node.append(helper.make_node('Sub', [output_name, input_name], ['scoring/error']))
+    graph.node.append(helper.make_node('Abs', ['scoring/error'], ['scoring/abs_error']))
+    # mean over the time steps (rows, cols) of each feature
+    if opset >= 18:
+        graph.initializer.append(numpy_helper.from_array(np.array([2, 3], dtype=np.int64), 'scoring/axes'))
+        graph.node.append(helper.make_node('ReduceMean', ['scoring/abs_error', 'scoring/axes'], ['scores'], keepdims=0))
+    else:
+        graph.node.append(helper.make_node('ReduceMean', ['scoring/abs_error'], ['scores'], axes=[2, 3], keepdims=0))
+    graph.node.append(helper.make_node('Greater', ['scores', 'scoring/thresholds'], ['anomalies']))
+    graph.output.append(helper.make_tensor_value_info('scores', TensorProto.FLOAT, [batch, len(thresholds)]))
+    graph.output.append(helper.make_tensor_value_info('anomalies', TensorProto.BOOL, [batch, len(thresholds)]))
+    onnx.checker.check_model(model)
+    onnx.save(model, model_path)
+
+def check_scoring_subgraph(model_path, thresholds):
+    '''
+        Compare the scores of the model with the ones computed by the edge application
+    '''
+    sess = ort.InferenceSession(model_path)
+    shape = [d if isinstance(d, int) else 2 for d in sess.get_inputs()[0].shape]
+    x = np.random.rand(*shape).astype(np.float32)
+    p, scores, anomalies = sess.run(['output', 'scores', 'anomalies'], {'input': x})
+    expected = np.mean(np.abs(p - x).reshape(x.shape[0], x.shape[1], -1), axis=2)
+    np.testing.assert_allclose(scores, expected, rtol=1e-5, atol=1e-6)
+    assert (anomalies == (scores > np.asarray(thresholds, dtype=np.float32))).all()
+
+def load_shards(s3_client, bucket, prefix, max_windows=5000, seed=0):
+    '''
+        Windows (N, F, 10, 10) of the wind_turbine_*.npy training shards,
+        uploaded by the notebooks in s3://bucket/prefix. A random subset of
+        at most max_windows windows is returned, float32
+    '''
+    keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys += [i['Key'] for i in page.get('Contents', []) if os.path.basename(i['Key']).startswith('wind_turbine_') and i['Key'].endswith('.npy')]
+    if len(keys) == 0:
+        raise Exception('No training shards found in s3://%s/%s' % (bucket, prefix))
+    shards = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for key in sorted(keys):
+            path = os.path.join(tmp, os.path.basename(key))
+            s3_client.download_file(bucket, key, path)
+            shards.append(np.load(path))
+    data = np.concatenate(shards).astype(np.float32)
+    rng = np.random.default_rng(seed)
+    return data[rng.permutation(len(data))[:max_windows]]
+
+class WindowsReader(CalibrationDataReader):
+    '''
+        Feeds the calibration windows to the static quantization, one batch at a time
+    '''
+    def __init__(self, windows, input_name='input', batch_size=1):
+        self.batches = iter([windows[i:i+batch_size] for i in range(0, len(windows), batch_size)])
+        self.input_name = input_name
+
+    def get_next(self):
+        batch = next(self.batches, None)
+        return None if batch is None else {self.input_name: batch}
+
+def quantize(model_path, output_path, mode, calibration_windows=None):
+    '''
+        INT8 quantization of the autoencoder (before the scoring subgraph is appended).
+        dynamic: weights quantized offline, activations at runtime (Conv -> ConvInteger)
+        static: weights and activations, QDQ format, calibrated on the training windows
+    '''
+    if mode == 'dynamic':
+        quantize_dynamic(model_path, output_path, weight_type=QuantType.QUInt8)
+    elif mode == 'static':
+        batch_size = onnx.load(model_path).graph.input[0].type.tensor_type.shape.dim[0].dim_value or 1
+        quantize_static(model_path, output_path, WindowsReader(calibration_windows, batch_size=batch_size),
+            quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+    else:
+        raise ValueError('Invalid quantization mode: %s' % mode)
+
+def scores(sess, windows):
+    '''
+        Reconstruction MAE of each window and feature: (N, F)
+    '''
+    batch_size = sess.get_inputs()[0].shape[0]
+    fixed = isinstance(batch_size, int)
+    batch_size = batch_size if fixed else 256
+    outputs = []
+    for i in range(0, len(windows), batch_size):
+        x = windows[i:i+batch_size]
+        feed = x
+        if fixed and len(x) < batch_size:
+            # the last partial batch is padded, its padding rows ignored
+            feed = np.concatenate([x, np.zeros((batch_size - len(x),) + x.shape[1:], dtype=x.dtype)])
+        p = sess.run(None, {'input': feed})[0][:len(x)]
+        outputs.append(np.mean(np.abs(p - x).reshape(len(x), x.shape[1], -1), axis=2))
+    return np.concatenate(outputs)
+
+def latency(sess, window, runs=200):
+    '''
+        Single window CPU latency in ms: mean, p50, p95
+    '''
+    feeds = {'input': window}
+    for i in range(10):
+        sess.run(None, feeds)
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        sess.run(None, feeds)
+        times.append((time.perf_counter() - start) * 1000)
+    return {'mean': float(np.mean(times)), 'p50': float(np.percentile(times, 50)), 'p95': float(np.percentile(times, 95))}
+
+def compare(fp32_path, int8_path, windows, thresholds):
+    '''
+        Report comparing the MAE scores, anomaly decisions, latency and size of the two models
+    '''
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = 1 # closer to a busy edge device
+    fp32 = ort.InferenceSession(fp32_path, sess_options=options)
+    int8 = ort.InferenceSession(int8_path, sess_options=options)
+    fp32_scores, int8_scores = scores(fp32, windows), scores(int8, windows)
+    fp32_flags, int8_flags = fp32_scores > thresholds, int8_scores > thresholds
+    return {
+        'windows': len(fp32_scores),
+        'score_abs_diff': {'mean': float(np.mean(np.abs(fp32_scores - int8_scores))), 'max': float(np.max(np.abs(fp32_scores - int8_scores)))},
+        'score_rel_diff': float(np.mean(np.abs(fp32_scores - int8_scores) / np.maximum(fp32_scores, 1e-6))),
+        # a window agrees when all its feature flags are the same
+        'decision_agreement': float(np.mean((fp32_flags == int8_flags).all(axis=1))),
+        'flag_agreement': float(np.mean(fp32_flags == int8_flags)),
+        'anomalies': {'fp32': int(fp32_flags.any(axis=1).sum()), 'int8': int(int8_flags.any(axis=1).sum())},
+        'latency_ms': {'fp32': latency(fp32, windows[:fp32.get_inputs()[0].shape[0] if isinstance(fp32.get_inputs()[0].shape[0], int) else 1]),
+            'int8': latency(int8, windows[:int8.get_inputs()[0].shape[0] if isinstance(int8.get_inputs()[0].shape[0], int) else 1])},
+        'size_bytes': {'fp32': os.path.getsize(fp32_path), 'int8': os.path.getsize(int8_path)}
+    }
+
+def quantization_stage(model_path, mode, thresholds, windows, min_agreement, report_path='quantization_report.json'):
+    '''
+        Quantize model_path in place if the decisions of the INT8 model agree
+        with the FP32 ones on at least min_agreement of the windows. The
+        first half of the windows calibrates the static quantization, the
+        second half is used for the report. Raises an exception (build
+        failure) otherwise, or when there are less than 2 windows
+    '''
+    if len(windows) < 2:
+        raise ValueError('Not enough windows to calibrate and evaluate the INT8 model: %d, check the calibration data' % len(windows))
+    calibration, evaluation = windows[:len(windows) // 2], windows[len(windows) // 2:]
+    int8_path = model_path.replace('.onnx', '.int8.onnx')
+    quantize(model_path, int8_path, mode, calibration)
+    report = compare(model_path, int8_path, evaluation, np.asarray(thresholds, dtype=np.float32))
+    report['mode'] = mode
+    report['min_agreement'] = min_agreement
+    print(json.dumps(report, indent=4))
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    if report['decision_agreement'] < min_agreement:
+        raise Exception('INT8 model rejected: decision agreement %.4f < %.4f' % (report['decision_agreement'], min_agreement))
+    os.replace(int8_path, model_path)
+    return report
+
+def convert_to_ort(model_path, optimization_level='extended'):
+    '''
+        Save the model, optimized, in the ORT (flatbuffer) format next to model_path,
+        so the edge doesn't parse the protobuf and optimize the graph at every
+        start. The layout optimizations ('all') are not applied: they depend on the
+        CPU of the build machine, not the one of the device.
+        Also writes the manifest of the operators the model needs, in the format of
+        the onnxruntime reduced operator builds (domain;opset;op1,op2), with the
+        sha256 of the ORT model and the onnxruntime version that wrote it in the
+        header comment (ORT models are only guaranteed to load with that version).
+        Returns the paths of the ORT model and of the manifest
+    '''
+    base_path = os.path.splitext(model_path)[0]
+    ort_path, manifest_path = base_path + '.ort', base_path + '.required_operators.config'
+    levels = {'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC, 'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED}
+    with tempfile.TemporaryDirectory() as tmp:
+        for path, model_format in ((ort_path, 'ORT'), (os.path.join(tmp, 'optimized.onnx'), 'ONNX')):
+            options = ort.SessionOptions()
+            options.graph_optimization_level = levels[optimization_level]
+            options.optimized_model_filepath = path
+            options.add_session_config_entry('session.save_model_format', model_format)
+            ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        # same graph as the ORT model, readable with onnx
+        optimized = onnx.load(os.path.join(tmp, 'optimized.onnx'))
+    opsets = dict((i.domain or 'ai.onnx', i.version) for i in optimized.opset_import)
+    operators = {}
+    for node in optimized.graph.node:
+        operators.setdefault(node.domain or 'ai.onnx', set()).add(node.op_type)
+    with open(ort_path, 'rb') as f:
+        ort_sha256 = hashlib.sha256(f.read()).hexdigest()
+    with open(manifest_path, 'w') as f:
+        f.write('# %s: sha256 %s, onnxruntime %s, %s optimizations\n' % (os.path.basename(ort_path), ort_sha256, ort.__version__, optimization_level))
+        for domain in sorted(operators):
+            f.write('%s;%d;%s\n' % (domain, opsets.get(domain, 1), ','.join(sorted(operators[domain]))))
+    return ort_path, manifest_path
+
+def check_ort_model(model_path, ort_path):
+    '''
+        Compare the outputs of the ORT format model with the ones of the ONNX model
+    '''
+    onnx_sess = ort.InferenceSession(model_path)
+    ort_sess = ort.InferenceSession(ort_path)
+    shape = [d if isinstance(d, int) else 2 for d in onnx_sess.get_inputs()[0].shape]
+    x = np.random.rand(*shape).astype(np.float32)
+    for expected, output in zip(onnx_sess.run(None, {'input': x}), ort_sess.run(None, {'input': x})):
+        np.testing.assert_allclose(output, expected, rtol=1e-4, atol=1e-5)
+
+def save_statistics_bundle(model_path, statistics_dir, model_name, model_version):
+    '''
+        Write the statistics of statistics_dir (thresholds, raw_std, mean, std .npy
+        files) in a single bundle next to model_path, keyed to the model version
+        and sha256, so the edge swaps them with the model. The bundle is written
+        by turbine.statistics, the module of the edge that reads it. Returns the
+        path of the bundle
+    '''
+    bundle_path = os.path.splitext(model_path)[0] + '.stats'
+    save_bundle(bundle_path, load_statistics(statistics_dir), model_path, model_name, model_version)
+    return bundle_path
@@ -21,27 +21,165 @@ import gzip
 import paho.mqtt.client as mqtt
 import time
 import io
+import struct
+import numpy as np
 
 BROKER = 'localhost'
 PORT = 1883
 TOPIC = "turbine/raw"
+# the edge application advertises (retained) the payload formats it accepts
+FORMATS_TOPIC = "turbine/raw/formats"
+# binary format: one format byte + the sample as little endian float32 values
+FORMAT_BINARY_V1 = 0xB1
 CLIENT_ID = "turbine_simulated_device"
 FILENAME = 'dataset_wind.csv'
 DATASET_FILE_URL = 'https://aws-ml-blog.s3.amazonaws.com/artifacts/monitor-manage-anomaly-detection-model-wind-turbine-fleet-sagemaker-neo/dataset_wind_turbine.csv.gz'
+# published columns of the sensors used by the edge application:
+# rps, wind_speed_rps, voltage, qw, qx, qy, qz
+SENSOR_COLUMNS = [2, 3, 4, 5, 6, 7, 8]
+# indexes in SENSOR_COLUMNS
+WIND = 1
+VOLTAGE = 2
+QUATERNION = [3, 4, 5, 6]
+BLOCK_SIZE = 1000 # samples read from the dataset and altered at once
+# anomaly profiles injected by the scenarios. rate: probability that an event
+# starts at a given sample, duration: length of an event in samples,
+# magnitude: size of the anomaly in stds of the sensor (*_noise: upper bound
+# of the random values). sensors: the sensors altered by each event, a random
+# one if not set
+PROFILES = {
+    'spike': {'rate': 0.002, 'duration': 1, 'magnitude': 10.0}, # outliers on one sensor
+    'drift': {'rate': 0.0002, 'duration': 200, 'magnitude': 5.0}, # offset growing up to magnitude
+    'stuck': {'rate': 0.0005, 'duration': 100, 'magnitude': 0.0}, # sensor repeating its last value
+    'dropout': {'rate': 0.0005, 'duration': 20, 'magnitude': 0.0, 'sensors': [VOLTAGE]}, # no voltage from the generator
+    # random values out of the range of the sensors
+    'radians_noise': {'rate': 1 / 50, 'duration': 1, 'magnitude': 10.0, 'sensors': QUATERNION},
+    'wind_noise': {'rate': 1 / 20, 'duration': 1, 'magnitude': 10.0, 'sensors': [WIND]},
+    'voltage_noise': {'rate': 1 / 50, 'duration': 1, 'magnitude': 1000.0, 'sensors': [VOLTAGE]}
+}
+# injected when no scenario is set, the noise the edge application used to add
+DEFAULT_SCENARIO = ['radians_noise', 'wind_noise', 'voltage_noise']
+
+class ScenarioEngine(object):
+    '''
+        Injects the anomaly profiles in blocks of samples. The events of a
+        block are drawn at once by a seeded generator and applied without
+        a loop over the samples, so a run is reproduced by its seed.
+        An event can span consecutive blocks
+    '''
+    def __init__(self, profiles, scale, seed=0):
+        self.profiles = profiles
+        self.scale = np.asarray(scale, dtype=np.float64) # std of the sensors
+        self.rng = np.random.default_rng(seed)
+        self.position = 0 # index of the first sample of the next block
+        self.pending = {} # events of each profile not over at the end of the last block
+        self.events = dict((name, 0) for name in profiles)
+
+    def draw(self, name, profile, samples):
+        '''
+            Events of a profile starting in the block: start, end, sensor,
+            sign of the anomaly and value of the sensor when it starts
+        '''
+        offsets = np.flatnonzero(self.rng.random(len(samples)) < profile['rate'])
+        self.events[name] += len(offsets)
+        if 'sensors' in profile:
+            # one event per sensor
+            sensors = np.tile(profile['sensors'], len(offsets))
+            offsets = np.repeat(offsets, len(profile['sensors']))
+        else:
+            sensors = self.rng.integers(samples.shape[1], size=len(offsets))
+        signs = self.rng.choice([-1.0, 1.0], size=len(offsets))
+        starts = self.position + offsets
+        return starts, starts + profile['duration'], sensors, signs, samples[offsets, sensors]
+
+    def apply(self, samples):
+        '''
+            Inject the anomalies in a block of samples (N, len(SENSOR_COLUMNS)),
+            in place. Returns the mask of the modified samples
+        '''
+        end = self.position + len(samples)
+        changed = np.zeros(len(samples), dtype=bool)
+        for name, profile in self.profiles.items():
+            events = self.draw(name, profile, samples)
+            if name in self.pending:
+                events = [np.concatenate(i) for i in zip(self.pending[name], events)]
+            starts, ends, sensors, signs, values = events
+            # one index per sample altered by an event
+            first = np.maximum(starts, self.position)
+            lengths = np.minimum(ends, end) - first
+            event = np.repeat(np.arange(len(starts)), lengths)
+            rows = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + first[event] - self.position
+            cols = sensors[event]
+            size = profile['magnitude'] * self.scale[cols] * signs[event]
+            # overlapping events of a sensor add up (a fancy += would keep only one)
+            if name == 'spike':
+                np.add.at(samples, (rows, cols), size)
+            elif name == 'drift':
+                np.add.at(samples, (rows, cols), size * (rows + self.position - starts[event] + 1) / profile['duration'])
+            elif name == 'stuck':
+                samples[rows, cols] = values[event]
+            elif name == 'dropout':
+                samples[rows, cols] = 0
+            elif name.endswith('_noise'):
+                samples[rows, cols] = self.rng.random(len(rows)) * profile['magnitude']
+            changed[rows] = True
+            over = ends > end
+            self.pending[name] = [i[over] for i in events]
+        self.position = end
+        return changed
+
+def parse_scenario(value):
+    '''
+        NAME[:RATE[:DURATION[:MAGNITUDE]]], the defaults come from PROFILES
+    '''
+    parts = value.split(':')
+    if parts[0] not in PROFILES or len(parts) > 4:
+        raise argparse.ArgumentTypeError("Invalid scenario: %s. Profiles: %s" % (value, ', '.join(PROFILES)))
+    profile = dict(PROFILES[parts[0]])
+    try:
+        for key, part in zip(['rate', 'duration', 'magnitude'], parts[1:]):
+            profile[key] = int(part) if key == 'duration' else float(part)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid scenario: %s" % value)
+    if profile['duration'] < 1:
+        raise argparse.ArgumentTypeError("Invalid scenario duration: %s" % value)
+    return parts[0], profile
 
 class SensorDataReader(object):
-            def __init__(self):
-                self.buffer = open(FILENAME, 'r').readlines()[1:] # skip the file header
+            def __init__(self, scenarios=None, seed=0):
+                lines = open(FILENAME, 'r').readlines()[1:] # skip the file header
+                self.rows = [self.reorganize(line) for line in lines]
+                self.engine = None
+                if scenarios:
+                    sensors = np.array([[row[i] for i in SENSOR_COLUMNS] for row in self.rows], dtype=np.float64)
+                    self.engine = ScenarioEngine(scenarios, sensors.std(axis=0), seed)
                 self.idx = 0
+                self.block = []
             def isOpen(self): return True
             def close(self): pass
+            def reorganize(self, line):
+                reading = line.strip().split(',')[2:] # drop the first two columns
+                return reading[0:2] + [reading[3], reading[-1]] + reading[4:-1] # reorganize the columns
+            def readblock(self):
+                block = [list(self.rows[(self.idx + i) % len(self.rows)]) for i in range(BLOCK_SIZE)]
+                self.idx = (self.idx + BLOCK_SIZE) % len(self.rows)
+                if self.engine is None:
+                    return block
+                sensors = np.array([[row[i] for i in SENSOR_COLUMNS] for row in block], dtype=np.float64)
+                for i in np.flatnonzero(self.engine.apply(sensors)):
+                    for k, column in enumerate(SENSOR_COLUMNS):
+                        block[i][column] = repr(float(sensors[i, k]))
+                logging.info("Anomalies injected so far: %s", self.engine.events)
+                return block
+            def readfields(self):
+                if len(self.block) == 0:
+                    self.block = self.readblock()[::-1]
+                return self.block.pop()
             def readline(self):
-                if self.idx >= len(self.buffer): self.idx = 0
-                reading = self.buffer[self.idx].strip().split(',')[2:] # drop the first two columns
-                reading = reading[0:2] + [reading[3], reading[-1]] + reading[4:-1] # reorganize the columns
-                reading = ",".join(reading).encode('utf-8')
-                self.idx += 1
-                return reading
+                return ",".join(self.readfields()).encode('utf-8')
+            def readbinary(self):
+                fields = self.readfields()
+                return struct.pack('<B%df' % len(fields), FORMAT_BINARY_V1, *[float(i) for i in fields])
 
 def download(url, filename):
     try:
@@ -57,13 +195,34 @@ def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("Connected to broker")
         client.connected_flag=True         
+        client.subscribe(FORMATS_TOPIC)
     else:
         print("Connection failed")
 
+def on_formats(client, userdata, msg):
+    # negotiate the payload format with the edge application, CSV is the fallback
+    formats = msg.payload.decode('utf-8').split(',')
+    binary = client.requested_format != 'csv' and 'bin1' in formats
+    if client.requested_format == 'binary' and not binary:
+        logging.warning("The edge application doesn't accept binary payloads, using CSV")
+    client.use_binary = binary
+    logging.info("Publishing %s payloads", "binary" if binary else "CSV")
+
 if __name__ == '__main__':
     
     logging.basicConfig(level=logging.INFO )
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turbine-id', type=str, default=None,
+        help='publish in turbine/<turbine_id>/raw, for edge applications in gateway mode')
+    parser.add_argument('--format', choices=['auto', 'csv', 'binary'], default='auto',
+        help='payload format. binary is used only if the edge application advertises it')
+    parser.add_argument('--scenario', type=parse_scenario, action='append', default=[],
+        help='anomaly profile injected in the data: NAME[:RATE[:DURATION[:MAGNITUDE]]], with NAME in %s. Can be repeated. '
+            'Default: %s, spike:0 for data without anomalies' % (', '.join(PROFILES), ' '.join(DEFAULT_SCENARIO)))
+    parser.add_argument('--seed', type=int, default=0, help='seed of the scenarios')
+    args = parser.parse_args()
+
     if not os.path.exists(FILENAME):
         logging.info("Input dataset not found, downloading it...")
         if download(DATASET_FILE_URL,FILENAME) == False:
@@ -74,9 +233,13 @@ if __name__ == '__main__':
         logging.info("Dataset present, loading data")
 
     logging.info("Connecting to MQTT broker...")
-    client = mqtt.Client(CLIENT_ID)
+    topic = TOPIC if args.turbine_id is None else "turbine/%s/raw" % args.turbine_id
+    client = mqtt.Client(CLIENT_ID if args.turbine_id is None else "%s_%s" % (CLIENT_ID, args.turbine_id))
     client.connected_flag=False
+    client.requested_format = args.format
+    client.use_binary = False
     client.on_connect = on_connect
+    client.on_message = on_formats
     client.loop_start()
     client.connect(BROKER, PORT)
     while not client.connected_flag: #wait in loop
@@ -84,13 +247,17 @@ if __name__ == '__main__':
         time.sleep(1)
     logging.info("Connected")
 
-    raw_sensor_data = SensorDataReader()
+    scenario = args.scenario or [(name, PROFILES[name]) for name in DEFAULT_SCENARIO]
+    raw_sensor_data = SensorDataReader(dict(scenario), args.seed)
 
     try:
         while True:
-            data = raw_sensor_data.readline().decode('utf-8').strip()
+            if client.use_binary:
+                data = raw_sensor_data.readbinary()
+            else:
+                data = raw_sensor_data.readline().decode('utf-8').strip()
             logging.info("publishing raw data to MQTT topic")
-            client.publish(TOPIC,data)
+            client.publish(topic,data)
             time.sleep(0.5)
     except Exception as e:
         logging.error(e)
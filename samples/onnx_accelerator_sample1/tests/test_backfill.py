@@ -0,0 +1,96 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import csv
+import os
+import sys
+import numpy as np
+import pytest
+
+pytest.importorskip('onnx')
+import onnxruntime as ort
+import turbine
+from turbine import backfill
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+import replay
+
+def write_telemetry(path, samples, turbines):
+    # samples of the turbines interleaved, like the logs of a gateway
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['ts', 'device_name'] + backfill.RAW_COLUMNS)
+        for i in range(len(samples)):
+            for t in range(turbines):
+                writer.writerow(['%d.%d' % (i, t), 'turbine%d' % t] + [repr(float(v)) for v in samples[i] + t])
+
+def gateway_scores(model_path, samples, dtype=np.float64):
+    '''Scores of a turbine predicted every STEP samples by the edge application'''
+    stats = {n: np.load(os.path.join(replay.STATISTICS_DIR, '%s.npy' % n)).astype(dtype) for n in ['raw_std', 'mean', 'std']}
+    gateway = turbine.Gateway(backfill.MIN_NUM_SAMPLES, backfill.NUM_FEATURES, stats['raw_std'], dtype=dtype)
+    sess = ort.InferenceSession(model_path)
+    features = turbine.prepare_features(samples[:, backfill.FEATURES_IDX])
+    scores = []
+    for end in range(backfill.MIN_NUM_SAMPLES, len(samples) + 1, backfill.STEP):
+        gateway.extend(None, features[end - (backfill.STEP if scores else end):end])
+        ids, times, x = gateway.prepare_batch(backfill.TIME_STEPS, backfill.STEP, stats['mean'], stats['std'])
+        scores.append(gateway.scores(x, sess.run(None, {'input': x})[0], len(ids))[0])
+    return np.array(scores)
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_backfill_matches_the_edge_application(tmp_path, dtype):
+    model_path = str(tmp_path / 'model.onnx')
+    replay.save_dummy_model(model_path)
+    samples = replay.synthetic_samples(733).astype(np.float64)
+    write_telemetry(tmp_path / 'telemetry.csv', samples, 2)
+
+    # chunks which don't end on a window
+    summary = backfill.backfill(str(tmp_path / 'telemetry.csv'), str(tmp_path / 'scores.csv'), model_path, replay.STATISTICS_DIR,
+        'device_name', 'ts', chunk_rows=137, batch_size=7, processes=1, dtype=dtype)
+    assert summary['windows'] == 2 * 24 and summary['turbines'] == 2
+
+    with open(tmp_path / 'scores.csv') as f:
+        rows = [r for r in csv.DictReader(f) if r['turbine_id'] == 'turbine1']
+    assert [int(r['sample']) for r in rows] == list(range(499, 733, 10))
+    assert rows[0]['time'] == '499.1'
+    scores = np.array([[float(r['score_%s' % n]) for n in backfill.FEATURE_NAMES] for r in rows])
+    np.testing.assert_allclose(scores, gateway_scores(model_path, samples + 1, dtype), rtol=1e-4, atol=1e-6)
+
+def test_backfill_parallel_parquet(tmp_path):
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+    model_path = str(tmp_path / 'model.onnx')
+    replay.save_dummy_model(model_path)
+    write_telemetry(tmp_path / 'telemetry.csv', replay.synthetic_samples(900).astype(np.float64), 3)
+    args = (model_path, replay.STATISTICS_DIR, 'device_name', 'ts')
+
+    backfill.backfill(str(tmp_path / 'telemetry.csv'), str(tmp_path / 'serial.csv'), *args, chunk_rows=500, processes=1)
+    backfill.backfill(str(tmp_path / 'telemetry.csv'), str(tmp_path / 'parallel.parquet'), *args, chunk_rows=500, processes=2)
+    with open(tmp_path / 'serial.csv') as f:
+        serial = list(csv.DictReader(f))
+    parallel = pq.read_table(tmp_path / 'parallel.parquet').to_pylist()
+    assert len(parallel) == len(serial) == 3 * 41
+    assert [(r['turbine_id'], int(r['sample'])) for r in serial] == [(r['turbine_id'], r['sample']) for r in parallel]
+    np.testing.assert_allclose([float(r['score_rps']) for r in serial], [r['score_rps'] for r in parallel], rtol=1e-6)
+
+def test_backfill_uses_the_statistics_bundle_of_the_model(tmp_path):
+    model_path = str(tmp_path / 'model.onnx')
+    replay.save_dummy_model(model_path)
+    write_telemetry(tmp_path / 'telemetry.csv', replay.synthetic_samples(600).astype(np.float64), 1)
+    args = (str(tmp_path / 'telemetry.csv'), str(tmp_path / 'scores.csv'), model_path, replay.STATISTICS_DIR)
+    # the random model flags all the windows against the .npy thresholds
+    assert backfill.backfill(*args, processes=1)['anomalies'] == 11
+    # and none against the ones of its bundle, the .npy files are ignored
+    statistics = turbine.load_statistics(replay.STATISTICS_DIR)._replace(thresholds=np.full(backfill.NUM_FEATURES, 1e6))
+    turbine.save_bundle(str(tmp_path / 'model.stats'), statistics, model_path, 'model', '1')
+    assert backfill.backfill(*args, processes=1)['anomalies'] == 0
@@ -0,0 +1,61 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import numpy as np
+import pytest
+
+import turbine
+
+def samples(start, count, num_features=2):
+    return np.arange(start, start + count, dtype=np.float64)[:, None].repeat(num_features, axis=1)
+
+def test_ring_buffer_wraps_around():
+    buffer = turbine.RingBuffer(5, 2)
+    for i in range(12):
+        buffer.append(samples(i, 1)[0])
+        # the latest samples are always a contiguous view, oldest first
+        np.testing.assert_array_equal(buffer.latest(), samples(max(0, i - 4), min(i + 1, 5)))
+    assert (len(buffer), buffer.total, buffer.head) == (5, 12, 2)
+    view = buffer.latest(3)
+    np.testing.assert_array_equal(view, samples(9, 3))
+    assert not view.flags.writeable
+
+def test_ring_buffer_extend_larger_than_capacity():
+    buffer = turbine.RingBuffer(5, 2)
+    buffer.extend(samples(0, 3))
+    buffer.extend(samples(3, 13))
+    np.testing.assert_array_equal(buffer.latest(), samples(11, 5))
+    assert (len(buffer), buffer.total, buffer.dropped) == (5, 16, 11)
+    buffer.extend(samples(16, 2))
+    np.testing.assert_array_equal(buffer.latest(2), samples(16, 2))
+
+def test_ring_buffer_counts_dropped_samples():
+    buffer = turbine.RingBuffer(4, 2)
+    buffer.extend(samples(0, 4))
+    assert buffer.is_full() and buffer.dropped == 0
+    buffer.append(samples(4, 1)[0])
+    buffer.extend(samples(5, 2))
+    assert buffer.dropped == 3
+    with pytest.raises(ValueError):
+        buffer.latest(5)
+    buffer.clear()
+    assert len(buffer) == 0 and buffer.total == 7
+
+def test_gateway_reports_the_dropped_samples():
+    metrics = turbine.Metrics()
+    gateway = turbine.Gateway(5, 2, np.full(2, 0.1), metrics=metrics)
+    gateway.extend('a', samples(0, 12))
+    gateway.extend('b', samples(0, 4))
+    assert gateway.stats()['dropped'] == 2
+    assert 'windturbine_samples_dropped_total 2.0' in metrics.render()
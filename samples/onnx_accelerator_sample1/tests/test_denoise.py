@@ -0,0 +1,43 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import numpy as np
+import pytest
+
+import turbine
+
+NOISE_SIGMAS = np.array([0.5, 0.3, 1.0, 0.2, 0.8, 2.0])
+
+def batch_denoise(window, wavelet):
+    return np.array([turbine.wavelet_denoise(window[:,i], NOISE_SIGMAS[i], wavelet) for i in range(window.shape[1])]).T
+
+@pytest.mark.parametrize("num_samples", [500, 501])
+def test_wavelet_denoise_batch_matches_per_feature(num_samples):
+    rng = np.random.default_rng(3)
+    data = np.cumsum(rng.standard_normal((num_samples, len(NOISE_SIGMAS))), axis=0)
+    expected = batch_denoise(data, 'db6')
+    np.testing.assert_allclose(turbine.wavelet_denoise_batch(data, NOISE_SIGMAS, 'db6'), expected, atol=1e-9)
+
+def test_gateway_denoises_the_turbines_like_the_single_window_path():
+    rng = np.random.default_rng(11)
+    gateway = turbine.Gateway(500, len(NOISE_SIGMAS), NOISE_SIGMAS, 'db6', max_turbines=3)
+    streams = dict((turbine_id, np.cumsum(rng.standard_normal((500 + 10 * i, len(NOISE_SIGMAS))), axis=0)) for i, turbine_id in enumerate(['a', 'b', 'c']))
+    for turbine_id, stream in streams.items():
+        gateway.extend(turbine_id, stream)
+    mean, std = np.full(len(NOISE_SIGMAS), 0.5), np.full(len(NOISE_SIGMAS), 2.0)
+    ids, times, x = gateway.prepare_batch(100, 10, mean, std)
+    assert ids == ['a', 'b', 'c']
+    for i, turbine_id in enumerate(ids):
+        expected = (batch_denoise(streams[turbine_id][-500:], 'db6')[-110:] - mean) / std
+        np.testing.assert_allclose(x[i:i + 1], turbine.create_model_input(expected, 100, 10), rtol=1e-6, atol=1e-6)
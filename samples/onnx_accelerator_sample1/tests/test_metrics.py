@@ -0,0 +1,66 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import urllib.request
+import numpy as np
+import turbine
+from turbine.metrics import quantile
+
+def test_histogram_render_and_summary():
+    metrics = turbine.Metrics()
+    latency = metrics.histogram('stage_seconds', 'Stage latency', buckets=(0.01, 0.1, 1.0), stage='infer')
+    for value in [0.005, 0.05, 0.05, 0.5]:
+        latency.observe(value)
+    queues = {'logs': 3}
+    metrics.gauge('queue_depth', 'Queue depth', lambda: queues, 'queue')
+    metrics.counter('ticks_total', 'Ticks', lambda: 7)
+    text = metrics.render()
+    assert '# TYPE windturbine_stage_seconds histogram' in text
+    assert 'windturbine_stage_seconds_bucket{stage="infer",le="0.1"} 3' in text
+    assert 'windturbine_stage_seconds_bucket{stage="infer",le="+Inf"} 4' in text
+    assert 'windturbine_stage_seconds_count{stage="infer"} 4' in text
+    assert 'windturbine_queue_depth{queue="logs"} 3.0' in text
+    assert 'windturbine_ticks_total 7.0' in text
+
+    summary = metrics.summary()
+    assert summary['stage_seconds']['infer']['count'] == 4
+    assert np.isclose(summary['stage_seconds']['infer']['mean'], 0.15125)
+    assert summary['queue_depth'] == {'logs': 3} and summary['ticks_total'] == 7
+    # the histograms of a summary cover the observations since the previous one
+    latency.observe(2.0)
+    assert metrics.summary()['stage_seconds']['infer'] == {'count': 1, 'mean': 2.0, 'p50': 1.0, 'p95': 1.0, 'p99': 1.0}
+
+def test_quantile_interpolates_in_the_bucket():
+    assert quantile((1.0, 2.0), [0, 4, 0], 0.5) == 1.5
+    assert quantile((1.0, 2.0), [0, 0, 0], 0.5) is None
+
+def test_pipeline_stage_latency_and_server():
+    metrics = turbine.Metrics()
+    pipeline = turbine.Pipeline(metrics)
+    q = pipeline.queue('in', 10, turbine.BLOCK)
+    pipeline.stage('double', lambda item: item * 2, q)
+    pipeline.start()
+    for i in range(5):
+        q.put(i)
+    pipeline.stop(5)
+    server = turbine.MetricsServer(metrics, port=0)
+    server.start()
+    try:
+        with urllib.request.urlopen('http://127.0.0.1:%d/metrics' % server.port) as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            text = response.read().decode('utf-8')
+    finally:
+        server.stop()
+    assert 'windturbine_stage_seconds_count{stage="double"} 5' in text
+    assert 'windturbine_queue_dropped_total{queue="in"} 0.0' in text
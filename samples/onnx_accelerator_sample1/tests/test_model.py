@@ -0,0 +1,56 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import numpy as np
+
+import turbine
+
+class FakeSession(object):
+    def __init__(self, output):
+        self.output = output
+    def run(self, outputs, feeds):
+        return [self.output(feeds['input'])]
+
+SESSIONS = {
+    'good.onnx': lambda: FakeSession(lambda x: x * 0.5),
+    'nan.onnx': lambda: FakeSession(lambda x: x * np.nan),
+    'shape.onnx': lambda: FakeSession(lambda x: x[:, :1]),
+}
+
+def factory(path):
+    if path not in SESSIONS:
+        raise IOError('No such file: %s' % path)
+    return SESSIONS[path]()
+
+def test_model_holder_keeps_the_current_model_on_failures():
+    holder = turbine.ModelHolder(factory, np.ones((1, 6, 10, 10), dtype=np.float32))
+    assert not holder.ready
+    assert holder.load('good.onnx', 'windturbine', '1')
+    current = holder.get()
+    for path in ['missing.onnx', 'nan.onnx', 'shape.onnx']:
+        assert not holder.load(path, 'windturbine', '2')
+        assert holder.get() is current
+    assert holder.stats() == {'name': 'windturbine', 'version': '1', 'statistics': None, 'swaps': 1, 'failures': 3, 'rollbacks': 0}
+
+def test_model_holder_rollback():
+    holder = turbine.ModelHolder(factory, np.ones((1, 6, 10, 10), dtype=np.float32))
+    holder.load('good.onnx', 'windturbine', '1')
+    first = holder.get()
+    holder.load('good.onnx', 'windturbine', '2')
+    second = holder.get()
+    # a stale model (not the current one) doesn't trigger a rollback
+    assert not holder.rollback(first)
+    assert holder.rollback(second) and holder.get() is first
+    # nothing left to roll back to
+    assert not holder.rollback(first)
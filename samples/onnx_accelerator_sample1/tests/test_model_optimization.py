@@ -0,0 +1,129 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import os
+import json
+import hashlib
+import sys
+import numpy as np
+import pytest
+
+onnx = pytest.importorskip('onnx')
+from onnx import helper, numpy_helper, TensorProto
+import onnxruntime as ort
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'onnxacceleratorsampleone', 'without_ggv2'))
+import model_optimization
+
+THRESHOLDS = np.array([0.5, 0.55, 0.5, 0.5, 0.5, 0.5])
+
+def save_autoencoder(path, seed=0):
+    '''
+        Dense autoencoder with the input and output of the exported model:
+        (batch, 6, 10, 10), dynamic batch axis
+    '''
+    rng = np.random.default_rng(seed)
+    initializers = [
+        numpy_helper.from_array((rng.standard_normal((600, 32)) * 0.05).astype(np.float32), 'encoder'),
+        numpy_helper.from_array((rng.standard_normal((32, 600)) * 0.05).astype(np.float32), 'decoder'),
+        numpy_helper.from_array(np.array([-1, 600], dtype=np.int64), 'flat'),
+        numpy_helper.from_array(np.array([-1, 6, 10, 10], dtype=np.int64), 'shape')]
+    graph = helper.make_graph([
+            helper.make_node('Reshape', ['input', 'flat'], ['x']),
+            helper.make_node('MatMul', ['x', 'encoder'], ['h']),
+            helper.make_node('Relu', ['h'], ['code']),
+            helper.make_node('MatMul', ['code', 'decoder'], ['y']),
+            helper.make_node('Reshape', ['y', 'shape'], ['output'])
+        ], 'autoencoder',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, ['batch', 6, 10, 10])],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, ['batch', 6, 10, 10])],
+        initializers)
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)], ir_version=8), path)
+    return path
+
+def windows(count, seed=1):
+    return np.random.default_rng(seed).uniform(-1, 1, (count, 6, 10, 10)).astype(np.float32)
+
+def test_scoring_subgraph_matches_numpy_scores(tmp_path):
+    model_path = save_autoencoder(str(tmp_path / 'model.onnx'))
+    model_optimization.add_scoring_subgraph(model_path, THRESHOLDS)
+    sess = ort.InferenceSession(model_path)
+    assert [o.name for o in sess.get_outputs()] == ['output', 'scores', 'anomalies']
+    x = windows(5)
+    p, scores, anomalies = sess.run(None, {'input': x})
+    # what the edge application computes from the reconstruction
+    expected = np.mean(np.abs(p - x).reshape(len(x), 6, -1), axis=2)
+    np.testing.assert_allclose(scores, expected, rtol=1e-5, atol=1e-6)
+    np.testing.assert_array_equal(anomalies, expected > THRESHOLDS.astype(np.float32))
+    assert anomalies.any() and not anomalies.all()
+
+def test_quantization_stage_replaces_the_model_when_the_decisions_agree(tmp_path):
+    model_path = save_autoencoder(str(tmp_path / 'model.onnx'))
+    report_path = str(tmp_path / 'report.json')
+    report = model_optimization.quantization_stage(model_path, 'dynamic', THRESHOLDS, windows(600), 0.5, report_path)
+    # every window of the evaluation half is scored, including the last partial batch
+    assert report['mode'] == 'dynamic' and report['windows'] == 300
+    assert 0.5 <= report['decision_agreement'] <= report['flag_agreement'] <= 1
+    assert report['size_bytes']['int8'] < report['size_bytes']['fp32']
+    assert 'MatMulInteger' in [n.op_type for n in onnx.load(model_path).graph.node]
+    assert not os.path.exists(str(tmp_path / 'model.int8.onnx'))
+    with open(report_path) as f:
+        assert json.load(f) == report
+
+def test_quantization_stage_with_less_than_a_batch_of_windows(tmp_path):
+    model_path = save_autoencoder(str(tmp_path / 'model.onnx'))
+    report = model_optimization.quantization_stage(model_path, 'dynamic', THRESHOLDS, windows(41), 0.5, str(tmp_path / 'report.json'))
+    assert report['windows'] == 21
+    with pytest.raises(ValueError, match='Not enough windows'):
+        model_optimization.quantization_stage(model_path, 'dynamic', THRESHOLDS, windows(1), 0.5, str(tmp_path / 'report.json'))
+
+def test_scores_pads_the_last_batch_of_a_fixed_batch_model(tmp_path):
+    model_path = save_autoencoder(str(tmp_path / 'model.onnx'))
+    model = onnx.load(model_path)
+    for value in (model.graph.input[0], model.graph.output[0]):
+        value.type.tensor_type.shape.dim[0].dim_value = 4
+    onnx.save(model, str(tmp_path / 'fixed.onnx'))
+    x = windows(10)
+    scores = model_optimization.scores(ort.InferenceSession(str(tmp_path / 'fixed.onnx')), x)
+    np.testing.assert_allclose(scores, model_optimization.scores(ort.InferenceSession(model_path), x), rtol=1e-6)
+
+def test_quantization_stage_rejects_the_model_below_min_agreement(tmp_path):
+    model_path = save_autoencoder(str(tmp_path / 'model.onnx'))
+    with open(model_path, 'rb') as f:
+        fp32 = f.read()
+    with pytest.raises(Exception, match='INT8 model rejected'):
+        model_optimization.quantization_stage(model_path, 'dynamic', THRESHOLDS, windows(600), 1.01, str(tmp_path / 'report.json'))
+    # the FP32 model is kept
+    with open(model_path, 'rb') as f:
+        assert f.read() == fp32
+
+def test_convert_to_ort_manifest(tmp_path):
+    model_path = save_autoencoder(str(tmp_path / 'windturbine.onnx'))
+    model_optimization.add_scoring_subgraph(model_path, THRESHOLDS)
+    ort_path, manifest_path = model_optimization.convert_to_ort(model_path)
+    assert ort_path == str(tmp_path / 'windturbine.ort')
+    assert manifest_path == str(tmp_path / 'windturbine.required_operators.config')
+    with open(manifest_path) as f:
+        header, *lines = f.read().splitlines()
+    name, fields = header[2:].split(': ')
+    sha256, version, level = fields.split(', ')
+    with open(ort_path, 'rb') as f:
+        assert sha256 == 'sha256 %s' % hashlib.sha256(f.read()).hexdigest()
+    assert name == 'windturbine.ort'
+    assert version == 'onnxruntime %s' % ort.__version__
+    assert level == 'extended optimizations'
+    domain, opset, ops = lines[0].split(';')
+    assert (domain, opset) == ('ai.onnx', '13')
+    assert {'Reshape', 'Abs', 'Sub', 'ReduceMean', 'Greater'} <= set(ops.split(','))
+    model_optimization.check_ort_model(model_path, ort_path)
@@ -0,0 +1,60 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import threading
+import pytest
+
+import turbine
+
+@pytest.mark.parametrize("policy,expected,dropped", [(turbine.DROP_OLDEST, [2, 3, 4], [0, 1]), (turbine.DROP_NEWEST, [0, 1, 2], [3, 4])])
+def test_bounded_queue_overflow(policy, expected, dropped):
+    released = []
+    q = turbine.BoundedQueue('test', 3, policy, on_drop=released.append)
+    for i in range(5):
+        q.put(i)
+    assert q.stats()['dropped'] == 2 and q.max_depth == 3
+    assert released == dropped
+    q.close()
+    assert [q.get() for i in range(4)] == expected + [None]
+
+def test_bounded_queue_block_timeout():
+    q = turbine.BoundedQueue('test', 1, turbine.BLOCK)
+    assert q.put(0)
+    assert not q.put(1, timeout=0.01)
+    threading.Timer(0.05, q.get).start()
+    assert q.put(2, timeout=5)
+    assert q.get() == 2 and q.dropped == 1
+
+def test_stage_counts_errors_and_drains():
+    pipeline = turbine.Pipeline()
+    inputs = pipeline.queue('inputs', 10, turbine.BLOCK)
+    outputs = pipeline.queue('outputs', 10, turbine.BLOCK)
+    stage = pipeline.stage('invert', lambda x: 1 / x, inputs, outputs)
+    for i in [1, 0, 2, 4]:
+        inputs.put(i)
+    pipeline.start()
+    pipeline.stop(5)
+    assert (stage.processed, stage.errors) == (3, 1)
+    assert [outputs.get(0) for i in range(3)] == [1.0, 0.5, 0.25]
+
+def test_deadline_scheduler_skips_missed_deadlines():
+    now = [0.0]
+    scheduler = turbine.DeadlineScheduler(1.0, clock=lambda: now[0])
+    assert scheduler.wait() and scheduler.deadline == 1.0
+    now[0] = 3.5 # processing overran two deadlines
+    assert scheduler.wait()
+    assert (scheduler.ticks, scheduler.missed, scheduler.deadline) == (2, 2, 4.0)
+    stop = threading.Event()
+    stop.set()
+    assert not scheduler.wait(stop)
@@ -0,0 +1,42 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import os
+import sys
+import pytest
+
+pytest.importorskip('onnx')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+import replay
+
+@pytest.mark.parametrize("wire_format,batch_size", [('csv', 1), ('binary', 5)])
+def test_replay_runs_the_pipeline(wire_format, batch_size):
+    results = replay.replay(replay.synthetic_samples(2000), turbines=2, ticks=3, batch_size=batch_size, wire_format=wire_format)
+    assert results['stages']['tick']['count'] == 3
+    assert results['stages']['ingest']['count'] == 2 * 3 * replay.app.STEP // batch_size
+    assert results['parser']['malformed'] == 0
+    # one window per turbine and tick, plus the first prediction
+    assert results['published']['messages']['inference'] == 2 * 4
+    assert results['throughput']['samples_per_s'] > 0
+
+def test_float32_preprocessing_matches_float64():
+    result = replay.parity(replay.synthetic_samples(3000), turbines=3, ticks=20, batch_size=5, wire_format='binary')
+    assert result['windows'] == 3 * 21
+    assert result['max_rel_diff'] < 1e-3 and result['flags_mismatch'] == 0
+
+def test_replay_with_the_cascade_publishes_every_window():
+    results = replay.replay(replay.synthetic_samples(3000), turbines=2, ticks=10, batch_size=5, wire_format='binary', cascade=True)
+    # the windows skipped by the cascade are published with their last scores
+    assert results['published']['messages']['inference'] == 2 * 11
+    assert results['gateway']['cascade']['checked'] > 0
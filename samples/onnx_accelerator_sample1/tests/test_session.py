@@ -0,0 +1,107 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import numpy as np
+import os
+import pytest
+
+onnx = pytest.importorskip('onnx')
+from onnx import helper, numpy_helper, TensorProto
+import onnxruntime as ort
+
+import turbine
+
+def save_model(path, seed=7):
+    weights = numpy_helper.from_array(np.random.default_rng(seed).standard_normal((600, 600)).astype(np.float32), 'weights')
+    flat = numpy_helper.from_array(np.array([1, 600], dtype=np.int64), 'flat')
+    shape = numpy_helper.from_array(np.array([1, 6, 10, 10], dtype=np.int64), 'shape')
+    graph = helper.make_graph([
+            helper.make_node('Reshape', ['input', 'flat'], ['x']),
+            helper.make_node('MatMul', ['x', 'weights'], ['y']),
+            helper.make_node('Relu', ['y'], ['z']),
+            helper.make_node('Reshape', ['z', 'shape'], ['output'])
+        ], 'test',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, [1, 6, 10, 10])],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, [1, 6, 10, 10])],
+        [weights, flat, shape])
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)], ir_version=8), path)
+
+def test_create_session_reuses_the_optimized_model(tmp_path):
+    model_path = str(tmp_path / 'model.onnx')
+    save_model(model_path)
+    params = {'cache_dir': str(tmp_path / 'cache'), 'intra_op_num_threads': 1}
+    x = np.random.default_rng(8).standard_normal((1, 6, 10, 10)).astype(np.float32)
+    expected = turbine.create_session(model_path, {'graph_optimization_level': 'disable'}).run(None, {'input': x})[0]
+
+    sess = turbine.create_session(model_path, params)
+    assert os.listdir(params['cache_dir']) == [os.path.basename(turbine.session.cached_model_path(params['cache_dir'], model_path))]
+    cached = turbine.create_session(model_path, params)
+    for s in [sess, cached]:
+        np.testing.assert_allclose(s.run(None, {'input': x})[0], expected, rtol=1e-4, atol=1e-4)
+
+def test_create_session_prunes_the_cache(tmp_path):
+    params = {'cache_dir': str(tmp_path / 'cache'), 'cache_size': 1}
+    for i in range(2):
+        model_path = str(tmp_path / ('model%d.onnx' % i))
+        save_model(model_path, seed=i)
+        turbine.create_session(model_path, params)
+    # only the optimized graph of the last model is kept
+    assert os.listdir(params['cache_dir']) == [os.path.basename(turbine.session.cached_model_path(params['cache_dir'], model_path))]
+
+def save_ort_model(model_path, ort_path):
+    options = turbine.session_options({'graph_optimization_level': 'extended'})
+    options.optimized_model_filepath = ort_path
+    options.add_session_config_entry('session.save_model_format', 'ORT')
+    ort.InferenceSession(model_path, sess_options=options)
+
+def test_create_session_prefers_the_ort_model(tmp_path):
+    x = np.random.default_rng(8).standard_normal((1, 6, 10, 10)).astype(np.float32)
+    save_model(str(tmp_path / 'other.onnx'), seed=1)
+    save_ort_model(str(tmp_path / 'other.onnx'), str(tmp_path / 'model.ort'))
+    expected = turbine.create_session(str(tmp_path / 'other.onnx')).run(None, {'input': x})[0]
+    save_model(str(tmp_path / 'model.onnx'), seed=2)
+    output = turbine.create_session(str(tmp_path / 'model.onnx')).run(None, {'input': x})[0]
+    np.testing.assert_allclose(output, expected, rtol=1e-4, atol=1e-4)
+
+def test_create_session_falls_back_to_the_onnx_model(tmp_path):
+    x = np.random.default_rng(8).standard_normal((1, 6, 10, 10)).astype(np.float32)
+    model_path = str(tmp_path / 'model.onnx')
+    save_model(model_path)
+    expected = turbine.create_session(model_path).run(None, {'input': x})[0]
+    (tmp_path / 'model.ort').write_bytes(b'not a model')
+    sess = turbine.create_session(model_path, {'cache_dir': str(tmp_path / 'cache')})
+    np.testing.assert_allclose(sess.run(None, {'input': x})[0], expected, rtol=1e-4, atol=1e-4)
+
+@pytest.mark.parametrize("batch_size", [1, 'batch'])
+def test_bound_runner_matches_run(tmp_path, batch_size):
+    graph = helper.make_graph([helper.make_node('Mul', ['input', 'scale'], ['output'])], 'test',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, [batch_size, 6, 10, 10])],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, [batch_size, 6, 10, 10])],
+        [numpy_helper.from_array(np.array([0.5], dtype=np.float32), 'scale')])
+    model_path = str(tmp_path / 'model.onnx')
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)], ir_version=8), model_path)
+    sess = turbine.create_session(model_path)
+    runner = turbine.BoundRunner(sess, max_batch=5, num_buffers=1)
+    buffers = runner.acquire()
+    assert runner.acquire() is None and runner.busy == 1
+    for n in [3, 5, 3]:
+        buffers.input[:n] = np.random.default_rng(n).standard_normal((n, 6, 10, 10))
+        output = runner.run(buffers, n)[0]
+        # written in place in the preallocated output
+        assert np.shares_memory(output, buffers.outputs[0])
+        np.testing.assert_allclose(output, buffers.input[:n] * 0.5)
+    assert len(buffers.bindings) == 2
+    runner.release(buffers)
+    with pytest.raises(ValueError):
+        runner.run(runner.acquire(), 6)
@@ -0,0 +1,81 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'simulated_device'))
+import simulated_device as device
+
+def run(profiles, blocks, block_size=100, seed=0):
+    engine = device.ScenarioEngine(profiles, np.ones(len(device.SENSOR_COLUMNS)), seed)
+    samples = np.ones((blocks * block_size, len(device.SENSOR_COLUMNS)))
+    changed = np.concatenate([engine.apply(block) for block in np.split(samples, blocks)])
+    return samples, changed, engine
+
+def test_scenarios_are_reproduced_by_their_seed():
+    profiles = dict((name, dict(profile, rate=0.01)) for name, profile in device.PROFILES.items())
+    samples, changed, engine = run(profiles, 20)
+    assert all(count > 0 for count in engine.events.values())
+    assert changed.any() and not changed.all()
+    np.testing.assert_array_equal(samples[~changed], 1)
+    np.testing.assert_array_equal(run(profiles, 20)[0], samples)
+    assert not np.array_equal(run(profiles, 20, seed=1)[0], samples)
+    assert not run({}, 5)[1].any()
+
+def test_events_span_consecutive_blocks():
+    samples, changed, engine = run({'dropout': dict(device.PROFILES['dropout'], rate=0.005, duration=30)}, 40, block_size=25)
+    voltage = samples[:, device.VOLTAGE]
+    np.testing.assert_array_equal(np.delete(samples, device.VOLTAGE, axis=1), 1)
+    np.testing.assert_array_equal(voltage == 0, changed)
+    # lengths of the runs of zeros: at least one event each, except at the end
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], changed.astype(int), [0]])))
+    lengths = edges[1::2] - edges[::2]
+    assert engine.events['dropout'] > 1
+    assert (lengths[:-1] >= 30).all() and lengths.sum() <= 30 * engine.events['dropout']
+
+def test_drift_grows_up_to_its_magnitude():
+    samples, changed, engine = run({'drift': dict(device.PROFILES['drift'], rate=0.001, duration=50, magnitude=4.0)}, 30, block_size=64)
+    assert engine.events['drift'] > 0
+    rows, cols = np.nonzero(samples != 1)
+    offsets = np.abs(samples[rows, cols] - 1)
+    assert offsets.max() <= 4.0 + 1e-9
+    np.testing.assert_allclose(np.sort(offsets)[:1], [4.0 / 50])
+
+def test_overlapping_drifts_add_up():
+    # an event starts at every sample of the single sensor, up to 5 of them overlap
+    engine = device.ScenarioEngine({'drift': dict(device.PROFILES['drift'], rate=1.0, duration=5, magnitude=5.0)}, np.ones(1), seed=3)
+    samples = np.ones((50, 1))
+    engine.apply(samples)
+    # same draws as the engine: starts, sensors, signs
+    rng = np.random.default_rng(3)
+    rng.random(50)
+    rng.integers(1, size=50)
+    signs = rng.choice([-1.0, 1.0], size=50)
+    expected = [1 + sum(signs[s] * (r - s + 1) for s in range(max(r - 4, 0), r + 1)) for r in range(50)]
+    np.testing.assert_allclose(samples[:, 0], expected)
+
+def test_default_scenario_matches_the_former_noise():
+    profiles = dict((name, device.PROFILES[name]) for name in device.DEFAULT_SCENARIO)
+    samples, changed, engine = run(profiles, 100, block_size=1000)
+    # events per sample: radians 1/50, wind 1/20, voltage 1/50
+    for name, rate in (('radians_noise', 1 / 50), ('wind_noise', 1 / 20), ('voltage_noise', 1 / 50)):
+        assert abs(engine.events[name] / len(samples) - rate) < 0.1 * rate
+    # the four quaternion sensors are overwritten together, out of the unit range
+    quaternion = samples[:, device.QUATERNION]
+    noisy = (quaternion != 1).any(axis=1)
+    assert ((quaternion[noisy] != 1).all(axis=1)).mean() > 0.99 and quaternion.max() < 10
+    assert (np.delete(samples, device.QUATERNION + [device.WIND, device.VOLTAGE], axis=1) == 1).all()
+    assert samples[:, device.VOLTAGE].max() > 100
@@ -0,0 +1,83 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import numpy as np
+import pytest
+
+import turbine
+
+NUM_FEATURES = 6
+
+class FakeRunner(object):
+    '''
+        Same interface as turbine.BoundRunner, the model outputs zeros
+    '''
+    output_names = ['output']
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.buffers = turbine.IOBuffers((4, NUM_FEATURES, 10, 10), np.float32, [(4, NUM_FEATURES, 10, 10)], [np.float32])
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+        return self.buffers
+
+    def release(self, buffers):
+        self.acquired -= 1
+
+    def run(self, buffers, n):
+        if self.fail:
+            raise RuntimeError('model failure')
+        return [buffers.outputs[0][:n]]
+
+def statistics(thresholds):
+    return turbine.Statistics(thresholds=np.full(NUM_FEATURES, thresholds), raw_std=np.full(NUM_FEATURES, 0.01), mean=np.zeros(NUM_FEATURES),
+        std=np.ones(NUM_FEATURES), model_name=None, model_version=None, model_sha256=None)
+
+def runner_holder(*runners):
+    holder = turbine.ModelHolder(lambda path: None, None)
+    for version, (runner, stats) in enumerate(runners):
+        holder.previous, holder.current = holder.current, turbine.Model(None, 'windturbine', str(version), runner, stats)
+    return holder
+
+def filled_gateway():
+    gateway = turbine.Gateway(500, NUM_FEATURES, np.full(NUM_FEATURES, 0.01))
+    gateway.extend(None, np.random.default_rng(0).normal(0, 1, (500, NUM_FEATURES)))
+    return gateway
+
+def test_preprocess_waits_for_the_model():
+    stages = turbine.DetectionStages(runner_holder(), filled_gateway(), statistics(0.0), 100, 10)
+    assert stages.preprocess() is None
+
+def test_infer_uses_the_statistics_of_the_model():
+    baked_in = statistics(1e6)
+    runner = FakeRunner()
+    # the reconstruction is zeros: the scores are the mean absolute normalized values
+    for model_statistics, flagged in ((None, False), (statistics(0.0), True)):
+        stages = turbine.DetectionStages(runner_holder((runner, model_statistics)), filled_gateway(), baked_in, 100, 10)
+        [(anomalies, scores, name, version, ts, turbine_id)] = stages.infer(stages.preprocess())
+        assert (name, version, turbine_id) == ('windturbine', '0', None)
+        assert (scores > 0).all() and anomalies.all() == flagged and anomalies.any() == flagged
+        assert runner.acquired == 0
+
+def test_infer_rolls_back_a_failing_model():
+    good, bad = FakeRunner(), FakeRunner(fail=True)
+    holder = runner_holder((good, None), (bad, None))
+    stages = turbine.DetectionStages(holder, filled_gateway(), statistics(1e6), 100, 10)
+    item = stages.preprocess()
+    with pytest.raises(RuntimeError):
+        stages.infer(item)
+    assert bad.acquired == 0
+    assert holder.get().runner is good and holder.rollbacks == 1
@@ -0,0 +1,89 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import os
+import sys
+import numpy as np
+import pytest
+
+import turbine
+
+STATISTICS_DIR = os.path.join(os.path.dirname(__file__), '..', 'edge_application', 'statistics')
+
+class FakeSession(object):
+    def run(self, outputs, feeds):
+        return [feeds['input'] * 0.5]
+
+def write_model(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+    return str(path)
+
+def test_bundle_roundtrip(tmp_path):
+    model_path = write_model(tmp_path / 'windturbine.onnx', b'model v1')
+    statistics = turbine.load_statistics(STATISTICS_DIR)
+    assert turbine.bundle_path(model_path) is None
+    turbine.save_bundle(str(tmp_path / 'windturbine.stats'), statistics, model_path, 'windturbine', 7)
+    assert turbine.bundle_path(model_path) == str(tmp_path / 'windturbine.stats')
+
+    bundle = turbine.load_model_statistics(model_path)
+    assert (bundle.model_name, bundle.model_version) == ('windturbine', '7')
+    for name in turbine.STATISTICS_NAMES:
+        np.testing.assert_array_equal(getattr(bundle, name), getattr(statistics, name))
+    # views of the memory map
+    assert not bundle.mean.flags.writeable and not bundle.mean.flags.owndata
+    assert turbine.load_model_statistics(model_path, np.float32).std.dtype == np.float32
+
+    # built for another model
+    write_model(model_path, b'model v2')
+    with pytest.raises(ValueError):
+        turbine.load_model_statistics(model_path)
+    # corrupted
+    data = bytearray((tmp_path / 'windturbine.stats').read_bytes())
+    data[-1] ^= 0xff
+    (tmp_path / 'windturbine.stats').write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        turbine.load_bundle(str(tmp_path / 'windturbine.stats'))
+
+def test_build_bundle_is_read_by_the_edge(tmp_path):
+    pytest.importorskip('onnx')
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'onnxacceleratorsampleone', 'without_ggv2'))
+    import model_optimization
+    model_path = write_model(tmp_path / 'windturbine.onnx', b'model')
+    path = model_optimization.save_statistics_bundle(model_path, STATISTICS_DIR, 'windturbine', 3)
+    assert path == str(tmp_path / 'windturbine.stats')
+    bundle = turbine.load_model_statistics(model_path)
+    assert bundle.model_version == '3'
+    np.testing.assert_array_equal(bundle.thresholds, np.load(os.path.join(STATISTICS_DIR, 'thresholds.npy')))
+
+def test_model_holder_swaps_the_statistics_with_the_model(tmp_path):
+    statistics = turbine.load_statistics(STATISTICS_DIR)
+    paths = {}
+    for version in [1, 2]:
+        paths[version] = write_model(tmp_path / ('v%d.onnx' % version), b'model %d' % version)
+        turbine.save_bundle(str(tmp_path / ('v%d.stats' % version)), statistics._replace(thresholds=statistics.thresholds * version),
+            paths[version], 'windturbine', version)
+    paths[3] = write_model(tmp_path / 'v3.onnx', b'model 3')
+    os.rename(tmp_path / 'v2.stats', tmp_path / 'v3.stats') # statistics of another model
+    paths[4] = write_model(tmp_path / 'v4.onnx', b'model 4') # no statistics
+
+    holder = turbine.ModelHolder(lambda path: FakeSession(), np.ones((1, 6, 10, 10), dtype=np.float32),
+        statistics_loader=turbine.load_model_statistics)
+    assert holder.load(paths[1], 'windturbine', '1')
+    np.testing.assert_array_equal(holder.get().statistics.thresholds, statistics.thresholds)
+    current = holder.get()
+    assert not holder.load(paths[3], 'windturbine', '3')
+    assert holder.get() is current and holder.stats()['statistics'] == '1'
+    assert holder.load(paths[4], 'windturbine', '4')
+    assert holder.get().statistics is None
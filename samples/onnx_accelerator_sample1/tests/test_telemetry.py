@@ -0,0 +1,66 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import numpy as np
+import pytest
+
+import turbine
+
+FEATURES_IDX = [6,7,8,5,3,2,4]
+NUM_RAW_FEATURES = 20
+
+def sample(i):
+    return ['%d' % (1000 + i), '512'] + ['%.4f' % (i + k / 100) for k in range(NUM_RAW_FEATURES - 2)]
+
+def test_parser_converts_the_used_columns_of_csv():
+    parser = turbine.TelemetryParser(FEATURES_IDX, NUM_RAW_FEATURES)
+    payload = '\n'.join(','.join(sample(i)) for i in range(3))
+    for data in (payload, payload.encode('utf-8')):
+        raw, rows = parser.parse(data)
+        assert raw.shape == (3, len(FEATURES_IDX))
+        np.testing.assert_array_equal(raw, [[float(sample(i)[k]) for k in FEATURES_IDX] for i in range(3)])
+        # the fields are kept as received, for the raw data logs
+        assert rows == [sample(i) for i in range(3)]
+    assert (parser.parsed, parser.malformed) == (6, 0)
+
+@pytest.mark.parametrize("line,wrong_length,invalid", [
+    ('1,2,3', 1, 0), # short sample
+    (','.join(sample(0) + ['1.0']), 1, 0), # extra column
+    ('', 1, 0),
+    (','.join(sample(0)[:FEATURES_IDX[0]] + ['nan?'] + sample(0)[FEATURES_IDX[0] + 1:]), 0, 1)])
+def test_parser_rejects_malformed_samples(line, wrong_length, invalid):
+    parser = turbine.TelemetryParser(FEATURES_IDX, NUM_RAW_FEATURES)
+    raw, rows = parser.parse('\n'.join([','.join(sample(1)), line, ','.join(sample(2))]))
+    # the valid samples around it are kept, in order
+    assert rows == [sample(1), sample(2)]
+    np.testing.assert_array_equal(raw[:, 0], [float(sample(1)[FEATURES_IDX[0]]), float(sample(2)[FEATURES_IDX[0]])])
+    assert (parser.parsed, parser.wrong_length, parser.invalid, parser.malformed) == (2, wrong_length, invalid, wrong_length + invalid)
+
+def test_parser_rejects_truncated_binary_payloads():
+    parser = turbine.TelemetryParser(FEATURES_IDX, NUM_RAW_FEATURES)
+    payload = turbine.encode_binary(np.ones((2, NUM_RAW_FEATURES)))
+    raw, rows = parser.parse(payload[:-3])
+    assert len(raw) == 0 and rows == []
+    assert (parser.parsed, parser.wrong_length) == (0, 1)
+
+def test_parser_counters_are_exported():
+    metrics = turbine.Metrics()
+    parser = turbine.TelemetryParser(FEATURES_IDX, NUM_RAW_FEATURES, metrics)
+    # the last column isn't used by the model, it isn't converted
+    parser.parse('\n'.join([','.join(sample(0)), '1,2', ','.join(sample(1)[:-1] + ['x'])]))
+    parser.parse(','.join(sample(2)))
+    text = metrics.render()
+    assert 'windturbine_samples_parsed_total 3.0' in text
+    assert 'windturbine_samples_malformed_total 1.0' in text
+    assert 'windturbine_parse_seconds_count 2' in text
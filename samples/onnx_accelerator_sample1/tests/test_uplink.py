@@ -0,0 +1,134 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import importlib.util
+import json
+import os
+import threading
+import pytest
+
+import turbine
+from turbine import uplink
+
+LAMBDA_PATH = os.path.join(os.path.dirname(__file__), '..', 'functions', 'edgeapplogs', 'src', 'lambda.py')
+
+def tokens(count, turbine_id=None):
+    result = []
+    for i in range(count):
+        token = {'ts': '2023-01-01T00:00:%02d.000+00:00' % (i % 60), 'values': ['%d' % i, '0.5', '%.4f' % (i / 7)]}
+        if turbine_id is not None:
+            token['turbine_id'] = '%s%d' % (turbine_id, i % 2)
+        result.append(token)
+    return result
+
+@pytest.mark.parametrize("turbine_id", [None, 'T'])
+def test_batch_round_trip(turbine_id):
+    batch = tokens(50, turbine_id)
+    message = json.loads(turbine.encode_batch(batch))
+    assert (message['type'], message['count']) == (turbine.RAW_BATCH_TYPE, 50)
+    decoded = turbine.decode_batch(message)
+    assert [t['ts'] for t in decoded] == [t['ts'] for t in batch]
+    assert [t.get('turbine_id') for t in decoded] == [t.get('turbine_id') for t in batch]
+    assert [t['values'] for t in decoded] == [t['values'] for t in batch]
+    assert len(turbine.encode_batch(batch)) < sum(len(json.dumps({'type': 'rawdata', 'data': t})) for t in batch) / 3
+
+def test_large_batches_are_split():
+    payloads = turbine.encode_batches(tokens(1000), max_size=4000)
+    assert len(payloads) > 1 and all(len(p) <= 4000 for p in payloads)
+    assert sum(len(turbine.decode_batch(json.loads(p))) for p in payloads) == 1000
+
+def test_batch_publisher_flushes_on_size_and_age():
+    now = [0.0]
+    published = []
+    publisher = turbine.BatchPublisher(published.append, max_samples=10, max_delay=1.0, clock=lambda: now[0])
+    for token in tokens(25):
+        publisher.add(token)
+    assert [json.loads(p)['count'] for p in published] == [10, 10]
+    publisher.poll()
+    assert len(published) == 2 # the last 5 samples are not late yet
+    now[0] = 1.5
+    publisher.poll()
+    assert json.loads(published[-1])['count'] == 5
+    publisher.add(tokens(1)[0])
+    publisher.flush()
+    assert publisher.stats() == {'samples': 26, 'messages': 4, 'bytes': sum(map(len, published)), 'errors': 0, 'waiting': 0}
+
+def test_idle_stage_publishes_late_batches():
+    pipeline = turbine.Pipeline()
+    logs = pipeline.queue('logs', 100, turbine.BLOCK)
+    published = threading.Event()
+    publisher = turbine.BatchPublisher(lambda payload: published.set(), max_samples=100, max_delay=0.05)
+    stage = pipeline.stage('publish_logs', publisher.add, logs, idle=publisher.poll, idle_interval=0.01)
+    pipeline.start()
+    logs.put(tokens(1)[0])
+    assert published.wait(5)
+    pipeline.stop(5)
+    assert not stage.thread.is_alive()
+    assert publisher.stats()['messages'] == 1
+
+def load_lambda(monkeypatch):
+    pytest.importorskip('boto3')
+    for name in ['LOG_GROUP_NAME', 'LOG_STREAM_RAW_DATA_NAME', 'LOG_STREAM_INFERENCE_NAME', 'LOG_STREAM_METRICS_NAME']:
+        monkeypatch.setenv(name, name.lower())
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    spec = importlib.util.spec_from_file_location('edgeapplogs', LAMBDA_PATH)
+    handler = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(handler)
+    return handler
+
+def test_lambda_expands_batches(monkeypatch):
+    handler = load_lambda(monkeypatch)
+    calls = []
+    monkeypatch.setattr(handler.logs_client, 'put_log_events', lambda **kwargs: calls.append(kwargs))
+
+    batch = tokens(3, 'T')
+    handler.handler(dict(json.loads(turbine.encode_batch(batch)), clientid='device'), None)
+    handler.handler({'type': 'rawdata', 'data': batch[1], 'clientid': 'device'}, None)
+    assert len(calls) == 2 and calls[0]['logStreamName'] == 'log_stream_raw_data_name'
+    messages = [e['message'] for e in calls[0]['logEvents']]
+    assert messages[1].split(' ')[:2] == calls[1]['logEvents'][0]['message'].split(' ')[:2] == [batch[1]['ts'], 'device/T1']
+    assert messages[1] == calls[1]['logEvents'][0]['message']
+
+def test_batch_publisher_counts_the_published_samples_only(monkeypatch):
+    split_batch = uplink.split_batch
+    monkeypatch.setattr(uplink, 'split_batch', lambda tokens, max_size=2000: split_batch(tokens, max_size))
+    metrics = turbine.Metrics()
+    published, calls = [], []
+    def publish(payload):
+        calls.append(payload)
+        # the second message of the split batch fails
+        if len(calls) == 2:
+            raise IOError('connection lost')
+        published.append(payload)
+    publisher = turbine.BatchPublisher(publish, max_samples=1000, metrics=metrics)
+    batch = tokens(1000)
+    for token in batch:
+        publisher.add(token)
+    counts = [count for count, payload in split_batch(batch, 2000)]
+    assert len(counts) > 2 and sum(counts) == 1000
+    stats = publisher.stats()
+    assert stats['errors'] == 1 and stats['messages'] == len(counts) - 1
+    assert stats['samples'] == 1000 - counts[1] == sum(len(turbine.decode_batch(json.loads(p))) for p in published)
+    assert 'uplink_errors_total 1' in metrics.render()
+
+def test_lambda_chunks_within_the_put_log_events_limits(monkeypatch):
+    handler = load_lambda(monkeypatch)
+    # 26 bytes of overhead per event: 1022 events of 1000 bytes fit in a call
+    items = [{'timestamp': 0, 'message': 'x' * 1000} for i in range(2500)]
+    assert [len(c) for c in handler.log_events_chunks(items)] == [1022, 1022, 456]
+    items = [{'timestamp': 0, 'message': 'x'} for i in range(25000)]
+    assert [len(c) for c in handler.log_events_chunks(items)] == [10000, 10000, 5000]
+    # multi-byte characters count for their utf8 size
+    items = [{'timestamp': 0, 'message': '\u00e9' * 500} for i in range(1100)]
+    assert [len(c) for c in handler.log_events_chunks(items)] == [1022, 78]
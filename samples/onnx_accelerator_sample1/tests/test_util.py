@@ -0,0 +1,173 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+
+import turbine
+
+def create_dataset_loop(X, time_steps=1, step=1):
+    Xs = []
+    for i in range(0, len(X) - time_steps, step):
+        Xs.append(X[i:(i + time_steps)])
+    return np.array(Xs)
+
+@pytest.mark.parametrize("num_samples", [101, 110, 111, 500])
+def test_create_dataset_matches_loop(num_samples):
+    X = np.random.default_rng(0).standard_normal((num_samples, 6))
+    np.testing.assert_array_equal(turbine.create_dataset(X, 100, 10), create_dataset_loop(X, 100, 10))
+
+def test_create_model_input_layout():
+    X = np.random.default_rng(1).standard_normal((500, 6))
+    expected = create_dataset_loop(X, 100, 10)
+    expected = np.transpose(expected, (0, 2, 1)).reshape(expected.shape[0], 6, 10, 10).astype(np.float32)
+
+    out = np.empty((64, 6, 10, 10), dtype=np.float32)
+    x = turbine.create_model_input(X, 100, 10, out=out)
+    assert np.shares_memory(x, out)
+    np.testing.assert_array_equal(x, expected)
+
+def test_euler_from_quaternion_batch_matches_scalar():
+    # out of range components exercise the pitch clamping
+    q = np.random.default_rng(2).uniform(-1.5, 1.5, (1000, 4))
+    expected = np.array([turbine.euler_from_quaternion(*i) for i in q])
+    np.testing.assert_allclose(turbine.euler_from_quaternion_batch(q[:,0], q[:,1], q[:,2], q[:,3]), expected, atol=1e-12)
+
+def test_ring_buffer_extend_matches_append():
+    rng = np.random.default_rng(4)
+    batched = turbine.RingBuffer(7, 3)
+    single = turbine.RingBuffer(7, 3)
+    for count in [1, 3, 0, 9, 6, 20, 2]:
+        chunk = rng.standard_normal((count, 3))
+        batched.extend(chunk)
+        for sample in chunk:
+            single.append(sample)
+        assert (batched.total, batched.dropped, len(batched)) == (single.total, single.dropped, len(single))
+        np.testing.assert_array_equal(batched.latest(), single.latest())
+
+def test_telemetry_parser_binary_matches_csv():
+    rng = np.random.default_rng(5)
+    samples = rng.uniform(-1, 1, (4, 20)).astype(np.float32)
+    parser = turbine.TelemetryParser([6,7,8,5,3,2,4], 20)
+    csv = "\n".join(",".join(repr(float(v)) for v in s) for s in samples).encode('utf-8')
+    raw, rows = parser.parse(csv)
+    expected = raw.copy()
+    raw, rows = parser.parse(turbine.encode_binary(samples))
+    assert len(rows) == 4 and parser.parsed == 8
+    np.testing.assert_array_equal(raw, expected)
+    raw, rows = parser.parse(turbine.encode_binary(samples)[:-1])
+    assert len(rows) == 0 and parser.malformed == 1
+
+class FakeSession(object):
+    '''Stand-in for an onnxruntime session: the "reconstruction" is the input * 0.5'''
+    def __init__(self):
+        self.calls = []
+    def run(self, outputs, feeds):
+        self.calls.append(len(feeds['input']))
+        return [feeds['input'] * 0.5]
+
+def test_gateway_batched_scores_match_single_turbine():
+    rng = np.random.default_rng(6)
+    gateway = turbine.Gateway(200, 6, np.full(6, 0.1), max_turbines=5)
+    for i in range(6):
+        gateway.extend('t%d' % i, rng.standard_normal((250, 6)))
+    assert len(gateway) == 5 and gateway.rejected == 250
+    ids, times, x = gateway.prepare_batch(100, 10, np.zeros(6), np.ones(6))
+    sess = FakeSession()
+    values = gateway.scores(x, sess.run(None, {'input': x})[0], len(ids))
+    assert sess.calls == [5] and values.shape == (5, 6)
+    for k in range(5):
+        # the per turbine computation of the single turbine application
+        a = x[k:k+1].reshape(1, 6, 100).transpose((0,2,1))
+        b = a * 0.5
+        np.testing.assert_allclose(values[k], np.mean(np.mean(np.abs(b - a), axis=1).transpose((1,0)), axis=1), rtol=1e-6)
+    # no new samples, nothing to score
+    assert gateway.prepare_batch(100, 10, np.zeros(6), np.ones(6)) == ([], [], None)
+
+def test_gateway_catches_up_the_backlog():
+    rng = np.random.default_rng(7)
+    samples = rng.standard_normal((1000, 6))
+    now = [100.0]
+    gateway = turbine.Gateway(200, 6, np.full(6, 0.1), catch_up=5, clock=lambda: now[0])
+    gateway.extend('t', samples[:250])
+    # buffering isn't a backlog
+    ids, times, x = gateway.prepare_batch(100, 10, np.zeros(6), np.ones(6))
+    assert ids == ['t'] and times == [100.0]
+    # 35 samples in 3.5s: 3 windows, 1s apart, the last one is the regular window
+    gateway.extend('t', samples[250:285])
+    now[0] = 103.5
+    ids, times, x = gateway.prepare_batch(100, 10, np.zeros(6), np.ones(6))
+    assert ids == ['t'] * 3 and np.allclose(times, [100.5, 101.5, 102.5])
+    reference = turbine.Gateway(200, 6, np.full(6, 0.1))
+    reference.extend('t', samples[:285])
+    np.testing.assert_allclose(x[-1], reference.prepare_batch(100, 10, np.zeros(6), np.ones(6))[2][0], atol=1e-9)
+    for i in range(2):
+        np.testing.assert_allclose(x[i].reshape(6, 100)[:, 10:], x[i+1].reshape(6, 100)[:, :90], atol=1e-9)
+    # only the latest windows fit in the batch
+    gateway.extend('t', samples[285:])
+    ids, times, x = gateway.prepare_batch(100, 10, np.zeros(6), np.ones(6), out=np.zeros((2, 6, 10, 10), dtype=np.float32))
+    assert len(ids) == 2 and len(x) == 2
+    assert gateway.stats()['skipped'] == 71 - 2 and gateway.stats()['catch_ups'] == 2
+
+def test_gateway_cascade_skips_unchanged_windows():
+    rng = np.random.default_rng(8)
+    metrics = turbine.Metrics()
+    cascade = turbine.Cascade(np.zeros(6), np.ones(6), np.full(6, 1.0), max_skips=2, metrics=metrics)
+    gateway = turbine.Gateway(200, 6, np.full(6, 0.1), cascade=cascade)
+    gateway.extend('t', rng.normal(0, 0.1, (200, 6)))
+    ids, times, x = gateway.prepare_batch(100, 10, np.zeros(6), np.ones(6))
+    assert ids == ['t'] and gateway.reused_scores() == []
+    gateway.update_scores(ids, np.full((1, 6), 0.2))
+    # same signal: the scores of the last run are reused, up to max_skips times in a row
+    for i in range(3):
+        gateway.extend('t', rng.normal(0, 0.1, (10, 6)))
+        ids, times, x = gateway.prepare_batch(100, 10, np.zeros(6), np.ones(6))
+        reused = gateway.reused_scores()
+        if i < 2:
+            assert x is None and len(reused) == 1 and reused[0][0] == 't'
+            np.testing.assert_allclose(reused[0][2], 0.2)
+        else:
+            assert ids == ['t'] and reused == []
+    gateway.update_scores(ids, np.full((1, 6), 0.2))
+    # change point
+    gateway.extend('t', rng.normal(1, 0.1, (10, 6)))
+    assert gateway.prepare_batch(100, 10, np.zeros(6), np.ones(6))[0] == ['t']
+    # close to the thresholds: always scored
+    gateway.update_scores(['t'], np.full((1, 6), 0.9))
+    gateway.extend('t', rng.normal(0.1, 0.1, (10, 6)))
+    assert gateway.prepare_batch(100, 10, np.zeros(6), np.ones(6))[0] == ['t']
+    assert gateway.stats()['cascade'] == {'checked': 6, 'skipped': 2}
+    assert 'windturbine_cascade_skip_ratio 0.333' in metrics.render()
+
+def test_turbine_imports_its_dependencies_lazily():
+    code = "import sys, turbine; print(sorted(m for m in ('numpy', 'pywt', 'onnxruntime', 'boto3', 'awscrt', 'requests') if m in sys.modules))"
+    app_dir = os.path.join(os.path.dirname(__file__), '..', 'edge_application')
+    assert subprocess.check_output([sys.executable, '-c', code], cwd=app_dir).strip() == b'[]'
+    assert turbine.Gateway.__name__ == 'Gateway' and 'Gateway' in dir(turbine)
+    with pytest.raises(AttributeError):
+        turbine.missing
+
+def test_gateway_noise_sigmas_follow_the_model():
+    samples = np.random.default_rng(9).standard_normal((300, 6))
+    gateway = turbine.Gateway(200, 6, np.full(6, 0.1))
+    reference = turbine.Gateway(200, 6, np.full(6, 0.3))
+    gateway.extend('t', samples[:250])
+    gateway.prepare_batch(100, 10, np.zeros(6), np.ones(6))
+    for g in (gateway, reference):
+        g.extend('t', samples[250:] if g is gateway else samples)
+    x = gateway.prepare_batch(100, 10, np.zeros(6), np.ones(6), noise_sigmas=np.full(6, 0.3))[2]
+    np.testing.assert_allclose(x, reference.prepare_batch(100, 10, np.zeros(6), np.ones(6))[2], atol=1e-9)